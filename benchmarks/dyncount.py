@@ -0,0 +1,137 @@
+"""
+Dynamic instruction count benchmark.
+
+Compiles C programs with several optimization levels, runs them in the MSM
+simulator in debug mode (`msm -d` traces one line per executed instruction) and
+reports how many instructions were executed with each configuration, as well as
+how many of them accessed the frame (`get`/`set`).
+The last configuration is profile-guided: the program is first compiled with
+counters and run once to collect its profile.
+
+Usage:
+```
+python benchmarks/dyncount.py [programs.c ...] [--msm path/to/msm] [--opcodes get set ...]
+```
+Without programs, every file of `benchmarks/programs/` and `examples/` is measured.
+The simulator is built from `msm/msm.c` with `gcc` if `--msm` is not given.
+"""
+import argparse
+import re
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from yacc.codegen import CodeGenerator  # noqa: E402
+from yacc.lexer import Lexer  # noqa: E402
+from yacc.optimizer import Optimizer  # noqa: E402
+from yacc.parser import Parser  # noqa: E402
+from yacc.passes.profile import Profile  # noqa: E402
+from yacc.sema import SemanticAnalyzer  # noqa: E402
+from yacc.source import Source  # noqa: E402
+from yacc.token import TokenType  # noqa: E402
+
+# configuration name: Optimizer options
+CONFIGS: dict[str, dict] = {
+    "-O0": {"level": "0"},
+    "-O1": {"level": "1"},
+    "-O2": {"level": "2"},
+}
+# configuration name: Optimizer options, compiled with the profile of a first run
+PGO_CONFIGS: dict[str, dict] = {
+    "-O2 pgo": {"level": "2"},
+}
+
+TRACE_LINE = re.compile(r"^  MEM\[\d+\] (\w+)")
+
+
+def compile_program(path: Path, optimizer_options: dict) -> str:
+    """Compile a C file to MSM assembly (same pipeline as the CLI)."""
+    source = Source.from_path(str(path))
+    lexer = Lexer(source_code=source)
+    parser = Parser(lexer, source_code=source)
+    sema = SemanticAnalyzer(source_code=source)
+    optimizer = Optimizer(source_code=source, **optimizer_options)
+    codegen = CodeGenerator(to_stdout=True, source_code=source, tail_calls=optimizer.is_enabled("tailcall"), rotate_loops=optimizer.is_enabled("rotate"), thread_jumps=optimizer.is_enabled("jump"), merge_tails=optimizer.is_enabled("tailmerge"), stack_values=optimizer.is_enabled("stack"), frame_base=optimizer.is_enabled("frame"))
+
+    codegen._start()
+    while lexer.T.type != TokenType.TOK_EOF:
+        node = optimizer.optimize_ast(sema.analyze(parser.parse()))
+        codegen.codegen(node, nbVars=sema.symbol_table.nbVars)
+    asm = optimizer.optimize_asm(codegen._finalize())
+    asm.extend(optimizer.finish_asm())
+    return "\n".join(asm.lines()) + "\n"
+
+
+def run_program(msm: Path, asm: str) -> tuple[str, Counter]:
+    """Run assembly in the simulator, return its output and executed opcode counts."""
+    with tempfile.NamedTemporaryFile("w", suffix=".asm", delete=False) as f:
+        f.write(asm)
+        asm_path = f.name
+    try:
+        trace = subprocess.run([str(msm), "-d", asm_path], capture_output=True, text=True, check=True).stdout
+    finally:
+        Path(asm_path).unlink()
+
+    counts: Counter = Counter()
+    output: list[str] = []
+    for line in trace.splitlines():
+        match = TRACE_LINE.match(line)
+        if match:
+            counts[match.group(1)] += 1
+        else:
+            output.append(line)
+    return "\n".join(output), counts
+
+
+def compile_with_profile(msm: Path, path: Path, optimizer_options: dict) -> str:
+    """Compile a C file with the profile collected by running an instrumented build."""
+    instrumented = compile_program(path, {**optimizer_options, "profile_generate": True})
+    # without tracing: the header is printed with `send`, which the trace would split
+    output = subprocess.run([str(msm)], input=instrumented, capture_output=True, text=True, check=True).stdout
+    return compile_program(path, {**optimizer_options, "profile": Profile.parse(output)})
+
+
+def build_msm() -> Path:
+    target = Path(tempfile.gettempdir()) / "yacc-bench-msm"
+    subprocess.run(["gcc", "-O2", "-o", str(target), str(ROOT / "msm" / "msm.c")], check=True)
+    return target
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Count executed MSM instructions per optimizer configuration")
+    ap.add_argument("programs", nargs="*", type=Path, help="C programs to measure")
+    ap.add_argument("--msm", type=Path, default=None, help="Path to the MSM simulator")
+    ap.add_argument("--opcodes", nargs="*", default=["get", "set"], help="Also report the dynamic count of these opcodes (default: get set)")
+    args = ap.parse_args()
+
+    programs = args.programs or sorted((ROOT / "benchmarks" / "programs").glob("*.c")) + sorted((ROOT / "examples").glob("*.c"))
+    msm = args.msm or build_msm()
+
+    names = list(CONFIGS) + list(PGO_CONFIGS)
+    columns = [f"{name}" for name in names] + [f"{name}:{op}" for name in names for op in args.opcodes]
+    print(f"{'program':<20}" + "".join(f"{c:>16}" for c in columns) + f"{'saved':>10}")
+    for path in programs:
+        results = {}
+        for name, optimizer_options in CONFIGS.items():
+            results[name] = run_program(msm, compile_program(path, optimizer_options))
+        for name, optimizer_options in PGO_CONFIGS.items():
+            results[name] = run_program(msm, compile_with_profile(msm, path, optimizer_options))
+
+        reference_output = results[names[0]][0]
+        for name, (output, _) in results.items():
+            if output != reference_output:
+                raise SystemExit(f"{path.name}: output of '{name}' differs from '{names[0]}'")
+
+        totals = [sum(results[name][1].values()) for name in names]
+        per_opcode = [results[name][1][op] for name in names for op in args.opcodes]
+        saved = 1 - totals[-1] / totals[0] if totals[0] else 0
+        print(f"{path.name:<20}" + "".join(f"{v:>16}" for v in totals + per_opcode) + f"{saved:>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+// Sum, weight and fill an array of locals emulated with neighbouring frame slots.
+int sum(int *p, int n) {
+    int i; int s;
+    s = 0;
+    for (i = 0; i < n; i++) { s = s + *(p - i); }
+    return s;
+}
+int weighted(int *p, int n) {
+    int i; int s;
+    s = 0;
+    for (i = n - 1; i >= 0; i--) { s = s + *(p - i) * i; }
+    return s;
+}
+int fill(int *p, int n) {
+    int i;
+    for (i = 0; i < n; i = i + 1) { *(p - i) = i * 3; if (i == 7) break; }
+    return i;
+}
+int pairs(int *p, int n) {
+    int i; int s;
+    s = 0;
+    for (i = 0; i < n - 1; i++) { s = s + *(p - i) * *(p - (i + 1)) - *(p - i); }
+    return s;
+}
+int main() {
+    int a0; int a1; int a2; int a3; int a4; int a5; int a6; int a7; int a8; int a9;
+    int r;
+    a0 = 0; a1 = 0; a2 = 0; a3 = 0; a4 = 0; a5 = 0; a6 = 0; a7 = 0; a8 = 0; a9 = 0;
+    debug fill(&a0, 10);
+    for (r = 0; r < 20; r++) { debug sum(&a0, 10); debug weighted(&a0, 10); debug pairs(&a0, 10); }
+    return 0;
+}
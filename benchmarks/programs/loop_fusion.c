@@ -0,0 +1,26 @@
+// Back-to-back loops over the same range that compute independent statistics.
+int main() {
+    int n;
+    int i;
+    int sum;
+    int squares;
+    int odd;
+
+    n = 60;
+    sum = 0;
+    squares = 0;
+    odd = 0;
+    for (i = 0; i < n; i++) {
+        sum = sum + i;
+    }
+    for (i = 0; i < n; i++) {
+        squares = squares + i * i;
+    }
+    for (i = 0; i < n; i++) {
+        odd = odd + i % 2;
+    }
+    debug sum;
+    debug squares;
+    debug odd;
+    return 0;
+}
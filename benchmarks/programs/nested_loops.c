@@ -0,0 +1,20 @@
+// Nested counted loops whose bodies recompute values that only depend on
+// the outer loop or on variables the loops never write.
+int main() {
+    int n;
+    int scale;
+    int total;
+    int row;
+    int col;
+
+    n = 12;
+    scale = 3;
+    total = 0;
+    for (row = 0; row < n; row++) {
+        for (col = 0; col < n * 2 - 1; col++) {
+            total = total + row * scale + n * 4 + col;
+        }
+    }
+    debug total;
+    return 0;
+}
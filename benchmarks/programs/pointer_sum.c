@@ -0,0 +1,39 @@
+// Sum a few frame slots through a pointer parameter, indexed by the loop counter.
+int sum(int *values, int count) {
+    int i;
+    int total;
+
+    total = 0;
+    for (i = 0; i < count; i++) {
+        total = total + *(values - i);
+    }
+    return total;
+}
+
+int main() {
+    int a;
+    int b;
+    int c;
+    int d;
+    int e;
+    int f;
+    int g;
+    int h;
+    int round;
+    int total;
+
+    a = 1;
+    b = 2;
+    c = 3;
+    d = 4;
+    e = 5;
+    f = 6;
+    g = 7;
+    h = 8;
+    total = 0;
+    for (round = 0; round < 40; round++) {
+        total = total + sum(&a, 8);
+    }
+    debug total;
+    return 0;
+}
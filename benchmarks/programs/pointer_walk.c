@@ -0,0 +1,25 @@
+// Walk a few frame slots through a pointer, many times over.
+int main() {
+    int a;
+    int b;
+    int c;
+    int d;
+    int *first;
+    int pass;
+    int offset;
+    int sum;
+
+    a = 1;
+    b = 2;
+    c = 3;
+    d = 4;
+    sum = 0;
+    for (pass = 0; pass < 50; pass++) {
+        for (offset = 0; offset < 4; offset++) {
+            first = &a;
+            sum = sum + *(first - offset);
+        }
+    }
+    debug sum;
+    return 0;
+}
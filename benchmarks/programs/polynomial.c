@@ -0,0 +1,24 @@
+// Evaluate a polynomial with Horner's scheme for many inputs.
+int main() {
+    int c0;
+    int c1;
+    int c2;
+    int c3;
+    int x;
+    int acc;
+    int checksum;
+
+    c0 = 7;
+    c1 = -3;
+    c2 = 2;
+    c3 = 1;
+    checksum = 0;
+    x = -20;
+    do {
+        acc = ((c3 * x + c2) * x + c1) * x + c0;
+        checksum = (checksum + acc % 1000 + c3 * c2 * 10) % 100000;
+        x++;
+    } while (x <= 20);
+    debug checksum;
+    return 0;
+}
@@ -0,0 +1,29 @@
+// Count primes below a limit with trial division.
+int is_prime(int value) {
+    int divisor;
+    if (value < 2) {
+        return 0;
+    }
+    for (divisor = 2; divisor * divisor <= value; divisor++) {
+        if (value % divisor == 0) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+int main() {
+    int limit;
+    int count;
+    int candidate;
+
+    limit = 300;
+    count = 0;
+    candidate = 0;
+    while (candidate < limit) {
+        count = count + is_prime(candidate);
+        candidate++;
+    }
+    debug count;
+    return 0;
+}
@@ -93,21 +93,16 @@ lbl_t *label(const char *name) {
 	return res;
 }
 
-int main(int argc, char *argv[]) {
-	int N = 1 << 16, dbg = 0, i;
-	int *mem, pc, sp, bp;
-	FILE *file = stdin;
-	argc--, argv++;
-	while (argc > 0) {
-		     if (!strcmp(argv[0], "-d")) dbg++;
-		else if (!strcmp(argv[0], "-m")) N = 1 << 24;
-		else if ((file = fopen(argv[0], "r")) == 0)
-			error(-1, "cannot open input file");
-		argc--, argv++;
-	}
-	if (!(mem = malloc(sizeof(int) * N)))
-		error(-1, "not enough memory");
-	pc = 1; memset(mem, 0, sizeof(int) * N);
+/* 32-bit little-endian word */
+static
+int word(const unsigned char *b) {
+	return (int)((unsigned)b[0] | (unsigned)b[1] << 8 | (unsigned)b[2] << 16 | (unsigned)b[3] << 24);
+}
+
+/* Load an assembly program: return the address of start. */
+static
+int loadtxt(FILE *file, int *mem) {
+	int pc = 1, i;
 	do {
 		int lno = 0;
 		while (!feof(file)) {
@@ -168,6 +163,58 @@ int main(int argc, char *argv[]) {
 	} while (0);
 	if ((pc = label("start")->addr) < 0)
 		error(-1, "start not defined");
+	return pc;
+}
+
+/* Load a pre-assembled program (yacc --emit binary), whose first byte was read:
+ * after the magic "\x7fMSM", a header with the format version, the size of the
+ * code (first free address) and the address of start, then the code words
+ * mem[1] .. mem[size - 1], already resolved. All are 32-bit little-endian.
+ * Return the address of start. */
+static
+int loadbin(FILE *file, int *mem, int N) {
+	unsigned char hdr[15], *b;
+	int size, start, i;
+	if (fread(hdr, 1, sizeof(hdr), file) != sizeof(hdr) || memcmp(hdr, "MSM", 3))
+		error(-1, "invalid binary program");
+	if (word(hdr + 3) != 1)
+		error(-1, "unsupported binary program version");
+	size = word(hdr + 7); start = word(hdr + 11);
+	if (size < 1 || size > N)
+		error(-1, "invalid program size");
+	if (start < 1 || start >= size)
+		error(-1, "start not defined");
+	if (fread(mem + 1, sizeof(int), size - 1, file) != (size_t)(size - 1))
+		error(-1, "truncated binary program");
+	for (i = 1; i < size; i++) {
+		b = (unsigned char *)&mem[i];
+		mem[i] = word(b);
+	}
+	mem[0] = size;
+	return start;
+}
+
+int main(int argc, char *argv[]) {
+	int N = 1 << 16, dbg = 0, i;
+	int *mem, pc, sp, bp;
+	FILE *file = stdin;
+	argc--, argv++;
+	while (argc > 0) {
+		     if (!strcmp(argv[0], "-d")) dbg++;
+		else if (!strcmp(argv[0], "-m")) N = 1 << 24;
+		else if ((file = fopen(argv[0], "rb")) == 0)
+			error(-1, "cannot open input file");
+		argc--, argv++;
+	}
+	if (!(mem = malloc(sizeof(int) * N)))
+		error(-1, "not enough memory");
+	memset(mem, 0, sizeof(int) * N);
+	if ((i = fgetc(file)) == 0x7f) {
+		pc = loadbin(file, mem, N);
+	} else {
+		ungetc(i, file);
+		pc = loadtxt(file, mem);
+	}
 	sp = N; bp = N;
 	while (1) {
 		const int tp = sp, nx = sp + 1;
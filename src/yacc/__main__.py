@@ -2,15 +2,21 @@ import argparse
 
 from .source import Source
 from .token import TokenType
+from .node import Node, NodeType
 
 from .lexer import Lexer
 from .parser import Parser
 from .sema import SemanticAnalyzer
 from .optimizer import Optimizer
 from .codegen import CodeGenerator
+from .ir.lower import lower_function
+from .ir.verify import verify_ir
+from .passes.peephole import RuleDatabase
+from .passes.profile import Profile
 
 from .utils.errors import CompilationError
 from .utils.logger import Logger
+from .utils.writer import AssemblyWriter, BinaryWriter
 
 def main():
     """
@@ -28,18 +34,73 @@ def main():
     lexer = Lexer(source_code=args.source_code, verbose=verbose)
     parser = Parser(lexer, source_code=args.source_code, verbose=verbose)
     sema = SemanticAnalyzer(source_code=args.source_code, verbose=verbose)
-    optimizer = Optimizer(source_code=args.source_code, verbose=verbose)
-    codegen = CodeGenerator(to_stdout=args.to_stdout, output_path=args.output, source_code=args.source_code, verbose=verbose)
-
-    codegen._start()
-    while lexer.T.type != TokenType.TOK_EOF:
-        A = parser.parse()
-        A = sema.analyze(A)
-        A = optimizer.optimize_ast(A)
-        codegen.codegen(A, nbVars=sema.symbol_table.nbVars)
-    asm = codegen._finalize()
-    asm = optimizer.optimize_asm(asm)
-    codegen._output(asm)
+    optimizer = args.optimizer
+    optimizer.source_code = args.source_code
+    optimizer.verbose = verbose
+    # the code of each function is written as soon as it is generated (with --emit ir, the IR is output instead)
+    emit_ir = args.emit == "ir"
+    writer_class = BinaryWriter if args.emit == "binary" else AssemblyWriter
+    writer = None if emit_ir else writer_class(args.output, args.to_stdout, transform=optimizer.optimize_asm)
+    codegen = CodeGenerator(to_stdout=args.to_stdout, output_path=args.output, source_code=args.source_code, verbose=verbose, tail_calls=optimizer.is_enabled("tailcall"), rotate_loops=optimizer.is_enabled("rotate"), thread_jumps=optimizer.is_enabled("jump"), merge_tails=optimizer.is_enabled("tailmerge"), stack_values=optimizer.is_enabled("stack"), frame_base=optimizer.is_enabled("frame"), use_ir=args.via_ir, writer=writer)
+
+    try:
+        codegen._start()
+        ir_dump: list[str] = []
+        if args.whole_program:
+            # buffer every function to optimize the program as a whole
+            program: list[Node] = []
+            while lexer.T.type != TokenType.TOK_EOF:
+                program.append(sema.analyze(parser.parse()))
+            for A in optimizer.optimize_program(program):
+                codegen.codegen(A)
+                if emit_ir:
+                    ir_dump.extend(dump_ir(A))
+            if optimizer.specialized_functions and (args.pass_stats or verbose):
+                Logger.log(f"Specialized functions: {', '.join(optimizer.specialized_functions)}\n")
+            if optimizer.removed_functions and (args.pass_stats or verbose):
+                Logger.log(f"Removed unreachable functions: {', '.join(optimizer.removed_functions)}\n")
+        else:
+            while lexer.T.type != TokenType.TOK_EOF:
+                A = parser.parse()
+                A = sema.analyze(A)
+                A = optimizer.optimize_ast(A)
+                codegen.codegen(A, nbVars=sema.symbol_table.nbVars)
+                if emit_ir:
+                    ir_dump.extend(dump_ir(A))
+        if optimizer.profile is not None:
+            optimizer.profile.check_complete()
+        asm = codegen._finalize()
+        asm.extend(optimizer.finish_asm())
+        codegen._output(ir_dump if emit_ir else asm)
+    except BaseException:
+        # no partial output file
+        if writer is not None:
+            writer.discard()
+        raise
+
+    if args.pass_stats or verbose:
+        if optimizer.fused_loops:
+            Logger.log(f"Fused loops: {', '.join(optimizer.fused_loops)}\n")
+        if optimizer.memoization is not None and optimizer.memoization.memoized:
+            Logger.log(f"Memoized functions: {', '.join(optimizer.memoization.memoized)}\n")
+        if optimizer.peephole is not None and optimizer.peephole.rewrites:
+            Logger.log(f"Peephole rewrites: {optimizer.peephole.rewrites}\n")
+        if codegen.tail_merging.removed:
+            Logger.log(f"Tail merging: {codegen.tail_merging.removed} instructions removed\n")
+        if optimizer.outlining is not None:
+            outlining = optimizer.outlining
+            Logger.log(f"Code size: {outlining.size_before} -> {outlining.size_after} instructions ({len(outlining.outlined)} outlined subroutines)\n")
+        Logger.log("Optimization passes:")
+        Logger.log(optimizer.pass_manager.report() + "\n")
+
+
+def dump_ir(node: Node | None) -> list[str]:
+    """Textual SSA IR of a function node (nothing for other nodes)."""
+    if node is None or node.type != NodeType.NODE_FUNCTION or not node.children:
+        return []
+    function = lower_function(node)
+    verify_ir(function)
+    return function.dump()
 
 
 def parse_args() -> argparse.Namespace:
@@ -55,6 +116,25 @@ def parse_args() -> argparse.Namespace:
     mx.add_argument("--string", "--str", dest="input_string", default=None, help="Compile code provided as a string")
     mx.add_argument("--stdin", dest="read_stdin", action="store_true", help="Read input code from standard input")
     ap.add_argument("--debug", "--verbose", "-v", dest="debug", action="store_true", help="Enable debug mode (verbose output)")
+    ap.add_argument("--whole-program", dest="whole_program", action="store_true", help="Optimize all functions together (removes functions unreachable from main)")
+    ap.add_argument("-O", dest="opt_level", default="2", choices=sorted(Optimizer.LEVELS), help="Optimization level: -O0, -O1, -O2 (default) or -Os")
+    ap.add_argument("-f", dest="pass_flags", action="append", default=[], metavar="[no-]PASS", help=f"Enable (-fPASS) or disable (-fno-PASS) one optimization pass among: {', '.join(Optimizer.PASSES)}")
+    ap.add_argument("--eval-budget", dest="eval_budget", type=int, default=100_000, metavar="STEPS", help="Maximum number of interpreted AST nodes to evaluate one call at compile time (default: 100000)")
+    ap.add_argument("--unroll-factor", dest="unroll_factor", type=int, default=4, metavar="N", help="Number of copies of the body in partially unrolled loops (default: 4)")
+    ap.add_argument("--unroll-max-size", dest="unroll_max_size", type=int, default=256, metavar="NODES", help="Maximum size of an unrolled loop, in AST nodes (default: 256)")
+    ap.add_argument("--spec-max-clones", dest="spec_max_clones", type=int, default=8, metavar="N", help="Maximum number of functions cloned for constant arguments with --whole-program (default: 8)")
+    ap.add_argument("--emit", dest="emit", default="asm", choices=["asm", "binary", "ir"], help="Output format: MSM assembly (default), pre-assembled MSM program (binary), or SSA IR of every function (ir)")
+    ap.add_argument("--emit-ir", dest="emit", action="store_const", const="ir", help="Same as --emit ir")
+    ap.add_argument("--via-ir", dest="via_ir", action="store_true", help="Generate assembly from the SSA IR instead of directly from the AST")
+    profiling = ap.add_mutually_exclusive_group()
+    profiling.add_argument("--profile-generate", dest="profile_generate", action="store_true", help="Add execution counters to the program, printed when it ends (to be saved as a profile)")
+    profiling.add_argument("--profile-use", dest="profile_use", default=None, metavar="PROFILE", help="Optimize with the execution counts of a profile (output of a program compiled with --profile-generate)")
+    ap.add_argument("--auto-memoize", dest="auto_memoize", action="store_true", help="Cache the results of pure recursive functions in tables in memory")
+    ap.add_argument("--memo-size", dest="memo_size", type=int, default=1024, metavar="ENTRIES", help="Number of entries of the table of each memoized function (default: 1024)")
+    ap.add_argument("--memo-max-words", dest="memo_max_words", type=int, default=16384, metavar="WORDS", help="Memory available for all memo tables, in words (default: 16384)")
+    ap.add_argument("--peephole-rules", dest="peephole_rules", default=None, metavar="RULES", help="Rules of the peephole pass (default: the rules shipped with yacc, found by python -m yacc.superopt)")
+    ap.add_argument("--verify-passes", dest="verify_passes", action="store_true", help="Check the AST after every optimization pass")
+    ap.add_argument("--pass-stats", dest="pass_stats", action="store_true", help="Print the runs, changes and time of every optimization pass to stderr")
     args = ap.parse_args()
 
     # Check that only one input source is given: positional, -i/--input, --string, --stdin
@@ -70,6 +150,30 @@ def parse_args() -> argparse.Namespace:
     if count > 1:
         ap.error("Multiple inputs provided. Provide exactly one of: file (positional), -i/--input, --string, or --stdin.")
 
+    # Read the profile
+    profile = None
+    if args.profile_use is not None:
+        try:
+            profile = Profile.from_path(args.profile_use)
+        except OSError as e:
+            ap.error(f"Cannot read profile '{args.profile_use}': {e.strerror}")
+
+    # Read the peephole rules
+    peephole_rules = None
+    if args.peephole_rules is not None:
+        try:
+            peephole_rules = RuleDatabase.from_path(args.peephole_rules)
+        except OSError as e:
+            ap.error(f"Cannot read peephole rules '{args.peephole_rules}': {e.strerror}")
+
+    # Build the optimizer from the optimization level and the pass flags
+    enable = [flag for flag in args.pass_flags if not flag.startswith("no-")]
+    disable = [flag[3:] for flag in args.pass_flags if flag.startswith("no-")]
+    try:
+        args.optimizer = Optimizer(level=args.opt_level, enable=enable, disable=disable, verify=args.verify_passes, eval_budget=args.eval_budget, unroll_factor=args.unroll_factor, unroll_max_size=args.unroll_max_size, profile_generate=args.profile_generate, profile=profile, auto_memoize=args.auto_memoize, memo_size=args.memo_size, memo_max_words=args.memo_max_words, spec_max_clones=args.spec_max_clones, peephole_rules=peephole_rules)
+    except ValueError as e:
+        ap.error(str(e))
+
     # Determine source of input
     input_path = None
     if args.input_pos is not None:
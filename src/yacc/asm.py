@@ -0,0 +1,154 @@
+from array import array
+from enum import IntEnum
+from typing import Iterable, Iterator
+
+class Opcode(IntEnum):
+    """MSM instructions, numbered like in the simulator (`msm/msm.c`)."""
+    DROP = 0     # drop n: pop n values
+    DUP = 1
+    SWAP = 2
+    PUSH = 3     # push n
+    GET = 4      # get i: push the slot i of the frame
+    SET = 5      # set i: pop into the slot i of the frame
+    READ = 6
+    WRITE = 7
+    ADD = 8
+    SUB = 9
+    MUL = 10
+    DIV = 11
+    MOD = 12
+    NOT = 13
+    AND = 14
+    OR = 15
+    CMPEQ = 16
+    CMPNE = 17
+    CMPLT = 18
+    CMPLE = 19
+    CMPGT = 20
+    CMPGE = 21
+    JUMP = 22    # jump label
+    JUMPT = 23   # jumpt label
+    JUMPF = 24   # jumpf label
+    PREP = 25    # prep label: prepare a call (or push the frame pointer with 'start')
+    CALL = 26    # call n: call with n arguments
+    RET = 27
+    RESN = 28    # resn n: reserve n slots
+    SEND = 29
+    RECV = 30
+    DBG = 31
+    HALT = 32
+
+    LABEL = 255  # not an instruction: '.label' line
+
+    @property
+    def mnemonic(self) -> str:
+        return self.name.lower()
+
+    @classmethod
+    def from_mnemonic(cls, mnemonic: str) -> "Opcode":
+        return cls[mnemonic.upper()]
+
+
+# Instructions whose operand is a label (the others take an integer, if any)
+LABEL_OPERANDS: set[Opcode] = {Opcode.JUMP, Opcode.JUMPT, Opcode.JUMPF, Opcode.PREP, Opcode.LABEL}
+# Instructions whose operand is an integer
+INTEGER_OPERANDS: set[Opcode] = {Opcode.DROP, Opcode.PUSH, Opcode.GET, Opcode.SET, Opcode.CALL, Opcode.RESN}
+
+Instruction = tuple[Opcode, int | str | None]
+
+_OPCODES: dict[int, Opcode] = {opcode.value: opcode for opcode in Opcode}
+
+
+def format_instruction(opcode: Opcode, operand: int | str | None = None) -> str:
+    """Assembly line of an instruction ('.label' for labels)."""
+    if opcode == Opcode.LABEL:
+        return f".{operand}"
+    if operand is None:
+        return opcode.mnemonic
+    return f"{opcode.mnemonic} {operand}"
+
+
+def parse_instruction(line: str) -> Instruction:
+    """Instruction of an assembly line (inverse of `format_instruction`)."""
+    if line.startswith("."):
+        return Opcode.LABEL, line[1:]
+    mnemonic, _, operand = line.strip().partition(" ")
+    opcode = Opcode.from_mnemonic(mnemonic)
+    if not operand:
+        return opcode, None
+    return opcode, operand if opcode in LABEL_OPERANDS else int(operand)
+
+
+class Assembly:
+    """
+    Compact sequence of instructions: opcodes in an array of bytes, and their
+    operands (integers, labels or None) in a parallel list.
+
+    Code generators append instructions with `emit` and `label`, passes work on
+    `Instruction` tuples (`(opcode, operand)`, by index, slice or iteration), and
+    the text is only formatted when the code is output (`lines`).
+    """
+
+    __slots__ = ("opcodes", "operands")
+
+    def __init__(self, instructions: Iterable[Instruction] = ()) -> None:
+        self.opcodes = array("B")
+        self.operands: list[int | str | None] = []
+        self.extend(instructions)
+
+    @classmethod
+    def parse(cls, lines: Iterable[str]) -> "Assembly":
+        """Assembly of text lines (empty lines and comments are skipped)."""
+        code = cls()
+        for line in lines:
+            line = line.split(";", 1)[0].strip()
+            if line:
+                code.emit(*parse_instruction(line))
+        return code
+
+    def emit(self, opcode: Opcode, operand: int | str | None = None) -> None:
+        """Append an instruction."""
+        self.opcodes.append(opcode)
+        self.operands.append(operand)
+
+    def label(self, name: str) -> None:
+        """Append a label."""
+        self.emit(Opcode.LABEL, name)
+
+    def extend(self, instructions: Iterable[Instruction]) -> None:
+        for opcode, operand in instructions:
+            self.emit(opcode, operand)
+
+    def lines(self) -> Iterator[str]:
+        """Assembly text, one line per instruction."""
+        for opcode, operand in self:
+            yield format_instruction(opcode, operand)
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def __iter__(self) -> Iterator[Instruction]:
+        return zip(map(_OPCODES.__getitem__, self.opcodes), self.operands)
+
+    def __getitem__(self, index: int | slice) -> Instruction | list[Instruction]:
+        if isinstance(index, slice):
+            return list(zip(map(_OPCODES.__getitem__, self.opcodes[index]), self.operands[index]))
+        return _OPCODES[self.opcodes[index]], self.operands[index]
+
+    def __setitem__(self, index: slice, instructions: Iterable[Instruction]) -> None:
+        """Replace a slice of the code."""
+        instructions = list(instructions)
+        self.opcodes[index] = array("B", (opcode for opcode, _ in instructions))
+        self.operands[index] = [operand for _, operand in instructions]
+
+    def __delitem__(self, index: slice) -> None:
+        del self.opcodes[index]
+        del self.operands[index]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Assembly):
+            return self.opcodes == other.opcodes and self.operands == other.operands
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Assembly({list(self.lines())})"
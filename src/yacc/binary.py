@@ -0,0 +1,181 @@
+"""
+Pre-assembled MSM programs (`--emit binary`): the memory image that the simulator
+would build from the assembly, loaded without parsing nor resolving labels.
+
+Layout (little-endian):
+```
+header  magic "\\x7fMSM" | version (u32) | size (i32) | entry (i32)
+code    size - 1 words (i32): mem[1] .. mem[size - 1]
+```
+`size` is the first free address (stored in `mem[0]` like for a text program), and
+`entry` the address of the `start` label. Every instruction is its opcode (numbered
+like in `msm/msm.c`) followed by its operand, if any, with labels replaced by their
+address.
+"""
+
+import argparse
+import struct
+import sys
+
+from array import array
+
+from .asm import INTEGER_OPERANDS, LABEL_OPERANDS, Assembly, Opcode
+from .utils.errors import CompilationError
+
+MAGIC = b"\x7fMSM"
+VERSION = 1
+HEADER = struct.Struct("<4sIii")
+WORD = struct.Struct("<i")
+
+ENTRY_LABEL = "start"
+
+
+def _to_bytes(words: array) -> bytes:
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words.tobytes()
+
+
+class Encoder:
+    """
+    Encode a program part by part (e.g. one function at a time).
+
+    Label operands are resolved to the address of their label as soon as it is
+    known: the ones that refer to a label defined later are returned by `finish`,
+    to be patched in the encoded code.
+    """
+
+    def __init__(self) -> None:
+        # address of the next word (the code is loaded from mem[1])
+        self.address = 1
+        self.labels: dict[str, int] = {}
+        # label operands to patch: (address of the operand, label)
+        self.fixups: list[tuple[int, str]] = []
+
+    def encode(self, code: Assembly) -> bytes:
+        """Words of a part of the program."""
+        words = array("i")
+        for opcode, operand in code:
+            if opcode == Opcode.LABEL:
+                if operand in self.labels:
+                    raise CompilationError(f"Label '{operand}' is defined twice")
+                self.labels[operand] = self.address + len(words)
+                continue
+            words.append(opcode)
+            if opcode in LABEL_OPERANDS:
+                target = self.labels.get(operand)
+                if target is None:
+                    self.fixups.append((self.address + len(words), operand))
+                words.append(0 if target is None else target)
+            elif opcode in INTEGER_OPERANDS:
+                words.append(operand)
+        self.address += len(words)
+        return _to_bytes(words)
+
+    def finish(self) -> tuple[bytes, list[tuple[int, int]]]:
+        """Header of the program, and the words to patch: (address, value)."""
+        for _, name in self.fixups:
+            if name not in self.labels:
+                raise CompilationError(f"Undefined label '{name}'")
+        if ENTRY_LABEL not in self.labels:
+            raise CompilationError(f"Undefined label '{ENTRY_LABEL}'")
+        header = HEADER.pack(MAGIC, VERSION, self.address, self.labels[ENTRY_LABEL])
+        return header, [(address, self.labels[name]) for address, name in self.fixups]
+
+
+def offset(address: int) -> int:
+    """Position of the word at `address` in a binary program."""
+    return HEADER.size + WORD.size * (address - 1)
+
+
+def assemble(code: Assembly) -> bytes:
+    """Binary program of a whole assembly program."""
+    encoder = Encoder()
+    program = bytearray(HEADER.size) + encoder.encode(code)
+    header, fixups = encoder.finish()
+    program[:HEADER.size] = header
+    for address, value in fixups:
+        WORD.pack_into(program, offset(address), value)
+    return bytes(program)
+
+
+def disassemble(program: bytes) -> Assembly:
+    """
+    Assembly of a binary program. Labels are named after their address (`L12`),
+    except the entry point (`start`).
+    """
+    if len(program) < HEADER.size:
+        raise ValueError("Not an MSM binary program (too short)")
+    magic, version, size, entry = HEADER.unpack_from(program)
+    if magic != MAGIC:
+        raise ValueError("Not an MSM binary program (bad magic)")
+    if version != VERSION:
+        raise ValueError(f"Unsupported MSM binary version {version}")
+    words = array("i", program[HEADER.size:])
+    if sys.byteorder == "big":
+        words.byteswap()
+    if size < 1 or len(words) != size - 1:
+        raise ValueError(f"Truncated MSM binary program ({len(words)} words of code instead of {size - 1})")
+
+    # instructions and jump targets
+    instructions: list[tuple[int, Opcode, int | None]] = []
+    targets = {entry}
+    address = 1
+    while address < size:
+        try:
+            opcode = Opcode(words[address - 1])
+        except ValueError:
+            raise ValueError(f"Unknown opcode {words[address - 1]} at address {address}") from None
+        if opcode == Opcode.LABEL:
+            raise ValueError(f"Unknown opcode {words[address - 1]} at address {address}")
+        operand = None
+        if opcode in LABEL_OPERANDS or opcode in INTEGER_OPERANDS:
+            if address + 1 >= size:
+                raise ValueError(f"Missing operand of '{opcode.mnemonic}' at address {address}")
+            operand = words[address]
+            if opcode in LABEL_OPERANDS:
+                targets.add(operand)
+        instructions.append((address, opcode, operand))
+        address += 1 if operand is None else 2
+
+    starts = {address for address, _, _ in instructions} | {size}
+    if not targets <= starts:
+        raise ValueError(f"Jump to an address that is not an instruction: {min(targets - starts)}")
+    names = {address: f"L{address}" for address in targets}
+    names[entry] = ENTRY_LABEL
+
+    code = Assembly()
+    for address, opcode, operand in instructions:
+        if address in names:
+            code.label(names[address])
+        code.emit(opcode, names[operand] if opcode in LABEL_OPERANDS else operand)
+    if size in names:
+        code.label(names[size])
+    return code
+
+
+def main() -> None:
+    """Disassemble a binary MSM program (`python -m yacc.binary program.out`)."""
+    ap = argparse.ArgumentParser(description="Disassemble a binary MSM program (output of yacc --emit binary)")
+    ap.add_argument("input", help="Binary program to disassemble")
+    ap.add_argument("-o", "--output", dest="output", default=None, help="Output file path (default: standard output)")
+    args = ap.parse_args()
+
+    try:
+        with open(args.input, "rb") as file:
+            code = disassemble(file.read())
+    except OSError as e:
+        ap.error(f"Cannot read '{args.input}': {e.strerror}")
+    except ValueError as e:
+        ap.error(str(e))
+
+    text = "".join(line + "\n" for line in code.lines())
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,24 @@
+from .asm import Assembly, Instruction, Opcode
 from .node import Node, NodeType
 from .source import Source
 
+from .ir.lower import lower_function
+from .ir.msm import generate_msm
+from .ir.verify import verify_ir
+from .passes.analysis import is_safe, walk
+from .passes.jumps import JumpThreading
+from .passes.stack import StackScheduling
+from .passes.tailmerge import TailMerging
+
 from .utils.errors import CompilationError
+from .utils.writer import AssemblyWriter
 
 class CodeGenerator:
-    def __init__(self, output_path: str = None, to_stdout: bool = False, source_code: Source = None, verbose: bool = False) -> None:
-        self._lines: list[str] = []
+    def __init__(self, output_path: str = None, to_stdout: bool = False, source_code: Source = None, verbose: bool = False, tail_calls: bool = True, stack_values: bool = False, frame_base: bool = False, rotate_loops: bool = False, thread_jumps: bool = False, merge_tails: bool = False, use_ir: bool = False, writer: AssemblyWriter = None) -> None:
+        self._code = Assembly()
+        # with a writer, the code of each function is written as soon as it is generated
+        # (only the current function is kept in `_code`), else the whole program is
+        self.writer = writer
         self._is_open: bool = False
         self.output_path = output_path
         self._to_stdout = to_stdout
@@ -14,10 +27,27 @@ class CodeGenerator:
         self._label_counter: int = 0
         self._loop_stack: list[dict[str, str]] = []
         self._has_main: bool = False
-
-    def add_line(self, line: str) -> None:
-        """Add one line to the buffer"""
-        self._lines.append(line)
+        self.tail_calls = tail_calls
+        self.stack_values = stack_values
+        self.frame_base = frame_base
+        self.rotate_loops = rotate_loops
+        self.thread_jumps = thread_jumps
+        self._jump_threading = JumpThreading()
+        self.merge_tails = merge_tails
+        self.tail_merging = TailMerging()
+        self.use_ir = use_ir
+        self._function: Node | None = None
+        self._entry_label: str | None = None
+        # slot of the frame base of the current function, when `&x` reads it from there
+        self._frame_slot: int | None = None
+
+    def emit(self, opcode: Opcode, operand: int | str | None = None) -> None:
+        """Add one instruction to the buffer"""
+        self._code.emit(opcode, operand)
+
+    def add_label(self, name: str) -> None:
+        """Add one label to the buffer"""
+        self._code.label(name)
 
     def _start(self) -> None:
         """Start generation and add the prefix line"""
@@ -25,37 +55,39 @@ class CodeGenerator:
             return
         self._is_open = True
 
-        self._lines = []
+        self._code = Assembly()
         self._label_counter = 0
+        self._jump_threading = JumpThreading()
+        self.tail_merging = TailMerging()
         self._loop_stack = []
         self._has_main = False
-        self.add_line(".start")
-        self.add_line("prep main")
-        self.add_line("call 0")
-        self.add_line("halt")
-
-    def _finalize(self) -> list[str]:
-        """End generation by adding suffix lines."""
+        self.add_label("start")
+        self.emit(Opcode.PREP, "main")
+        self.emit(Opcode.CALL, 0)
+        self.emit(Opcode.HALT)
+
+    def _flush(self) -> None:
+        """Write the generated code to the writer, if any."""
+        if self.writer is not None and len(self._code):
+            self.writer.write(self._code)
+            self._code = Assembly()
+
+    def _finalize(self) -> Assembly:
+        """End generation by adding suffix lines. Return the code not written yet."""
         if not self._is_open:
-            return []
+            return Assembly()
 
         if not self._has_main:
             raise CompilationError("Function 'main' is required")
 
         self._is_open = False
 
-        return self._lines
+        return self._code
 
-    def _output(self, lines: list[str]) -> None:
-        """Output the generated code to file or stdout."""
-        asm = "\n".join(lines) + "\n"
-        if self._to_stdout:
-            print(asm, end="")
-        elif self.output_path is not None:
-            with open(self.output_path, "w", encoding="utf-8") as f:
-                f.write(asm)
-        else:
-            raise ValueError("No output path specified for code generation.")
+    def _output(self, lines: Assembly | list[str]) -> None:
+        """Output the generated code (or the rest of it, with a writer) to file or stdout."""
+        writer = self.writer if self.writer is not None else AssemblyWriter(self.output_path, self._to_stdout)
+        writer.close(lines)
 
     def codegen(self, node: Node, nbVars: int = 0) -> None:
         """One code generation step (entry point of the compilation pipeline)"""
@@ -64,13 +96,15 @@ class CodeGenerator:
 
         if node.type == NodeType.NODE_FUNCTION:
             self.gennode(node)
+            self._flush()
             return
 
         if nbVars:
-            self.add_line(f"resn {nbVars}") # reserve space for variables
+            self.emit(Opcode.RESN, nbVars) # reserve space for variables
         self.gennode(node)
         if nbVars:
-            self.add_line(f"drop {nbVars}") # clean up variable space
+            self.emit(Opcode.DROP, nbVars) # clean up variable space
+        self._flush()
 
     def gennode(self, node: Node) -> None:
         """Generate code for a single AST node (recursive)"""
@@ -79,37 +113,59 @@ class CodeGenerator:
                 target = node.children[0]
                 value = node.children[1]
                 self.gennode(value)
-                self.add_line("dup")
+                self.emit(Opcode.DUP)
                 if target.type == NodeType.NODE_REF:
-                    self.add_line(f"set {target.index}")
+                    self.emit(Opcode.SET, target.index)
                 elif target.type == NodeType.NODE_DEREF:
                     if not target.children:
                         raise CompilationError("Indirection requires one operand")
                     self.gennode(target.children[0])
-                    self.add_line("write")
+                    self.emit(Opcode.WRITE)
                 else:
                     raise CompilationError("Invalid assignment target")
 
             case NodeType.NODE_COND:
+                has_else = len(node.children) > 2 and node.children[2] is not None
+                then_jump = self._jump_target(node.children[1])
+                else_jump = self._jump_target(node.children[2]) if has_else else None
+                if then_jump is not None and not has_else:
+                    # `if (c) break;` (and the condition of `do ... while`): branch out of the loop
+                    self._branch(node.children[0], then_jump, True)
+                    return
+                if else_jump is not None:
+                    # `if (c) body else break;` (the condition of `while` and `for` loops)
+                    self._branch(node.children[0], else_jump, False)
+                    self.gennode(node.children[1])
+                    return
+
                 label_id = self._next_label_id()
                 false_label = self._format_label(label_id, "else")
                 end_label = self._format_label(label_id, "end")
 
-                # evaluate condition
-                self.gennode(node.children[0])
+                if has_else and node.counts is not None and node.counts[0] > node.counts[1]:
+                    # profiled hot then branch: the branch laid out first pays a jump
+                    # over the other one, so the hot branch goes second (jump if true)
+                    then_label = self._format_label(label_id, "then")
+                    self._branch(node.children[0], then_label, True)
+                    self.gennode(node.children[2])
+                    self.emit(Opcode.JUMP, end_label)
+                    self.add_label(then_label)
+                    self.gennode(node.children[1])
+                    self.add_label(end_label)
+                    return
 
                 # if false, jump to else (or end if no else)
-                self.add_line(f"jumpf {false_label}")
+                self._branch(node.children[0], false_label, False)
                 self.gennode(node.children[1])
 
                 # (optional) else instruction
                 if len(node.children) > 2 and node.children[2] is not None:
-                    self.add_line(f"jump {end_label}")
-                    self.add_line(f".{false_label}")
+                    self.emit(Opcode.JUMP, end_label)
+                    self.add_label(false_label)
                     self.gennode(node.children[2])
-                    self.add_line(f".{end_label}")
+                    self.add_label(end_label)
                 else:
-                    self.add_line(f".{false_label}")
+                    self.add_label(false_label)
 
             case NodeType.NODE_LOOP:
                 loop_id = self._next_label_id()
@@ -123,26 +179,51 @@ class CodeGenerator:
                     "head": head_label,
                 })
 
-                self.add_line(f".{head_label}")
-                for child in node.children:
-                    self.gennode(child)
-                self.add_line(f"jump {head_label}")
-                self.add_line(f".{end_label}")
+                exit_test = self._exit_test(node) if self.rotate_loops and node.children else None
+                if exit_test is not None:
+                    # rotated loop: the condition is checked once before the loop, then
+                    # after each iteration, branching back to the body while it holds
+                    cond = exit_test.children[0]
+                    cond_label = self._format_label(loop_id, "loop_cond")
+                    # `continue` in a `while` loop goes to the condition
+                    self._loop_stack[-1]["head"] = cond_label
+                    for child in node.children[:-1]:
+                        self.gennode(child)
+                    self._branch(cond, end_label, False)
+                    self.add_label(head_label)
+                    self.gennode(exit_test.children[1])
+                    if self._loop_stack[-1]["continue"] == cond_label:
+                        self.add_label(cond_label)
+                    self._branch(cond, head_label, True)
+                    self.add_label(end_label)
+                elif self.rotate_loops and node.children and self._is_break(node.children[-1]):
+                    # the loop ends with its exit test (`do ... while`): branch back unless it exits
+                    self.add_label(head_label)
+                    for child in node.children[:-1]:
+                        self.gennode(child)
+                    self._branch(node.children[-1].children[0], head_label, False)
+                    self.add_label(end_label)
+                else:
+                    self.add_label(head_label)
+                    for child in node.children:
+                        self.gennode(child)
+                    self.emit(Opcode.JUMP, head_label)
+                    self.add_label(end_label)
 
                 self._loop_stack.pop()
 
             case NodeType.NODE_BREAK:
                 loop_info = self._current_loop()
-                self.add_line(f"jump {loop_info['end']}")
+                self.emit(Opcode.JUMP, loop_info['end'])
 
             case NodeType.NODE_CONTINUE:
                 loop_info = self._current_loop()
-                self.add_line(f"jump {loop_info['continue']}")
+                self.emit(Opcode.JUMP, loop_info['continue'])
 
             case NodeType.NODE_TARGET:
                 loop_info = self._current_loop()
                 if node.value:
-                    self.add_line(f".{loop_info['continue']}")
+                    self.add_label(loop_info['continue'])
                 else:
                     loop_info["continue"] = loop_info["head"]
 
@@ -151,24 +232,73 @@ class CodeGenerator:
                     raise CompilationError("Function missing name")
                 if node.repr == "start":
                     raise CompilationError("Function name 'start' is reserved")
-                self.add_line(f".{node.repr}")
-                locals_count = node.value or 0
-                if locals_count:
-                    self.add_line(f"resn {locals_count}")
-                body = node.children[-1] if node.children else None
-                if body is not None:
-                    self.gennode(body)
-                self.add_line("push 0")
-                self.add_line("ret")
+                first_line = len(self._code)
+                if self.use_ir and node.children:
+                    # generate the function through the SSA IR
+                    function = lower_function(node)
+                    verify_ir(function)
+                    self._code.extend(generate_msm(function, tail_calls=self.tail_calls))
+                else:
+                    self.add_label(node.repr)
+                    locals_count = node.value or 0
+                    body = node.children[-1] if node.children else None
+                    tail_calls = body is not None and self.tail_calls and self._has_tail_self_call(body, node) and not self._takes_address(body)
+
+                    previous = (self._function, self._entry_label, self._frame_slot)
+                    self._function = node
+                    self._entry_label = None
+                    self._frame_slot = None
+                    if body is not None and self.frame_base and self._address_uses(body) >= 2:
+                        # hidden slot after the locals, for the frame base
+                        self._frame_slot = max(len(node.children) - 1, 0) + locals_count
+                        locals_count += 1
+                    if locals_count:
+                        self.emit(Opcode.RESN, locals_count)
+                    if self._frame_slot is not None:
+                        # address of slot 0, computed once for every `&x` of the function
+                        self._emit_frame_address()
+                        self.emit(Opcode.SET, self._frame_slot)
+                    if tail_calls:
+                        # self tail calls jump back here, after the locals are reserved
+                        self._entry_label = self._format_label(self._next_label_id(), "entry")
+                        self.add_label(self._entry_label)
+                    try:
+                        if body is not None:
+                            self.gennode(body)
+                    finally:
+                        self._function, self._entry_label, self._frame_slot = previous
+                    self.emit(Opcode.PUSH, 0)
+                    self.emit(Opcode.RET)
+                if self.thread_jumps or self.merge_tails or self.stack_values:
+                    code = Assembly(self._code[first_line:])
+                    if self.thread_jumps:
+                        # only the function label may be referred to from other functions
+                        self._jump_threading.run(code, keep={node.repr})
+                    if self.merge_tails and self.tail_merging.run(code, lambda: self._format_label(self._next_label_id(), "tail")) and self.thread_jumps:
+                        # the jumps to the merged tails may go to the next instruction
+                        self._jump_threading.run(code, keep={node.repr})
+                    if self.stack_values:
+                        # keep short-lived values on the operand stack
+                        StackScheduling().run(code)
+                    self._code[first_line:] = code
                 if node.repr == "main":
                     self._has_main = True
 
             case NodeType.NODE_RETURN:
+                if self._entry_label is not None and node.children and self._is_self_call(node.children[0], self._function):
+                    # tail call elimination: overwrite the arguments and restart the body
+                    args = node.children[0].children[1:]
+                    for arg in args:
+                        self.gennode(arg)
+                    for index in reversed(range(len(args))):
+                        self.emit(Opcode.SET, index)
+                    self.emit(Opcode.JUMP, self._entry_label)
+                    return
                 if node.children:
                     self.gennode(node.children[0])
                 else:
-                    self.add_line("push 0")
-                self.add_line("ret")
+                    self.emit(Opcode.PUSH, 0)
+                self.emit(Opcode.RET)
 
             case NodeType.NODE_CALL:
                 if not node.children:
@@ -176,29 +306,31 @@ class CodeGenerator:
                 target = node.children[0]
                 if target.type != NodeType.NODE_REF or not target.repr:
                     raise CompilationError("Function call target must be an identifier")
-                self.add_line(f"prep {target.repr}")
+                self.emit(Opcode.PREP, target.repr)
                 for arg in node.children[1:]:
                     self.gennode(arg)
-                self.add_line(f"call {len(node.children) - 1}")
+                self.emit(Opcode.CALL, len(node.children) - 1)
 
             case NodeType.NODE_DEREF:
                 if not node.children:
                     raise CompilationError("Indirection requires one operand")
                 self.gennode(node.children[0])
-                self.add_line("read")
+                self.emit(Opcode.READ)
 
             case NodeType.NODE_ADDRESS:
                 if len(node.children) != 1:
                     raise CompilationError("Address-of operator requires one operand")
                 target = node.children[0]
-                if target.type == NodeType.NODE_REF:
-                    self.add_line("prep start")
-                    self.add_line("swap")
-                    self.add_line("drop 1")
-                    self.add_line("push 1")
-                    self.add_line("sub")
-                    self.add_line(f"push {target.index}")
-                    self.add_line("sub")
+                if target.type == NodeType.NODE_REF and self._frame_slot is not None:
+                    # slots are stored downwards from the frame base
+                    self.emit(Opcode.GET, self._frame_slot)
+                    if target.index:
+                        self.emit(Opcode.PUSH, target.index)
+                        self.emit(Opcode.SUB)
+                elif target.type == NodeType.NODE_REF:
+                    self._emit_frame_address()
+                    self.emit(Opcode.PUSH, target.index)
+                    self.emit(Opcode.SUB)
                 elif target.type == NodeType.NODE_DEREF:
                     if not target.children:
                         raise CompilationError("Indirection requires one operand")
@@ -206,51 +338,156 @@ class CodeGenerator:
                 else:
                     raise CompilationError("Cannot take address of this expression")
 
+            case NodeType.NODE_AND | NodeType.NODE_OR if not is_safe(node.children[1]):
+                # the right operand is only evaluated if needed: as a branch, then 0 or 1
+                label_id = self._next_label_id()
+                false_label = self._format_label(label_id, "false")
+                end_label = self._format_label(label_id, "end")
+                self._branch(node, false_label, False)
+                self.emit(Opcode.PUSH, 1)
+                self.emit(Opcode.JUMP, end_label)
+                self.add_label(false_label)
+                self.emit(Opcode.PUSH, 0)
+                self.add_label(end_label)
+
             case _ if node.type in Node.EN:
                 prefix, suffix = Node.EN[node.type]
                 if prefix:
-                    self.add_line(self._expand(prefix, node))
+                    self.emit(*self._expand(prefix, node))
                 for child in node.children:
                     self.gennode(child)
                 if suffix:
-                    self.add_line(self._expand(suffix, node))
+                    self.emit(*self._expand(suffix, node))
 
             case _:
                 raise CompilationError(f"Code generation not implemented for node type: {node.type.name}")
 
+    def _branch(self, cond: Node, target: str, when: bool) -> None:
+        """
+        Jump to `target` if the truth value of `cond` is `when`, else go on with the
+        next instruction, without computing the value of `cond` when possible:
+        `!` swaps `jumpt` and `jumpf`, and `&&` and `||` skip their right operand
+        once the left one decides.
+        """
+        match cond.type:
+            case NodeType.NODE_NOT:
+                self._branch(cond.children[0], target, not when)
+            case NodeType.NODE_AND | NodeType.NODE_OR:
+                left, right = cond.children
+                # the left operand decides for `a && b` if false, for `a || b` if true
+                decides = cond.type == NodeType.NODE_OR
+                if decides == when:
+                    self._branch(left, target, when)
+                    self._branch(right, target, when)
+                else:
+                    skip_label = self._format_label(self._next_label_id(), "skip")
+                    self._branch(left, skip_label, decides)
+                    self._branch(right, target, when)
+                    self.add_label(skip_label)
+            case _:
+                self.gennode(cond)
+                self.emit(Opcode.JUMPT if when else Opcode.JUMPF, target)
+
+    @staticmethod
+    def _exit_test(loop: Node) -> Node | None:
+        """
+        Condition that a loop starts with (`while` and `for` loops), when the loop can
+        be rotated: `if (c) body else break;` after nothing but the `continue` target.
+        """
+        *prefix, last = loop.children
+        if not all(child.type == NodeType.NODE_TARGET and not child.value for child in prefix):
+            return None
+        if last.type != NodeType.NODE_COND or len(last.children) != 3:
+            return None
+        if last.children[2] is None or last.children[2].type != NodeType.NODE_BREAK:
+            return None
+        return last
+
+    @staticmethod
+    def _is_break(node: Node) -> bool:
+        """Check if a statement is `if (c) break;`."""
+        return (
+            node.type == NodeType.NODE_COND and len(node.children) == 2
+            and node.children[1] is not None and node.children[1].type == NodeType.NODE_BREAK
+        )
+
+    def _jump_target(self, node: Node | None) -> str | None:
+        """Label that a `break` or `continue` statement jumps to (None for other statements)."""
+        if node is not None and node.type == NodeType.NODE_BREAK:
+            return self._current_loop()["end"]
+        if node is not None and node.type == NodeType.NODE_CONTINUE:
+            return self._current_loop()["continue"]
+        return None
+
     @staticmethod
-    def _expand(template: str, node: Node) -> str:
+    def _expand(instruction: Instruction, node: Node) -> Instruction:
         """
-        Expand a template string by replacing placeholders.
+        Expand the placeholder operand of an instruction.
 
         Placeholders:
-        - '@': the node index if defined, otherwise the first child's index if any, else '0'
+        - '@': the node index if defined, otherwise the first child's index if any
         - '#': the node value
         """
-        at_value = None
-        if node.index is not None:
-            at_value = str(node.index)
-        elif node.children and node.children[0].index is not None:
-            # use the first child's index as a fallback
-            # this is useful for nodes that do not store their own index
-            # (e.g., ND_AFFECT nodes use the index of their ND_REF child)
-            at_value = str(node.children[0].index)
-
-        hash_value = str(node.value)
-
-        if (
-            (at_value is None and "@" in template) or
-            (hash_value is None and "#" in template)
-        ):
-            raise ValueError(f"Cannot expand template: \"{template}\" with node: {node.__repr__()}")
-    
-        expanded = template
-        if at_value is not None:
-            expanded = expanded.replace("@", at_value)
-        if hash_value is not None:
-            expanded = expanded.replace("#", hash_value)
-
-        return expanded
+        opcode, operand = instruction
+        if operand == "@":
+            operand = node.index
+            if operand is None and node.children:
+                # use the first child's index as a fallback
+                # this is useful for nodes that do not store their own index
+                # (e.g., ND_AFFECT nodes use the index of their ND_REF child)
+                operand = node.children[0].index
+        elif operand == "#":
+            operand = node.value
+
+        if operand is None and instruction[1] is not None:
+            raise ValueError(f"Cannot expand instruction: {instruction} with node: {node.__repr__()}")
+        return opcode, operand
+
+    def _emit_frame_address(self) -> None:
+        """Push the address of slot 0 of the frame (`bp - 1`, through the frame pointer saved by `prep`)."""
+        self.emit(Opcode.PREP, "start")
+        self.emit(Opcode.SWAP)
+        self.emit(Opcode.DROP, 1)
+        self.emit(Opcode.PUSH, 1)
+        self.emit(Opcode.SUB)
+
+    @classmethod
+    def _address_uses(cls, node: Node, in_loop: bool = False) -> int:
+        """
+        Weighted number of `&x` of locals in `node`: 1 per occurrence, 2 in a loop,
+        where it is evaluated several times. From 2, computing the frame base once is cheaper.
+        """
+        uses = 0
+        if node.type == NodeType.NODE_ADDRESS and node.children and node.children[0].type == NodeType.NODE_REF:
+            uses = 2 if in_loop else 1
+        in_loop = in_loop or node.type == NodeType.NODE_LOOP
+        return uses + sum(cls._address_uses(child, in_loop) for child in node.children)
+
+    @staticmethod
+    def _is_self_call(node: Node, function: Node | None) -> bool:
+        """Check if `node` calls `function` itself with one argument per parameter."""
+        if function is None or node.type != NodeType.NODE_CALL or not node.children:
+            return False
+        target = node.children[0]
+        if target.type != NodeType.NODE_REF or target.repr != function.repr:
+            return False
+        param_count = max(len(function.children) - 1, 0)
+        return len(node.children) - 1 == param_count
+
+    @classmethod
+    def _has_tail_self_call(cls, node: Node, function: Node) -> bool:
+        """Check if a `return f(...)` to the enclosing function appears in `node`."""
+        if node.type == NodeType.NODE_RETURN:
+            return bool(node.children) and cls._is_self_call(node.children[0], function)
+        return any(cls._has_tail_self_call(child, function) for child in node.children)
+
+    @staticmethod
+    def _takes_address(node: Node) -> bool:
+        """
+        Check if `node` takes the address of a local or parameter: a self tail call
+        would then overwrite the frame that the arguments may point to.
+        """
+        return any(n.type == NodeType.NODE_ADDRESS for n in walk(node))
 
     def _next_label_id(self) -> int:
         label_id = self._label_counter
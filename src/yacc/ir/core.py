@@ -0,0 +1,213 @@
+from enum import Enum
+
+
+class IRType(Enum):
+    """
+    Type of an IR value.
+    The front end does not keep declared types, so they are inferred: addresses
+    (and pointer arithmetic on them) are `ptr`, other values are `int`, and
+    instructions without result are `void`.
+    """
+    INT = "int"
+    PTR = "ptr"
+    VOID = "void"
+
+
+# Binary operators (same mnemonics as the MSM instructions)
+BINARY_OPCODES: set[str] = {
+    "add", "sub", "mul", "div", "mod", "and", "or",
+    "cmpeq", "cmpne", "cmplt", "cmple", "cmpgt", "cmpge",
+}
+UNARY_OPCODES: set[str] = {"not", "neg"}
+TERMINATORS: set[str] = {"jump", "branch", "ret"}
+# Instructions that must be kept even if their result is unused
+SIDE_EFFECTS: set[str] = {"set", "store", "call", "debug"} | TERMINATORS
+
+
+class Instruction:
+    """
+    One IR instruction, which is also the SSA value it defines.
+
+    Opcodes and attributes:
+    - `const` (value), `param` (index): constants and incoming arguments
+    - `addr` (slot): address of a frame slot, `get` / `set v` (slot): read / write a frame slot
+      (only for locals that may be accessed through a pointer, others are SSA values)
+    - `load p`, `store v, p`: read / write memory through a pointer
+    - unary (`not`, `neg`) and binary (`add`, `cmplt`...) operators
+    - `call args...` (name), `debug v`
+    - `phi` (one operand per block of `incoming`)
+    - terminators: `jump` (targets), `branch c` (targets: true, false), `ret v`
+    """
+
+    def __init__(
+        self,
+        opcode: str,
+        operands: list["Instruction"] | None = None,
+        type: IRType = IRType.INT,
+        value: int | None = None,
+        name: str | None = None,
+    ) -> None:
+        self.opcode = opcode
+        self.operands: list[Instruction] = operands if operands is not None else []
+        self.type = type
+        # constant value, parameter index or frame slot
+        self.value = value
+        # called function
+        self.name = name
+        # successors of terminators
+        self.targets: list[Block] = []
+        # predecessor of each operand of phis
+        self.incoming: list[Block] = []
+        self.block: Block | None = None
+
+    @property
+    def is_terminator(self) -> bool:
+        return self.opcode in TERMINATORS
+
+    def __repr__(self) -> str:
+        return f"Instruction({self.opcode}, value={self.value}, name={self.name})"
+
+
+class Block:
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self.instructions: list[Instruction] = []
+
+    @property
+    def phis(self) -> list[Instruction]:
+        return [inst for inst in self.instructions if inst.opcode == "phi"]
+
+    @property
+    def terminator(self) -> Instruction | None:
+        if self.instructions and self.instructions[-1].is_terminator:
+            return self.instructions[-1]
+        return None
+
+    @property
+    def successors(self) -> list["Block"]:
+        terminator = self.terminator
+        return list(terminator.targets) if terminator is not None else []
+
+    def append(self, inst: Instruction) -> Instruction:
+        inst.block = self
+        self.instructions.append(inst)
+        return inst
+
+    def __repr__(self) -> str:
+        return f"Block({self.label})"
+
+
+class Function:
+    """
+    A function in SSA form: a list of basic blocks, the first one being the entry.
+    `frame` is the number of frame slots used by `get`/`set`/`addr` (the parameters and
+    locals of the source function), `params` the number of parameters.
+    """
+
+    def __init__(self, name: str, params: int, frame: int) -> None:
+        self.name = name
+        self.params = params
+        self.frame = frame
+        self.blocks: list[Block] = []
+        self._label_counter: int = 0
+
+    @property
+    def entry(self) -> Block:
+        return self.blocks[0]
+
+    def new_block(self) -> Block:
+        block = Block(f"bb{self._label_counter}")
+        self._label_counter += 1
+        self.blocks.append(block)
+        return block
+
+    def instructions(self) -> list[Instruction]:
+        return [inst for block in self.blocks for inst in block.instructions]
+
+    def predecessors(self) -> dict[Block, list[Block]]:
+        """Predecessors of every block (a block jumping twice to the same successor counts once)."""
+        preds: dict[Block, list[Block]] = {block: [] for block in self.blocks}
+        for block in self.blocks:
+            for succ in dict.fromkeys(block.successors):
+                preds[succ].append(block)
+        return preds
+
+    def users(self) -> dict[Instruction, list[Instruction]]:
+        """Instructions using each value (once per operand)."""
+        users: dict[Instruction, list[Instruction]] = {inst: [] for inst in self.instructions()}
+        for inst in self.instructions():
+            for operand in inst.operands:
+                users.setdefault(operand, []).append(inst)
+        return users
+
+    def replace_uses(self, old: Instruction, new: Instruction) -> None:
+        """Replace every use of `old` by `new`."""
+        for inst in self.instructions():
+            inst.operands[:] = [new if operand is old else operand for operand in inst.operands]
+
+    def dominators(self) -> dict[Block, set[Block]]:
+        """Blocks dominating each block reachable from the entry (iterative data-flow)."""
+        preds = self.predecessors()
+        reachable = self.reachable()
+        dominators = {block: set(reachable) for block in reachable}
+        dominators[self.entry] = {self.entry}
+        changed = True
+        while changed:
+            changed = False
+            for block in reachable:
+                if block is self.entry:
+                    continue
+                incoming = [dominators[pred] for pred in preds[block] if pred in dominators]
+                new = set.intersection(*incoming) | {block} if incoming else {block}
+                if new != dominators[block]:
+                    dominators[block] = new
+                    changed = True
+        return dominators
+
+    def reachable(self) -> list[Block]:
+        """Blocks reachable from the entry, in layout order."""
+        seen = {self.entry}
+        stack = [self.entry]
+        while stack:
+            for succ in stack.pop().successors:
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append(succ)
+        return [block for block in self.blocks if block in seen]
+
+    def dump(self) -> list[str]:
+        """Textual representation of the function, one line per block label or instruction."""
+        names: dict[Instruction, str] = {}
+        for inst in self.instructions():
+            if inst.type != IRType.VOID:
+                names[inst] = f"%{len(names)}"
+        preds = self.predecessors()
+
+        lines = [f"function {self.name}(params: {self.params}, frame: {self.frame}) {{"]
+        for block in self.blocks:
+            comment = f"  ; preds: {', '.join(pred.label for pred in preds[block])}" if preds[block] else ""
+            lines.append(f"{block.label}:{comment}")
+            for inst in block.instructions:
+                lines.append(f"    {self._format(inst, names)}")
+        lines.append("}")
+        return lines
+
+    @staticmethod
+    def _format(inst: Instruction, names: dict[Instruction, str]) -> str:
+        def name(value: Instruction) -> str:
+            return names.get(value, "<undefined>")
+
+        if inst.opcode == "phi":
+            args = [f"[{name(value)}, {block.label}]" for value, block in zip(inst.operands, inst.incoming)]
+        else:
+            args = [name(operand) for operand in inst.operands]
+        if inst.opcode == "call":
+            args.insert(0, f"@{inst.name}")
+        elif inst.value is not None:
+            args.insert(0, str(inst.value))
+        args.extend(target.label for target in inst.targets)
+
+        text = inst.opcode + (" " + ", ".join(args) if args else "")
+        if inst.type == IRType.VOID:
+            return text
+        return f"{names[inst]}:{inst.type.value} = {text}"
@@ -0,0 +1,396 @@
+from ..node import Node, NodeType
+
+from ..passes.alias import aliased_slots
+from ..passes.analysis import is_safe, param_count
+from ..utils.errors import CompilationError
+
+from .core import BINARY_OPCODES, Block, Function, Instruction, IRType
+
+
+class Lowering:
+    """
+    Build the SSA form of an analyzed function node.
+
+    Local variables become SSA values, with phi nodes created on the fly while the
+    AST is walked ("Simple and Efficient Construction of Static Single Assignment
+    Form", Braun et al.): a block is sealed once all its predecessors are known,
+    and phis that turn out to merge a single value are removed.
+    Variables that may be accessed through a pointer (see `aliased_slots`) stay in
+    their frame slot and are read and written with `get`/`set`.
+    Reading a variable that was never assigned gives 0.
+    """
+
+    def __init__(self, func: Node) -> None:
+        if func.type != NodeType.NODE_FUNCTION or not func.children:
+            raise CompilationError("Only functions with a body can be lowered to IR")
+        self.node = func
+        params = param_count(func)
+        self.function = Function(func.repr, params, params + (func.value or 0))
+        self._memory = aliased_slots(func)
+        self._definitions: dict[int, dict[Block, Instruction]] = {}
+        self._sealed: set[Block] = set()
+        self._incomplete: dict[Block, dict[int, Instruction]] = {}
+        self._preds: dict[Block, list[Block]] = {}
+        self._loops: list[dict[str, Block | None]] = []
+        self._block: Block | None = None
+
+    def lower(self) -> Function:
+        entry = self._new_block()
+        self._seal(entry)
+        self._block = entry
+        for index in range(self.function.params):
+            if index not in self._memory:
+                self._write(index, entry, self._emit(Instruction("param", value=index)))
+
+        self._statement(self.node.children[-1])
+        self._terminate(Instruction("ret", [self._const(0)], IRType.VOID))
+
+        self._remove_unreachable_blocks()
+        self._simplify_cfg()
+        self._infer_types()
+        return self.function
+
+    # Blocks
+
+    def _new_block(self) -> Block:
+        block = self.function.new_block()
+        self._preds[block] = []
+        return block
+
+    def _emit(self, inst: Instruction) -> Instruction:
+        return self._block.append(inst)
+
+    def _enter(self, block: Block) -> None:
+        """Continue in `block` (blocks are laid out in the order they are entered)."""
+        self.function.blocks.remove(block)
+        self.function.blocks.append(block)
+        self._block = block
+
+    def _terminate(self, inst: Instruction, *targets: Block) -> None:
+        """End the current block. Code that follows goes in a new unreachable block."""
+        inst.targets = list(targets)
+        self._emit(inst)
+        for target in targets:
+            self._preds[target].append(self._block)
+        self._block = self._new_block()
+        self._seal(self._block)
+
+    def _jump(self, target: Block) -> None:
+        self._terminate(Instruction("jump", type=IRType.VOID), target)
+
+    def _const(self, value: int) -> Instruction:
+        return self._emit(Instruction("const", value=value))
+
+    # Variables
+
+    def _write(self, slot: int, block: Block, value: Instruction) -> None:
+        self._definitions.setdefault(slot, {})[block] = value
+
+    def _read(self, slot: int, block: Block) -> Instruction:
+        if block in self._definitions.get(slot, {}):
+            return self._definitions[slot][block]
+
+        if block not in self._sealed:
+            value = self._new_phi(block)
+            self._incomplete.setdefault(block, {})[slot] = value
+        elif len(self._preds[block]) == 1:
+            value = self._read(slot, self._preds[block][0])
+        elif not self._preds[block]:
+            value = self._undefined(block)
+        else:
+            value = self._new_phi(block)
+            self._write(slot, block, value)
+            value = self._complete_phi(slot, value)
+        self._write(slot, block, value)
+        return value
+
+    def _undefined(self, block: Block) -> Instruction:
+        value = Instruction("const", value=0)
+        value.block = block
+        block.instructions.insert(len(block.phis), value)
+        return value
+
+    @staticmethod
+    def _new_phi(block: Block) -> Instruction:
+        phi = Instruction("phi")
+        phi.block = block
+        block.instructions.insert(0, phi)
+        return phi
+
+    def _complete_phi(self, slot: int, phi: Instruction) -> Instruction:
+        for pred in self._preds[phi.block]:
+            phi.operands.append(self._read(slot, pred))
+            phi.incoming.append(pred)
+        return self._remove_trivial_phi(phi)
+
+    def _remove_trivial_phi(self, phi: Instruction) -> Instruction:
+        same = None
+        for operand in phi.operands:
+            if operand is same or operand is phi:
+                continue
+            if same is not None:
+                return phi  # merges at least two values
+            same = operand
+        if same is None:
+            same = self._undefined(phi.block)
+
+        users = [inst for inst in self.function.instructions() if phi in inst.operands and inst is not phi]
+        phi.block.instructions.remove(phi)
+        self.function.replace_uses(phi, same)
+        for definitions in self._definitions.values():
+            for block, value in definitions.items():
+                if value is phi:
+                    definitions[block] = same
+        for incomplete in self._incomplete.values():
+            for slot, value in incomplete.items():
+                if value is phi:
+                    incomplete[slot] = same
+
+        for user in users:
+            if user.opcode == "phi" and user.block is not None and user in user.block.instructions:
+                self._remove_trivial_phi(user)
+        return same
+
+    def _seal(self, block: Block) -> None:
+        for slot, phi in self._incomplete.pop(block, {}).items():
+            if phi.opcode == "phi" and phi in phi.block.instructions:
+                self._complete_phi(slot, phi)
+        self._sealed.add(block)
+
+    # Statements
+
+    def _statement(self, node: Node) -> None:
+        match node.type:
+            case NodeType.NODE_BLOCK | NodeType.NODE_SEQ:
+                for child in node.children:
+                    self._statement(child)
+
+            case NodeType.NODE_DECLARE:
+                pass
+
+            case NodeType.NODE_DROP:
+                self._expression(node.children[0])
+
+            case NodeType.NODE_DEBUG:
+                self._emit(Instruction("debug", [self._expression(node.children[0])], IRType.VOID))
+
+            case NodeType.NODE_RETURN:
+                value = self._expression(node.children[0]) if node.children else self._const(0)
+                self._terminate(Instruction("ret", [value], IRType.VOID))
+
+            case NodeType.NODE_COND:
+                condition = self._expression(node.children[0])
+                then_block = self._new_block()
+                join = self._new_block()
+                else_block = self._new_block() if len(node.children) > 2 else join
+                self._terminate(Instruction("branch", [condition], IRType.VOID), then_block, else_block)
+                self._seal(then_block)
+                self._enter(then_block)
+                self._statement(node.children[1])
+                self._jump(join)
+                if else_block is not join:
+                    self._seal(else_block)
+                    self._enter(else_block)
+                    self._statement(node.children[2])
+                    self._jump(join)
+                self._seal(join)
+                self._enter(join)
+
+            case NodeType.NODE_LOOP:
+                head = self._new_block()
+                exit = self._new_block()
+                self._loops.append({"head": head, "exit": exit, "continue": None})
+                self._jump(head)
+                self._enter(head)
+                for child in node.children:
+                    self._statement(child)
+                self._jump(head)
+                loop = self._loops.pop()
+                self._seal(head)
+                if loop["continue"] is not None and loop["continue"] not in self._sealed:
+                    self._seal(loop["continue"])
+                self._seal(exit)
+                self._enter(exit)
+
+            case NodeType.NODE_TARGET:
+                loop = self._current_loop()
+                if node.value:
+                    if loop["continue"] is None:
+                        loop["continue"] = self._new_block()
+                    self._jump(loop["continue"])
+                    self._enter(loop["continue"])
+                else:
+                    loop["continue"] = loop["head"]
+
+            case NodeType.NODE_BREAK:
+                self._jump(self._current_loop()["exit"])
+
+            case NodeType.NODE_CONTINUE:
+                loop = self._current_loop()
+                if loop["continue"] is None:
+                    loop["continue"] = self._new_block()
+                self._jump(loop["continue"])
+
+            case _:
+                self._expression(node)
+
+    def _current_loop(self) -> dict[str, Block | None]:
+        if not self._loops:
+            raise CompilationError("Loop control statement used outside of a loop")
+        return self._loops[-1]
+
+    # Expressions
+
+    def _expression(self, node: Node) -> Instruction:
+        match node.type:
+            case NodeType.NODE_CONST:
+                return self._const(node.value)
+
+            case NodeType.NODE_REF:
+                if node.index in self._memory:
+                    return self._emit(Instruction("get", value=node.index))
+                return self._read(node.index, self._block)
+
+            case NodeType.NODE_AFFECT:
+                target, expr = node.children
+                value = self._expression(expr)
+                if target.type == NodeType.NODE_DEREF:
+                    address = self._expression(target.children[0])
+                    self._emit(Instruction("store", [value, address], IRType.VOID))
+                elif target.index in self._memory:
+                    self._emit(Instruction("set", [value], IRType.VOID, value=target.index))
+                else:
+                    self._write(target.index, self._block, value)
+                return value
+
+            case NodeType.NODE_ADDRESS:
+                target = node.children[0]
+                if target.type == NodeType.NODE_DEREF:
+                    return self._expression(target.children[0])
+                return self._emit(Instruction("addr", type=IRType.PTR, value=target.index))
+
+            case NodeType.NODE_DEREF:
+                return self._emit(Instruction("load", [self._expression(node.children[0])]))
+
+            case NodeType.NODE_CALL:
+                args = [self._expression(arg) for arg in node.children[1:]]
+                return self._emit(Instruction("call", args, name=node.children[0].repr))
+
+            case NodeType.NODE_NOT | NodeType.NODE_NEG:
+                opcode = "not" if node.type == NodeType.NODE_NOT else "neg"
+                return self._emit(Instruction(opcode, [self._expression(node.children[0])]))
+
+            case NodeType.NODE_AND | NodeType.NODE_OR if not is_safe(node.children[1]):
+                return self._short_circuit(node)
+
+            case _ if node.type in Node.EN and (suffix := Node.EN[node.type][1]) and suffix[0].mnemonic in BINARY_OPCODES:
+                left = self._expression(node.children[0])
+                right = self._expression(node.children[1])
+                return self._emit(Instruction(suffix[0].mnemonic, [left, right]))
+
+        raise CompilationError(f"IR lowering not implemented for node type: {node.type.name}")
+
+    def _short_circuit(self, node: Node) -> Instruction:
+        """
+        `a && b` and `a || b` whose right operand may have side effects: the right
+        operand is only evaluated if the left one does not decide, in its own block,
+        and a phi merges the value decided by the left operand with the truth value
+        of the right one.
+        """
+        # the left operand decides for `a && b` if false (0), for `a || b` if true (1)
+        decides = int(node.type == NodeType.NODE_OR)
+        condition = self._expression(node.children[0])
+        decided = self._const(decides)
+        left_block = self._block
+        right_block = self._new_block()
+        join = self._new_block()
+        targets = (join, right_block) if decides else (right_block, join)
+        self._terminate(Instruction("branch", [condition], IRType.VOID), *targets)
+        self._seal(right_block)
+        self._enter(right_block)
+        right = self._expression(node.children[1])
+        truth = self._emit(Instruction("cmpne", [right, self._const(0)]))
+        right_block = self._block
+        self._jump(join)
+        self._seal(join)
+        self._enter(join)
+        phi = self._new_phi(join)
+        phi.operands = [decided, truth]
+        phi.incoming = [left_block, right_block]
+        return phi
+
+    # Cleanup
+
+    def _remove_unreachable_blocks(self) -> None:
+        reachable = set(self.function.reachable())
+        for block in self.function.blocks:
+            for phi in block.phis:
+                kept = [(value, pred) for value, pred in zip(phi.operands, phi.incoming) if pred in reachable]
+                phi.operands = [value for value, _ in kept]
+                phi.incoming = [pred for _, pred in kept]
+        self.function.blocks = [block for block in self.function.blocks if block in reachable]
+        changed = True
+        while changed:
+            changed = False
+            for block in self.function.blocks:
+                for phi in block.phis:
+                    if phi in block.instructions and len({id(value) for value in phi.operands if value is not phi}) <= 1:
+                        self._remove_trivial_phi(phi)
+                        changed = True
+
+    def _simplify_cfg(self) -> None:
+        """Bypass blocks that only jump elsewhere and merge blocks into their single predecessor."""
+        changed = True
+        while changed:
+            changed = False
+            preds = self.function.predecessors()
+            for block in self.function.blocks[1:]:
+                terminator = block.terminator
+                if block.instructions == [terminator] and terminator.opcode == "jump" and terminator.targets[0] is not block:
+                    target = terminator.targets[0]
+                    if target.phis and any(pred in preds[target] for pred in preds[block]):
+                        continue
+                    for phi in target.phis:
+                        index = phi.incoming.index(block)
+                        value = phi.operands.pop(index)
+                        del phi.incoming[index]
+                        phi.operands.extend(value for _ in preds[block])
+                        phi.incoming.extend(preds[block])
+                    for pred in preds[block]:
+                        pred.terminator.targets = [target if succ is block else succ for succ in pred.terminator.targets]
+                    self.function.blocks.remove(block)
+                    changed = True
+                    break
+                if len(preds[block]) == 1 and preds[block][0].terminator.opcode == "jump" and not block.phis:
+                    pred = preds[block][0]
+                    pred.instructions.pop()
+                    for inst in block.instructions:
+                        pred.append(inst)
+                    for succ in block.successors:
+                        for phi in succ.phis:
+                            phi.incoming = [pred if incoming is block else incoming for incoming in phi.incoming]
+                    self.function.blocks.remove(block)
+                    changed = True
+                    break
+
+    def _infer_types(self) -> None:
+        """Propagate `ptr` through pointer arithmetic and phis until nothing changes."""
+        changed = True
+        while changed:
+            changed = False
+            for inst in self.function.instructions():
+                if inst.opcode in ("add", "sub", "phi"):
+                    pointers = [operand.type == IRType.PTR for operand in inst.operands]
+                    if inst.opcode == "sub":
+                        is_pointer = pointers == [True, False]
+                    else:
+                        is_pointer = any(pointers)
+                    new = IRType.PTR if is_pointer else IRType.INT
+                    if new != inst.type:
+                        inst.type = new
+                        changed = True
+
+
+def lower_function(func: Node) -> Function:
+    """Lower an analyzed function node to SSA form."""
+    return Lowering(func).lower()
@@ -0,0 +1,379 @@
+from ..asm import Assembly, Opcode
+
+from .core import SIDE_EFFECTS, Block, Function, Instruction, IRType
+
+_COMMUTATIVE = {"add", "mul", "and", "or", "cmpeq", "cmpne"}
+# comparisons with swapped operands: a < b <=> b > a
+_SWAPPED = {"cmplt": "cmpgt", "cmple": "cmpge", "cmpgt": "cmplt", "cmpge": "cmple"}
+
+
+class StackCodeGenerator:
+    """
+    Generate MSM stack code from a function in SSA form (the function is modified).
+
+    - Values used once, by a later instruction of the same block, stay on the operand
+      stack between their definition and their use (a `swap` may be needed when the
+      value is the right operand); this is checked by simulating the stack of each
+      block and falling back to frame slots for the values that are not on top of
+      the stack when they are needed.
+    - Other values live in frame slots. Slots are shared by values that are never
+      live at the same time (liveness analysis and greedy coloring), and a phi
+      prefers the slot of its operands so that most copies disappear.
+    - Phis are replaced by parallel copies at the end of the predecessors (critical
+      edges are split first): all the copied values are pushed, then stored.
+    - Other constants are pushed where they are used, parameters stay in their slot.
+    - With `tail_calls`, `return f(...)` inside `f` overwrites the parameters and
+      jumps back to the start of the function (unless the function takes an address).
+    """
+
+    def __init__(self, function: Function, tail_calls: bool = True) -> None:
+        self.function = function
+        self.tail_calls = tail_calls
+        self._tail_calls: set[Instruction] = set()
+        # calls whose `prep` goes before an instruction
+        self._preps: dict[Instruction, list[Instruction]] = {}
+        self._users: dict[Instruction, list[Instruction]] = {}
+        self._on_stack: set[Instruction] = set()
+        self._slots: dict[Instruction, int] = {}
+        self._frame: int = function.params
+        self._copies: dict[Block, list[tuple[Instruction, Instruction]]] = {}
+        self._code = Assembly()
+
+    def generate(self) -> Assembly:
+        self._remove_dead_code()
+        self._split_critical_edges()
+        self._users = self.function.users()
+        self._copies = {block: [] for block in self.function.blocks}
+        for block in self.function.blocks:
+            for phi in block.phis:
+                for value, pred in zip(phi.operands, phi.incoming):
+                    self._copies[pred].append((phi, value))
+        # a tail call would overwrite the frame that a pointer argument may point to
+        if self.tail_calls and not any(inst.opcode == "addr" for inst in self.function.instructions()):
+            self._tail_calls = {inst for inst in self.function.instructions() if self._is_tail_self_call(inst)}
+        self._schedule()
+        self._allocate_slots()
+        return self._emit()
+
+    # Preparation
+
+    def _remove_dead_code(self) -> None:
+        changed = True
+        while changed:
+            users = self.function.users()
+            changed = False
+            for block in self.function.blocks:
+                for inst in list(block.instructions):
+                    if inst.opcode not in SIDE_EFFECTS and not any(user is not inst for user in users[inst]):
+                        block.instructions.remove(inst)
+                        changed = True
+
+    def _split_critical_edges(self) -> None:
+        for block in list(self.function.blocks):
+            terminator = block.terminator
+            if len(terminator.targets) < 2:
+                continue
+            for position, target in enumerate(terminator.targets):
+                if not target.phis:
+                    continue
+                split = self.function.new_block()
+                self.function.blocks.remove(split)
+                self.function.blocks.insert(self.function.blocks.index(block) + 1, split)
+                jump = Instruction("jump", type=IRType.VOID)
+                jump.targets = [target]
+                split.append(jump)
+                terminator.targets[position] = split
+                for phi in target.phis:
+                    phi.incoming = [split if incoming is block else incoming for incoming in phi.incoming]
+
+    def _is_tail_self_call(self, inst: Instruction) -> bool:
+        """Check for a call to the function itself whose result is immediately returned."""
+        if inst.opcode != "call" or inst.name != self.function.name or len(inst.operands) != self.function.params:
+            return False
+        following = inst.block.instructions[inst.block.instructions.index(inst) + 1:]
+        return (
+            following[-1].opcode == "ret" and following[-1].operands[0] is inst
+            and all(other.opcode == "const" for other in following[:-1])
+            and self._users[inst] == [following[-1]]
+        )
+
+    def _is_variable(self, inst: Instruction) -> bool:
+        """Values kept in a frame slot."""
+        if inst.type == IRType.VOID or inst.opcode == "const" or inst in self._on_stack:
+            return False
+        return inst.opcode in ("param", "phi") or bool(self._users[inst])
+
+    # Stack scheduling
+
+    def _schedule(self) -> None:
+        """Find the values that can stay on the operand stack until their only use."""
+        for block in self.function.blocks:
+            for inst in block.instructions:
+                users = self._users[inst]
+                if (
+                    inst.opcode not in ("param", "phi") and len(users) == 1
+                    and users[0].block is block and users[0].opcode != "phi"
+                    # constants are only pushed early when it avoids a `swap`
+                    and (inst.opcode != "const" or users[0].operands[0] is inst)
+                ):
+                    self._on_stack.add(inst)
+
+        while True:
+            failed = self._simulate()
+            if not failed:
+                return
+            self._on_stack -= failed
+
+    def _simulate(self) -> set[Instruction]:
+        """
+        Simulate the operand stack, return the values that are not on top when used.
+        Also find where the `prep` of calls with arguments on the stack must go: before
+        the first instruction computing their first argument.
+        """
+        failed: set[Instruction] = set()
+        self._preps = {}
+        for block in self.function.blocks:
+            stack: list[Instruction] = []
+            # first instruction computing each value of the stack
+            starts: dict[Instruction, Instruction] = {}
+            for inst in block.instructions:
+                if inst.opcode == "phi":
+                    continue
+                pending = [operand for operand in inst.operands if operand in self._on_stack]
+                start = inst
+                if pending:
+                    if self._swapped_operands(inst) and stack[-1:] == pending:
+                        stack.pop()
+                    elif inst.operands[:len(pending)] == pending and stack[len(stack) - len(pending):] == pending:
+                        del stack[len(stack) - len(pending):]
+                    else:
+                        failed.update(pending)
+                        stack = [value for value in stack if value not in pending]
+                        pending = []
+                if pending:
+                    start = starts[pending[0]]
+                    if inst.opcode == "call" and inst not in self._tail_calls:
+                        # outer calls are prepared before the calls computing their arguments
+                        self._preps.setdefault(start, []).insert(0, inst)
+                if inst in self._on_stack:
+                    stack.append(inst)
+                    starts[inst] = start
+        return failed
+
+    def _swapped_operands(self, inst: Instruction) -> bool:
+        """Check for a binary instruction whose right operand only is on the stack."""
+        return (
+            len(inst.operands) == 2 and inst.opcode != "call"
+            and inst.operands[1] in self._on_stack
+            and inst.operands[0] not in self._on_stack
+        )
+
+    # Slot allocation
+
+    def _allocate_slots(self) -> None:
+        blocks = self.function.blocks
+        variables = [inst for block in blocks for inst in block.instructions if self._is_variable(inst)]
+        interference: dict[Instruction, set[Instruction]] = {value: set() for value in variables}
+
+        def interfere(value: Instruction, others: set[Instruction]) -> None:
+            for other in others:
+                if other is not value:
+                    interference[value].add(other)
+                    interference[other].add(value)
+
+        live_in, live_out = self._liveness()
+        for block in blocks:
+            live = set(live_out[block])
+            for step in reversed(self._steps(block)):
+                defs, uses = step
+                for value in defs:
+                    interfere(value, live | set(defs))
+                live -= set(defs)
+                live |= set(uses)
+        params = [inst for inst in self.function.entry.instructions if inst.opcode == "param"]
+        for param in params:
+            interfere(param, set(params) | live_in[self.function.entry])
+
+        # memory-resident locals keep their slot (their address may be taken)
+        reserved = set(range(self.function.frame)) if any(inst.opcode in ("get", "set", "addr") for inst in self.function.instructions()) else set()
+        self._frame = max(self.function.params, len(reserved))
+        for param in params:
+            self._slots[param] = param.value
+        # phis of parameters first, so that they can take the slot of the parameter
+        variables.sort(key=lambda value: not (value.opcode == "phi" and any(operand in params for operand in value.operands)))
+        for value in variables:
+            if value in self._slots:
+                continue
+            taken = reserved | {self._slots[other] for other in interference[value] if other in self._slots}
+            if value.opcode == "phi":
+                related = value.operands
+            else:
+                related = [user for user in self._users[value] if user.opcode == "phi"]
+            preferred = [self._slots[other] for other in related if other in self._slots and self._slots[other] not in taken]
+            if preferred:
+                self._slots[value] = preferred[0]
+            else:
+                slot = 0
+                while slot in taken:
+                    slot += 1
+                self._slots[value] = slot
+            self._frame = max(self._frame, self._slots[value] + 1)
+
+    def _steps(self, block: Block) -> list[tuple[list[Instruction], list[Instruction]]]:
+        """Definitions and uses of variables, in execution order (phis are defined by the copies)."""
+        steps = []
+        for inst in block.instructions:
+            if inst.is_terminator and self._copies[block]:
+                dests = [phi for phi, _ in self._copies[block] if self._is_variable(phi)]
+                srcs = [value for _, value in self._copies[block] if self._is_variable(value)]
+                steps.append((dests, srcs))
+            if inst.opcode in ("phi", "param"):
+                continue
+            uses = [operand for operand in inst.operands if self._is_variable(operand)]
+            steps.append(([inst] if self._is_variable(inst) else [], uses))
+        return steps
+
+    def _liveness(self) -> tuple[dict[Block, set[Instruction]], dict[Block, set[Instruction]]]:
+        live_in: dict[Block, set[Instruction]] = {block: set() for block in self.function.blocks}
+        live_out: dict[Block, set[Instruction]] = {block: set() for block in self.function.blocks}
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(self.function.blocks):
+                out = set().union(*(live_in[succ] for succ in block.successors))
+                live = set(out)
+                for defs, uses in reversed(self._steps(block)):
+                    live -= set(defs)
+                    live |= set(uses)
+                if out != live_out[block] or live != live_in[block]:
+                    live_out[block], live_in[block] = out, live
+                    changed = True
+        return live_in, live_out
+
+    # Emission
+
+    def _label(self, block: Block) -> str:
+        if block is self.function.entry:
+            return self.function.name
+        return f"{self.function.name}.{block.label}"
+
+    def _add(self, opcode: Opcode, operand: int | str | None = None) -> None:
+        self._code.emit(opcode, operand)
+
+    def _push(self, value: Instruction) -> None:
+        if value in self._on_stack:
+            return
+        if value.opcode == "const":
+            self._add(Opcode.PUSH, value.value)
+        else:
+            self._add(Opcode.GET, self._slots[value])
+
+    def _emit(self) -> Assembly:
+        self._code = Assembly()
+        blocks = self.function.blocks
+        for position, block in enumerate(blocks):
+            self._code.label(self._label(block))
+            if block is self.function.entry and self._frame > self.function.params:
+                self._add(Opcode.RESN, self._frame - self.function.params)
+            if block is self.function.entry and self._tail_calls:
+                self._code.label(f"{self.function.name}.entry")
+            following = blocks[position + 1] if position + 1 < len(blocks) else None
+            for inst in block.instructions:
+                if inst.is_terminator:
+                    self._emit_copies(block)
+                    self._emit_terminator(inst, following)
+                else:
+                    self._emit_instruction(inst)
+        return self._code
+
+    def _emit_instruction(self, inst: Instruction) -> None:
+        for call in self._preps.get(inst, []):
+            self._add(Opcode.PREP, call.name)
+        match inst.opcode:
+            case "const" if inst in self._on_stack:
+                self._add(Opcode.PUSH, inst.value)
+                return
+            case "const" | "param" | "phi":
+                return
+            case "call" if inst in self._tail_calls:
+                for operand in inst.operands:
+                    self._push(operand)
+                for index in reversed(range(len(inst.operands))):
+                    self._add(Opcode.SET, index)
+                self._add(Opcode.JUMP, f"{self.function.name}.entry")
+                return
+            case "call":
+                if not any(inst in calls for calls in self._preps.values()):
+                    self._add(Opcode.PREP, inst.name)
+                for operand in inst.operands:
+                    self._push(operand)
+                self._add(Opcode.CALL, len(inst.operands))
+            case "neg":
+                self._add(Opcode.PUSH, 0)
+                if inst.operands[0] in self._on_stack:
+                    self._add(Opcode.SWAP)
+                self._push(inst.operands[0])
+                self._add(Opcode.SUB)
+            case "addr":
+                self._add(Opcode.PREP, "start")
+                self._add(Opcode.SWAP)
+                self._add(Opcode.DROP, 1)
+                self._add(Opcode.PUSH, 1)
+                self._add(Opcode.SUB)
+                self._add(Opcode.PUSH, inst.value)
+                self._add(Opcode.SUB)
+            case "get":
+                self._add(Opcode.GET, inst.value)
+            case _:
+                for operand in inst.operands:
+                    self._push(operand)
+                opcode = {"load": "read", "store": "write", "debug": "dbg"}.get(inst.opcode, inst.opcode)
+                if self._swapped_operands(inst):
+                    if inst.opcode in _SWAPPED:
+                        opcode = _SWAPPED[inst.opcode]
+                    elif inst.opcode not in _COMMUTATIVE:
+                        self._add(Opcode.SWAP)
+                self._add(Opcode.from_mnemonic(opcode), inst.value if opcode == "set" else None)
+
+        if inst in self._on_stack:
+            return
+        if self._is_variable(inst):
+            self._add(Opcode.SET, self._slots[inst])
+        elif inst.type != IRType.VOID:
+            self._add(Opcode.DROP, 1)
+
+    def _emit_copies(self, block: Block) -> None:
+        copies = [
+            (phi, value) for phi, value in self._copies[block]
+            if self._is_variable(phi) and self._slots[phi] != self._slots.get(value)
+        ]
+        for _, value in copies:
+            self._push(value)
+        for phi, _ in reversed(copies):
+            self._add(Opcode.SET, self._slots[phi])
+
+    def _emit_terminator(self, inst: Instruction, following: Block | None) -> None:
+        match inst.opcode:
+            case "jump":
+                if inst.targets[0] is not following:
+                    self._add(Opcode.JUMP, self._label(inst.targets[0]))
+            case "branch":
+                self._push(inst.operands[0])
+                if_true, if_false = inst.targets
+                if if_true is following:
+                    self._add(Opcode.JUMPF, self._label(if_false))
+                elif if_false is following:
+                    self._add(Opcode.JUMPT, self._label(if_true))
+                else:
+                    self._add(Opcode.JUMPF, self._label(if_false))
+                    self._add(Opcode.JUMP, self._label(if_true))
+            case "ret":
+                if inst.operands[0] in self._tail_calls:
+                    return
+                self._push(inst.operands[0])
+                self._add(Opcode.RET)
+
+
+def generate_msm(function: Function, tail_calls: bool = True) -> Assembly:
+    """Generate the MSM assembly of a function in SSA form."""
+    return StackCodeGenerator(function, tail_calls).generate()
@@ -0,0 +1,88 @@
+from ..utils.errors import CompilationError
+
+from .core import BINARY_OPCODES, UNARY_OPCODES, Function, Instruction, IRType
+
+# Number of operands of each opcode (phis and calls are checked separately)
+_ARITY: dict[str, int] = {
+    "const": 0, "param": 0, "addr": 0, "get": 0, "set": 1,
+    "load": 1, "store": 2, "debug": 1,
+    "jump": 0, "branch": 1, "ret": 1,
+    **{opcode: 1 for opcode in UNARY_OPCODES},
+    **{opcode: 2 for opcode in BINARY_OPCODES},
+}
+_TARGETS: dict[str, int] = {"jump": 1, "branch": 2, "ret": 0}
+
+
+def verify_ir(function: Function) -> None:
+    """
+    Check the invariants of a function in SSA form: every block ends with its only
+    terminator, phis come first and have one operand per predecessor, operands are
+    non-void values defined in the function, and every definition dominates its uses.
+    Raise a `CompilationError` otherwise.
+    """
+    try:
+        _verify(function)
+    except ValueError as e:
+        raise CompilationError(f"Invalid IR in function '{function.name}': {e}")
+
+
+def _verify(function: Function) -> None:
+    if not function.blocks:
+        raise ValueError("function without blocks")
+    preds = function.predecessors()
+    if preds[function.entry]:
+        raise ValueError(f"entry block {function.entry.label} has predecessors")
+
+    defined: set[Instruction] = set()
+    for block in function.blocks:
+        if block.terminator is None:
+            raise ValueError(f"block {block.label} does not end with a terminator")
+        in_phis = True
+        for position, inst in enumerate(block.instructions):
+            where = f"{inst.opcode} in {block.label}"
+            if inst in defined:
+                raise ValueError(f"{where} appears twice")
+            defined.add(inst)
+            if inst.block is not block:
+                raise ValueError(f"{where} is not attached to its block")
+            if inst.is_terminator and position != len(block.instructions) - 1:
+                raise ValueError(f"{where} is not at the end of the block")
+            if inst.opcode == "phi":
+                if not in_phis:
+                    raise ValueError(f"{where} comes after other instructions")
+                if len(inst.operands) != len(inst.incoming) or set(inst.incoming) != set(preds[block]) or len(inst.incoming) != len(preds[block]):
+                    raise ValueError(f"{where} does not have one operand per predecessor")
+            else:
+                in_phis = False
+                if inst.opcode == "call":
+                    if not inst.name:
+                        raise ValueError(f"call without target in {block.label}")
+                elif inst.opcode not in _ARITY:
+                    raise ValueError(f"unknown opcode '{inst.opcode}' in {block.label}")
+                elif len(inst.operands) != _ARITY[inst.opcode]:
+                    raise ValueError(f"{where} with {len(inst.operands)} operands")
+            if len(inst.targets) != _TARGETS.get(inst.opcode, 0):
+                raise ValueError(f"{where} with {len(inst.targets)} targets")
+            if inst.targets and any(target not in preds for target in inst.targets):
+                raise ValueError(f"{where} jumps to a block outside of the function")
+            if (inst.type == IRType.VOID) != (inst.opcode in ("set", "store", "debug", "jump", "branch", "ret")):
+                raise ValueError(f"{where} has type {inst.type.value}")
+            if any(operand.type == IRType.VOID for operand in inst.operands):
+                raise ValueError(f"{where} uses a value without type")
+
+    dominators = function.dominators()
+    for block in function.blocks:
+        if block not in dominators:
+            raise ValueError(f"block {block.label} is unreachable")
+    for block in function.blocks:
+        for position, inst in enumerate(block.instructions):
+            for index, operand in enumerate(inst.operands):
+                if operand not in defined:
+                    raise ValueError(f"{inst.opcode} in {block.label} uses a value defined outside of the function")
+                # the operand of a phi is used at the end of the matching predecessor
+                use_block = inst.incoming[index] if inst.opcode == "phi" else block
+                if operand.block is use_block and inst.opcode != "phi":
+                    if operand.block.instructions.index(operand) >= position:
+                        raise ValueError(f"{inst.opcode} in {block.label} uses a value before its definition")
+                elif operand.block not in dominators[use_block]:
+                    raise ValueError(f"{inst.opcode} in {block.label} uses a value whose definition does not dominate it")
@@ -1,6 +1,7 @@
 from enum import Enum, auto
 from typing import Self
 
+from .asm import Instruction, Opcode
 from .token import TokenType
 
 from .utils.logger import Logger
@@ -62,6 +63,8 @@ class Node:
         self.repr: str = repr
         self.index: int = index
         self.children: list[Self] = children if children is not None else []
+        # execution counts read from a profile (see passes/profile.py)
+        self.counts: tuple[int, ...] | None = None
 
     # Dictionary of binary operators for priority parsing
     # operator: (priority, priority for right argument, corresponding NodeType)
@@ -92,36 +95,36 @@ class Node:
     }
 
     # Dictionary of "easy nodes" for code generation
-    # NodeType: (prefix_code, suffix_code)
-    # @ = index of variable, # = value of constant
-    EN: dict[NodeType, tuple[str, str]] = {
+    # NodeType: (prefix_instruction, suffix_instruction)
+    # operand "@" = index of variable, "#" = value of constant
+    EN: dict[NodeType, tuple[Instruction | None, Instruction | None]] = {
         # constants
-        NodeType.NODE_CONST:      ("push #", ""      ),
+        NodeType.NODE_CONST:      ((Opcode.PUSH, "#"), None                 ),
         # unary ops
-        NodeType.NODE_NOT:        (""      , "not"   ),
-        NodeType.NODE_NEG:        ("push 0", "sub"   ),
+        NodeType.NODE_NOT:        (None              , (Opcode.NOT, None)   ),
+        NodeType.NODE_NEG:        ((Opcode.PUSH, 0)  , (Opcode.SUB, None)   ),
         # binary ops
-        NodeType.NODE_ADD:        (""      , "add"   ),
-        NodeType.NODE_SUB:        (""      , "sub"   ),
-        NodeType.NODE_MUL:        (""      , "mul"   ),
-        NodeType.NODE_DIV:        (""      , "div"   ),
-        NodeType.NODE_MOD:        (""      , "mod"   ),
-        NodeType.NODE_AND:        (""      , "and"   ),
-        NodeType.NODE_OR:         (""      , "or"    ),
-        NodeType.NODE_EQ:         (""      , "cmpeq" ),
-        NodeType.NODE_NOT_EQ:     (""      , "cmpne" ),
-        NodeType.NODE_LOWER:      (""      , "cmplt" ),
-        NodeType.NODE_LOWER_EQ:   (""      , "cmple" ),
-        NodeType.NODE_GREATER:    (""      , "cmpgt" ),
-        NodeType.NODE_GREATER_EQ: (""      , "cmpge" ),
+        NodeType.NODE_ADD:        (None              , (Opcode.ADD, None)   ),
+        NodeType.NODE_SUB:        (None              , (Opcode.SUB, None)   ),
+        NodeType.NODE_MUL:        (None              , (Opcode.MUL, None)   ),
+        NodeType.NODE_DIV:        (None              , (Opcode.DIV, None)   ),
+        NodeType.NODE_MOD:        (None              , (Opcode.MOD, None)   ),
+        NodeType.NODE_AND:        (None              , (Opcode.AND, None)   ),
+        NodeType.NODE_OR:         (None              , (Opcode.OR, None)    ),
+        NodeType.NODE_EQ:         (None              , (Opcode.CMPEQ, None) ),
+        NodeType.NODE_NOT_EQ:     (None              , (Opcode.CMPNE, None) ),
+        NodeType.NODE_LOWER:      (None              , (Opcode.CMPLT, None) ),
+        NodeType.NODE_LOWER_EQ:   (None              , (Opcode.CMPLE, None) ),
+        NodeType.NODE_GREATER:    (None              , (Opcode.CMPGT, None) ),
+        NodeType.NODE_GREATER_EQ: (None              , (Opcode.CMPGE, None) ),
         # symbols
-        NodeType.NODE_DECLARE:    (""      , ""      ),  # no code needed
-        NodeType.NODE_REF:        ("get @" , ""      ),  # get @index
+        NodeType.NODE_DECLARE:    (None              , None                 ),  # no code needed
+        NodeType.NODE_REF:        ((Opcode.GET, "@") , None                 ),  # get @index
         # statements / helpers
-        NodeType.NODE_DEBUG:      (""      , "dbg"   ),
-        NodeType.NODE_BLOCK:      (""      , ""      ),  # children will just be added to the code with the loop
-        NodeType.NODE_DROP:       (""      , "drop 1"),
-        NodeType.NODE_SEQ:        (""      , ""      ),
+        NodeType.NODE_DEBUG:      (None              , (Opcode.DBG, None)   ),
+        NodeType.NODE_BLOCK:      (None              , None                 ),  # children will just be added to the code with the loop
+        NodeType.NODE_DROP:       (None              , (Opcode.DROP, 1)     ),
+        NodeType.NODE_SEQ:        (None              , None                 ),
     }
 
     def __str__(self) -> str:
@@ -1,47 +1,265 @@
+from .asm import Assembly
 from .node import Node, NodeType
 from .source import Source
 
-from typing import Callable
+from .passes.consteval import ConstantCallEvaluation, Interpreter, c_div, c_mod
+from .passes.dfe import DeadFunctionElimination
+from .passes.dse import DeadStoreElimination
+from .passes.fusion import LoopFusion
+from .passes.ivsr import StrengthReduction
+from .passes.licm import LoopInvariantCodeMotion
+from .passes.manager import PassManager
+from .passes.memo import Memoization
+from .passes.outline import Outlining
+from .passes.peephole import DEFAULT_RULES, Peephole, RuleDatabase
+from .passes.profile import Profile, ProfileInstrumentation
+from .passes.specialize import FunctionSpecialization
+from .passes.unroll import LoopUnrolling
+from .passes.verify import verify_function
+from .passes.vrp import ValueRangePropagation
 
+from .utils.logger import Logger
 
-def _c_div(a: int, b: int) -> int:
-    """Integer division that truncates toward zero (like in C)."""
-    quotient = abs(a) // abs(b)
-    if (a < 0) ^ (b < 0):
-        quotient = -quotient
-    return quotient
+from typing import Callable, Iterable
 
+class Optimizer:
+    # Every known pass, in pipeline order
+    # ('tailcall', 'rotate', 'jump', 'tailmerge', 'stack' and 'frame' are applied by the code generator, see `is_enabled`,
+    # 'peephole' works on the assembly, see `optimize_asm`, 'spec' and 'dfe' on the whole program, see
+    # `optimize_program`, and 'outline' on its assembly)
+    PASSES: list[str] = ["fold", "eval", "vrp", "dce", "fuse", "licm", "unroll", "ivsr", "dse", "tailcall", "rotate", "jump", "tailmerge", "stack", "frame", "peephole", "spec", "dfe", "outline"]
 
-def _c_mod(a: int, b: int) -> int:
-    """Modulo operation that matches C behavior."""
-    return a - _c_div(a, b) * b
+    # Optimization levels: -O0, -O1, -O2 (default), -Os
+    LEVELS: dict[str, set[str]] = {
+        "0": set(),
+        "1": {"fold", "dce", "dse", "tailcall", "rotate", "jump", "stack", "frame", "peephole", "dfe"},
+        "2": {"fold", "eval", "vrp", "dce", "fuse", "licm", "unroll", "ivsr", "dse", "tailcall", "rotate", "jump", "stack", "frame", "peephole", "spec", "dfe"},
+        "s": {"fold", "eval", "vrp", "dce", "fuse", "dse", "tailcall", "jump", "tailmerge", "stack", "frame", "peephole", "dfe", "outline"},
+    }
 
-class Optimizer:
-    def __init__(self, source_code: Source = None, verbose: bool = False):
+    def __init__(
+        self,
+        source_code: Source = None,
+        verbose: bool = False,
+        level: str = "2",
+        enable: Iterable[str] = (),
+        disable: Iterable[str] = (),
+        verify: bool = False,
+        eval_budget: int = 100_000,
+        unroll_factor: int = 4,
+        unroll_max_size: int = 256,
+        profile_generate: bool = False,
+        profile: Profile | None = None,
+        auto_memoize: bool = False,
+        memo_size: int = 1024,
+        memo_max_words: int = 16384,
+        spec_max_clones: int = 8,
+        peephole_rules: RuleDatabase | None = None,
+    ):
         self.source_code = source_code
         self.verbose = verbose
+        self.eval_budget = eval_budget
+        self.unroll_factor = unroll_factor
+        self.unroll_max_size = unroll_max_size
+        self.spec_max_clones = spec_max_clones
+        # counters added to functions (--profile-generate), counts read back (--profile-use)
+        self.instrumentation = ProfileInstrumentation() if profile_generate else None
+        self.profile = profile
+        # optimized functions, by name (callees available to compile-time evaluation)
+        self.functions: dict[str, Node] = {}
+        # memo tables of pure recursive functions (--auto-memoize), not in instrumented
+        # programs since the profile counters use the same memory
+        self.memoization = Memoization(self.functions, memo_size, memo_max_words) if auto_memoize and not profile_generate else None
+        # functions removed by whole-program optimizations
+        self.removed_functions: list[str] = []
+        # clones of functions for constant arguments (whole-program)
+        self.specialized_functions: list[str] = []
+        # loops merged by loop fusion (function and counter)
+        self.fused_loops: list[str] = []
+
+        if level not in self.LEVELS:
+            raise ValueError(f"Unknown optimization level '{level}'")
+        enabled = set(self.LEVELS[level])
+        for name in (*enable, *disable):
+            if name not in self.PASSES:
+                raise ValueError(f"Unknown optimization pass '{name}'")
+        enabled |= set(enable)
+        enabled -= set(disable)
+        self.enabled: list[str] = [name for name in self.PASSES if name in enabled]
+        # rewrites of short instruction sequences (the rules shipped with the compiler by default)
+        self.peephole = None
+        if self.is_enabled("peephole"):
+            self.peephole = Peephole(peephole_rules if peephole_rules is not None else RuleDatabase.from_path(DEFAULT_RULES))
+        # repeated sequences moved to subroutines (-Os): the assembly is kept until the end of the program
+        self.outlining = Outlining() if self.is_enabled("outline") else None
+        self._program = Assembly()
+
+        self._changes: int = 0
+        self.pass_manager = PassManager()
+        for name in self.enabled:
+            run = self._pass_function(name)
+            if run is not None:
+                self.pass_manager.add(name, run)
+        if verify:
+            self.pass_manager.add_hook(lambda name, func: verify_function(func, after=name))
+
+    def is_enabled(self, name: str) -> bool:
+        """Check if a pass is enabled (also used for passes applied by other steps, like 'tailcall')."""
+        return name in self.enabled
 
     def optimize_ast(self, node: Node | None) -> Node | None:
-        """Optimize the AST with constant folding and dead code elimination."""
+        """
+        Optimize the AST.
+        Functions go through the enabled passes until a fixed point is reached,
+        other nodes only get constant folding and dead code elimination.
+        Functions are instrumented or annotated with their profile first, if any,
+        and pure recursive functions get a memo table last (`--auto-memoize`).
+        """
+        if node is None:
+            return None
+
+        if node.type == NodeType.NODE_FUNCTION:
+            if self.instrumentation is not None:
+                self.instrumentation.run(node)
+            if self.profile is not None:
+                self.profile.annotate(node)
+            return self._optimize_function(node)
+
+        return self._simplify(node, fold=self.is_enabled("fold"), dce=self.is_enabled("dce"))
+
+    def optimize_program(self, nodes: list[Node]) -> list[Node]:
+        """
+        Optimize a whole program (every function at once).
+        Unlike `optimize_ast` on functions one by one, calls to functions defined
+        later in the file can be evaluated, functions are specialized for the
+        constant arguments they get, and unreachable functions are removed.
+        """
+        for node in nodes:
+            if node is not None and node.type == NodeType.NODE_FUNCTION:
+                self.functions[node.repr] = node
+        nodes = [self.optimize_ast(node) for node in nodes]
+
+        if self.is_enabled("spec"):
+            specialization = FunctionSpecialization(self.functions, self.spec_max_clones)
+            optimized = 0
+            while True:
+                nodes = specialization.run(nodes)
+                if len(specialization.clones) == optimized:
+                    break
+                # clones keep the profile counters or counts of the function they were copied from,
+                # and their calls may get constant arguments once they are optimized
+                for node in specialization.clones[optimized:]:
+                    self._optimize_function(node)
+                optimized = len(specialization.clones)
+            self.specialized_functions.extend(node.repr for node in specialization.clones)
+
+        if self.is_enabled("dfe"):
+            dfe = DeadFunctionElimination()
+            nodes = dfe.run(nodes)
+            for name in dfe.removed:
+                del self.functions[name]
+            self.removed_functions.extend(dfe.removed)
+        return nodes
+
+    def _optimize_function(self, node: Node) -> Node:
+        self.pass_manager.run(node)
+        self.functions[node.repr] = node
+        if self.memoization is not None and self.memoization.run(node):
+            # compile-time evaluation keeps using the function without its table
+            self.functions[node.repr] = self.memoization.originals[node.repr]
+        if self.verbose:
+            Logger.log("Optimization (AST):")
+            node.print(mode="beautify")
+        return node
+
+    def _pass_function(self, name: str) -> Callable[[Node], int] | None:
+        match name:
+            case "fold":
+                return lambda func: self._simplify_body(func, fold=True, dce=False)
+            case "eval":
+                interpreter = Interpreter(self.functions, self._UNARY_FOLDERS, self._BINARY_FOLDERS, self.eval_budget)
+                return ConstantCallEvaluation(interpreter).run
+            case "vrp":
+                return ValueRangePropagation().run
+            case "dce":
+                return lambda func: self._simplify_body(func, fold=False, dce=True)
+            case "fuse":
+                fusion = LoopFusion()
+                self.fused_loops = fusion.fused
+                return fusion.run
+            case "licm":
+                return LoopInvariantCodeMotion().run
+            case "unroll":
+                return LoopUnrolling(self.unroll_factor, self.unroll_max_size, self.profile).run
+            case "ivsr":
+                return StrengthReduction().run
+            case "dse":
+                return DeadStoreElimination().run
+        return None
+
+    def _simplify_body(self, func: Node, fold: bool, dce: bool) -> int:
+        """Fold constants and/or eliminate dead code in a function body. Return the number of changes."""
+        if not func.children:
+            return 0
+        self._changes = 0
+        body = self._simplify(func.children[-1], fold=fold, dce=dce)
+        func.children[-1] = body if body is not None else Node(NodeType.NODE_BLOCK)
+        return self._changes
+
+    def _simplify(self, node: Node | None, fold: bool, dce: bool) -> Node | None:
         if node is None:
             return None
 
         optimized_children: list[Node] = []
-        for child in node.children:
-            optimized = self.optimize_ast(child)
+        for index, child in enumerate(node.children):
+            optimized = self._simplify(child, fold, dce)
+            if optimized is None and node.type == NodeType.NODE_COND and index == 1:
+                # the then branch keeps its place (before the else branch)
+                optimized = Node(NodeType.NODE_BLOCK)
             if optimized is not None:
                 optimized_children.append(optimized)
+        if len(optimized_children) != len(node.children):
+            self._changes += 1
         node.children = optimized_children
 
-        node = self._fold_constants(node)
-        node = self._eliminate_dead_code(node)
+        if fold:
+            node = self._fold_constants(node)
+        if dce:
+            simplified = self._eliminate_dead_code(node)
+            if simplified is not node:
+                self._changes += 1
+            node = simplified
         return node
 
-    def optimize_asm(self, asm: list[str]) -> list[str]:
-        """Optimize the generated assembly code (unused)."""
-        # unused
+    def optimize_asm(self, asm: Assembly) -> Assembly:
+        """
+        Optimize generated assembly code: the whole program, or one function at a time
+        when the output is streamed: peephole rewrites, then instrumented programs are sent
+        to their profile output.
+        With outlining, the code is only output by `finish_asm`, once the whole program is known.
+        """
+        if self.peephole is not None:
+            self.peephole.run(asm)
+        if self.instrumentation is not None:
+            asm = self.instrumentation.exit(asm)
+        if self.outlining is not None:
+            self._program.extend(asm)
+            return Assembly()
         return asm
 
+    def finish_asm(self) -> Assembly:
+        """
+        Code to add at the end of the program: the program itself with outlining, then
+        the profile output of instrumented programs.
+        """
+        code = Assembly()
+        if self.outlining is not None:
+            code, self._program = self._program, Assembly()
+            self.outlining.run(code)
+        if self.instrumentation is not None:
+            code.extend(self.instrumentation.output())
+        return code
+
     def _fold_constants(self, node: Node) -> Node:
         if not node.children:
             return node
@@ -104,6 +322,8 @@ class Optimizer:
                         flattened.extend(child.children)
                     else:
                         flattened.append(child)
+                if len(flattened) != len(node.children):
+                    self._changes += 1
                 node.children = flattened
                 if not node.children:
                     return None
@@ -119,8 +339,8 @@ class Optimizer:
             case _:
                 return node
 
-    @staticmethod
-    def _turn_into_const(node: Node, value: int) -> None:
+    def _turn_into_const(self, node: Node, value: int) -> None:
+        self._changes += 1
         node.type = NodeType.NODE_CONST
         node.value = value
         node.children = []
@@ -144,8 +364,8 @@ class Optimizer:
         NodeType.NODE_ADD: lambda a, b: a + b,
         NodeType.NODE_SUB: lambda a, b: a - b,
         NodeType.NODE_MUL: lambda a, b: a * b,
-        NodeType.NODE_DIV: _c_div,
-        NodeType.NODE_MOD: _c_mod,
+        NodeType.NODE_DIV: c_div,
+        NodeType.NODE_MOD: c_mod,
         NodeType.NODE_AND: lambda a, b: 1 if (a != 0 and b != 0) else 0,
         NodeType.NODE_OR: lambda a, b: 1 if (a != 0 or b != 0) else 0,
         NodeType.NODE_EQ: lambda a, b: 1 if a == b else 0,
@@ -0,0 +1,185 @@
+from ..node import Node, NodeType
+
+from .analysis import param_count, walk
+
+# Pointer to a slot of the frame that cannot be determined (unknown offset from an address),
+# which may also point outside of the frame
+ANY_SLOT = None
+# Any address outside of the frame (parameters, constants, `*0`, ...)
+OUTSIDE = -1
+
+_NOT_POINTERS = {
+    NodeType.NODE_NOT, NodeType.NODE_AND, NodeType.NODE_OR,
+    NodeType.NODE_EQ, NodeType.NODE_NOT_EQ,
+    NodeType.NODE_LOWER, NodeType.NODE_LOWER_EQ,
+    NodeType.NODE_GREATER, NodeType.NODE_GREATER_EQ,
+}
+
+
+class AliasAnalysis:
+    """
+    Points-to analysis of the frame slots of a function.
+
+    Every expression gets the set of slots it may point to: `&x` points to `x`,
+    `&x + 1` to the slot after `x` (slot `x - 1`, the frame grows down), and
+    pointers flow through assignments, `*p = q` stores and `*p` loads. Adding a
+    value that is not a constant to a pointer can reach any slot of the frame
+    (this is how arrays are emulated), as can the callee of a call that gets a
+    pointer to the frame, or any code once such a pointer is stored in memory:
+    the pointer escapes, and then every slot is aliased.
+
+    The analysis is flow-insensitive (one set per slot for the whole function).
+    Values that do not come from `&` (parameters, constants, `*0`, ...) point
+    outside of the frame, and local variables are assumed to be assigned before
+    they are used as pointers.
+    """
+
+    def __init__(self, func: Node) -> None:
+        self.slots = param_count(func) + (func.value or 0)
+        # pointer values each slot may hold
+        self.contents: dict[int, set[int | None]] = {}
+        # a pointer to the frame may be used by code outside the function
+        self.escaped = False
+        body = func.children[-1] if func.type == NodeType.NODE_FUNCTION and func.children else None
+        if body is not None and any(n.type == NodeType.NODE_ADDRESS for n in walk(body)):
+            for index in range(param_count(func)):
+                self.contents[index] = {OUTSIDE}
+            self._solve(body)
+        self.aliased: set[int] = self._accessed(body)
+
+    def points_to(self, address: Node) -> set[int]:
+        """Slots of the frame that `*address` may access."""
+        if self.escaped:
+            return set(range(self.slots))
+        return self._expand(self._values(address))
+
+    def may_alias(self, address: Node, slot: int) -> bool:
+        """Check if `*address` may access the frame slot `slot`."""
+        return slot in self.points_to(address)
+
+    def may_point_anywhere(self, address: Node) -> bool:
+        """Check if `*address` may access a slot of the frame that cannot be determined."""
+        return self.escaped or ANY_SLOT in self._values(address)
+
+    def may_point_outside(self, address: Node) -> bool:
+        """Check if `*address` may access memory outside of the frame."""
+        return bool(self._values(address) & {OUTSIDE, ANY_SLOT})
+
+    def clobbered(self, node: Node) -> set[int]:
+        """Slots that pointer writes and calls in `node` may modify."""
+        slots: set[int] = set()
+        for n in walk(node):
+            if n.type == NodeType.NODE_CALL and self.escaped:
+                return set(range(self.slots))
+            if n.type == NodeType.NODE_AFFECT and n.children[0].type == NodeType.NODE_DEREF:
+                slots |= self.points_to(n.children[0].children[0])
+        return slots
+
+    def _solve(self, body: Node) -> None:
+        """Propagate pointer values until nothing changes."""
+        changed = True
+        while changed:
+            changed = False
+            for node in walk(body):
+                if node.type == NodeType.NODE_AFFECT:
+                    target, expr = node.children
+                    values = self._values(expr)
+                    if target.type == NodeType.NODE_REF:
+                        changed |= self._store({target.index}, values)
+                    else:
+                        address = self._values(target.children[0])
+                        changed |= self._store(self._expand(address), values)
+                        if OUTSIDE in address or ANY_SLOT in address:
+                            changed |= self._escape(values)
+                elif node.type == NodeType.NODE_CALL:
+                    for arg in node.children[1:]:
+                        changed |= self._escape(self._values(arg))
+
+    def _store(self, slots: set[int], values: set[int | None]) -> bool:
+        changed = False
+        for slot in slots:
+            contents = self.contents.setdefault(slot, set())
+            if not values <= contents:
+                contents |= values
+                changed = True
+        return changed
+
+    def _escape(self, values: set[int | None]) -> bool:
+        if values - {OUTSIDE} and not self.escaped:
+            self.escaped = True
+            return True
+        return False
+
+    def _accessed(self, body: Node | None) -> set[int]:
+        """Slots read or written through a pointer somewhere in the function."""
+        if body is None:
+            return set()
+        if self.escaped:
+            return set(range(self.slots))
+        slots: set[int] = set()
+        for node in walk(body):
+            if node.type == NodeType.NODE_DEREF:
+                slots |= self.points_to(node.children[0])
+        return slots
+
+    def _expand(self, values: set[int | None]) -> set[int]:
+        """Slots of the frame among pointer values."""
+        if ANY_SLOT in values:
+            return set(range(self.slots))
+        return values - {OUTSIDE}
+
+    def _values(self, node: Node) -> set[int | None]:
+        """Slots of the frame the value of `node` may point to."""
+        match node.type:
+            case NodeType.NODE_CONST:
+                return {OUTSIDE}
+            case NodeType.NODE_REF:
+                return set(self.contents.get(node.index, ()))
+            case NodeType.NODE_ADDRESS:
+                target = node.children[0]
+                if target.type == NodeType.NODE_REF:
+                    return {target.index}
+                return self._values(target.children[0])
+            case NodeType.NODE_DEREF:
+                address = self._values(node.children[0])
+                loaded: set[int | None] = set()
+                if OUTSIDE in address or ANY_SLOT in address:
+                    loaded = {OUTSIDE, ANY_SLOT} if self.escaped else {OUTSIDE}
+                for slot in self._expand(address):
+                    loaded |= self.contents.get(slot, set())
+                return loaded
+            case NodeType.NODE_AFFECT:
+                return self._values(node.children[1])
+            case NodeType.NODE_CALL:
+                return {OUTSIDE, ANY_SLOT} if self.escaped else {OUTSIDE}
+            case NodeType.NODE_ADD | NodeType.NODE_SUB:
+                left, right = node.children
+                if right.type == NodeType.NODE_CONST:
+                    # &x + c is the address of slot x - c
+                    shift = -right.value if node.type == NodeType.NODE_ADD else right.value
+                    return self._shift(self._values(left), shift)
+                if left.type == NodeType.NODE_CONST and node.type == NodeType.NODE_ADD:
+                    return self._shift(self._values(right), -left.value)
+            case _ if node.type in _NOT_POINTERS:
+                return {OUTSIDE}
+
+        values: set[int | None] = {OUTSIDE}
+        for child in node.children:
+            values |= self._values(child)
+        return {OUTSIDE, ANY_SLOT} if values - {OUTSIDE} else {OUTSIDE}
+
+    def _shift(self, values: set[int | None], shift: int) -> set[int | None]:
+        shifted: set[int | None] = set()
+        for slot in values:
+            if slot in (ANY_SLOT, OUTSIDE):
+                shifted.add(slot)
+            elif 0 <= slot + shift < self.slots:
+                shifted.add(slot + shift)
+            else:
+                shifted.add(ANY_SLOT)
+        return shifted
+
+
+def aliased_slots(func: Node) -> set[int]:
+    """Frame slots of `func` that may be accessed through a pointer (see `AliasAnalysis`)."""
+    return AliasAnalysis(func).aliased
@@ -0,0 +1,150 @@
+from typing import Iterator
+
+from ..node import Node, NodeType
+
+
+# Operators without side effects that cannot fault at runtime
+SAFE_OPERATORS: set[NodeType] = {
+    NodeType.NODE_NOT, NodeType.NODE_NEG,
+    NodeType.NODE_ADD, NodeType.NODE_SUB, NodeType.NODE_MUL,
+    NodeType.NODE_AND, NodeType.NODE_OR,
+    NodeType.NODE_EQ, NodeType.NODE_NOT_EQ,
+    NodeType.NODE_LOWER, NodeType.NODE_LOWER_EQ,
+    NodeType.NODE_GREATER, NodeType.NODE_GREATER_EQ,
+}
+
+
+def walk(node: Node | None) -> Iterator[Node]:
+    """Iterate over `node` and all its descendants (pre-order)."""
+    if node is None:
+        return
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        stack.extend(reversed(current.children))
+
+
+def param_count(func: Node) -> int:
+    """Number of parameters of a function node (its last child is the body)."""
+    return max(len(func.children) - 1, 0)
+
+
+def written_slots(node: Node) -> set[int]:
+    """Frame slots directly assigned somewhere in `node`."""
+    slots: set[int] = set()
+    for n in walk(node):
+        if n.type == NodeType.NODE_AFFECT and n.children[0].type == NodeType.NODE_REF:
+            slots.add(n.children[0].index)
+    return slots
+
+
+def address_taken_slots(node: Node) -> set[int]:
+    """Frame slots whose address is taken with `&` somewhere in `node`."""
+    slots: set[int] = set()
+    for n in walk(node):
+        if n.type == NodeType.NODE_ADDRESS and n.children and n.children[0].type == NodeType.NODE_REF:
+            slots.add(n.children[0].index)
+    return slots
+
+
+def writes_memory(node: Node) -> bool:
+    """Check if `node` may write memory other than its own named slots (pointer writes or calls)."""
+    for n in walk(node):
+        if n.type == NodeType.NODE_CALL:
+            return True
+        if n.type == NodeType.NODE_AFFECT and n.children[0].type == NodeType.NODE_DEREF:
+            return True
+    return False
+
+
+def is_pure(node: Node) -> bool:
+    """Check if evaluating `node` has no side effect (it may still fault, e.g. `*p` or `a / b`)."""
+    for n in walk(node):
+        if n.type in (NodeType.NODE_AFFECT, NodeType.NODE_CALL, NodeType.NODE_DEBUG):
+            return False
+    return True
+
+
+def is_safe(node: Node) -> bool:
+    """Check if evaluating `node` has no side effect and cannot fault (it may be evaluated even if not needed)."""
+    for n in walk(node):
+        if n.type in (NodeType.NODE_CONST, NodeType.NODE_REF, NodeType.NODE_ADDRESS) or n.type in SAFE_OPERATORS:
+            continue
+        divisor = n.children[1] if n.type in (NodeType.NODE_DIV, NodeType.NODE_MOD) else None
+        if divisor is None or divisor.type != NodeType.NODE_CONST or divisor.value in (0, -1):
+            return False
+    return True
+
+
+def structural_key(node: Node) -> tuple:
+    """Hashable key identifying an expression tree up to node identity."""
+    return (node.type, node.value, node.index, tuple(structural_key(c) for c in node.children))
+
+
+def induction_step(statement: Node, counter: int) -> int | None:
+    """Step of an `i = i + c` / `i = i - c` statement on the `counter` slot (None for other statements)."""
+    if statement.type != NodeType.NODE_DROP or statement.children[0].type != NodeType.NODE_AFFECT:
+        return None
+    target, value = statement.children[0].children
+    if target.type != NodeType.NODE_REF or target.index != counter:
+        return None
+    if value.type not in (NodeType.NODE_ADD, NodeType.NODE_SUB):
+        return None
+    ref, amount = value.children
+    if ref.type != NodeType.NODE_REF or ref.index != counter or amount.type != NodeType.NODE_CONST or not amount.value:
+        return None
+    return amount.value if value.type == NodeType.NODE_ADD else -amount.value
+
+
+def clone(node: Node) -> Node:
+    """Deep copy of an AST subtree."""
+    copy = Node(node.type, value=node.value, repr=node.repr, index=node.index, children=[clone(c) for c in node.children])
+    copy.counts = node.counts
+    return copy
+
+
+def new_slot(func: Node, name: str) -> Node:
+    """Reserve a new local slot in `func` and return a reference to it."""
+    index = param_count(func) + (func.value or 0)
+    func.value = (func.value or 0) + 1
+    return Node(NodeType.NODE_REF, repr=name, index=index)
+
+
+def replace(node: Node, other: Node) -> None:
+    """Turn `node` into `other` in place, so that parents see the change."""
+    node.type = other.type
+    node.value = other.value
+    node.repr = other.repr
+    node.index = other.index
+    node.children = other.children
+    node.counts = other.counts
+
+
+def renumber_slots(func: Node) -> int:
+    """
+    Compact the local slots of `func` so that unused ones are removed from its frame.
+    Parameters keep their slots (they are filled by the caller), and the frame of a
+    function that takes an address is kept as it is, since pointer arithmetic may
+    reach a slot next to the variable (arrays are emulated this way).
+    Return the number of slots removed.
+    """
+    if any(n.type == NodeType.NODE_ADDRESS for n in walk(func)):
+        return 0
+    params = param_count(func)
+    refs = [n for n in walk(func) if n.type == NodeType.NODE_REF and n.index is not None and n.index >= params]
+    mapping = {old: params + new for new, old in enumerate(sorted({n.index for n in refs}))}
+    for ref in refs:
+        ref.index = mapping[ref.index]
+    removed = (func.value or 0) - len(mapping)
+    func.value = len(mapping)
+    return removed
+
+
+def called_functions(node: Node) -> set[str]:
+    """Names of the functions called somewhere in `node`."""
+    return {
+        n.children[0].repr
+        for n in walk(node)
+        if n.type == NodeType.NODE_CALL and n.children and n.children[0].repr is not None
+    }
@@ -0,0 +1,237 @@
+from typing import Callable
+
+from ..node import Node, NodeType
+
+from .analysis import param_count, replace
+
+INT_MIN = -2**31
+INT_MAX = 2**31 - 1
+
+
+def c_div(a: int, b: int) -> int:
+    """Integer division that truncates toward zero (like in C)."""
+    quotient = abs(a) // abs(b)
+    if (a < 0) ^ (b < 0):
+        quotient = -quotient
+    return quotient
+
+
+def c_mod(a: int, b: int) -> int:
+    """Modulo operation that matches C behavior."""
+    return a - c_div(a, b) * b
+
+
+class EvaluationAborted(Exception):
+    """The call cannot be evaluated at compile time (side effect, fault, budget exhausted...)."""
+
+
+class _Break(Exception):
+    pass
+
+
+class _Continue(Exception):
+    pass
+
+
+class _Return(Exception):
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+
+class Interpreter:
+    """
+    AST interpreter for side-effect free functions.
+
+    Any operation whose effect is not limited to the function's own frame (debug,
+    pointers, calls to unknown functions) aborts the evaluation, as do reads of
+    uninitialized variables, divisions by zero, results outside of the `int` range
+    and running out of steps (every evaluated node costs one step).
+    Arithmetic uses the optimizer's folders, hence C truncation semantics.
+    Results are cached per (function, arguments) since evaluated functions are pure.
+    """
+
+    MAX_DEPTH = 64
+
+    def __init__(
+        self,
+        functions: dict[str, Node],
+        unary: dict[NodeType, Callable[[int], int]],
+        binary: dict[NodeType, Callable[[int, int], int]],
+        budget: int,
+    ) -> None:
+        self.functions = functions
+        self.unary = unary
+        self.binary = binary
+        self.budget = budget
+        self._steps: int = 0
+        self._depth: int = 0
+        self._cache: dict[tuple[str, tuple[int, ...]], int] = {}
+
+    def call(self, name: str, args: list[int]) -> int:
+        """Evaluate `name(args)` with a fresh step budget. Raise `EvaluationAborted` on failure."""
+        self._steps = 0
+        self._depth = 0
+        try:
+            return self._call(name, tuple(args))
+        except RecursionError:
+            raise EvaluationAborted("Python recursion limit reached")
+
+    def _call(self, name: str, args: tuple[int, ...]) -> int:
+        key = (name, args)
+        if key in self._cache:
+            return self._cache[key]
+
+        func = self.functions.get(name)
+        if func is None or not func.children or param_count(func) != len(args):
+            raise EvaluationAborted(f"unknown function '{name}'")
+        if self._depth >= self.MAX_DEPTH:
+            raise EvaluationAborted("call depth limit reached")
+
+        frame: list[int | None] = [*args] + [None] * (func.value or 0)
+        self._depth += 1
+        try:
+            self._exec(func.children[-1], frame)
+            result = 0
+        except _Return as ret:
+            result = ret.value
+        finally:
+            self._depth -= 1
+
+        self._cache[key] = result
+        return result
+
+    def _step(self) -> None:
+        self._steps += 1
+        if self._steps > self.budget:
+            raise EvaluationAborted("step budget exhausted")
+
+    # Statements
+
+    def _exec(self, node: Node, frame: list[int | None]) -> None:
+        self._step()
+        match node.type:
+            case NodeType.NODE_BLOCK | NodeType.NODE_SEQ:
+                self._exec_list(node.children, frame)
+            case NodeType.NODE_DECLARE | NodeType.NODE_TARGET:
+                pass
+            case NodeType.NODE_DROP:
+                self._eval(node.children[0], frame)
+            case NodeType.NODE_COND:
+                if self._eval(node.children[0], frame):
+                    self._exec(node.children[1], frame)
+                elif len(node.children) > 2:
+                    self._exec(node.children[2], frame)
+            case NodeType.NODE_LOOP:
+                while True:
+                    try:
+                        self._exec_list(node.children, frame)
+                    except _Continue:
+                        pass
+                    except _Break:
+                        break
+            case NodeType.NODE_BREAK:
+                raise _Break()
+            case NodeType.NODE_CONTINUE:
+                raise _Continue()
+            case NodeType.NODE_RETURN:
+                raise _Return(self._eval(node.children[0], frame) if node.children else 0)
+            case _:
+                raise EvaluationAborted(f"unsupported statement {node.type.name}")
+
+    def _exec_list(self, nodes: list[Node], frame: list[int | None]) -> None:
+        i = 0
+        while i < len(nodes):
+            try:
+                self._exec(nodes[i], frame)
+                i += 1
+            except _Continue:
+                # resume after the continue target of the loop, if it is in this list
+                targets = [j for j in range(i + 1, len(nodes)) if nodes[j].type == NodeType.NODE_TARGET and nodes[j].value]
+                if not targets:
+                    raise
+                i = targets[0] + 1
+
+    # Expressions
+
+    def _eval(self, node: Node, frame: list[int | None]) -> int:
+        self._step()
+        match node.type:
+            case NodeType.NODE_CONST:
+                return node.value
+            case NodeType.NODE_REF:
+                value = frame[node.index]
+                if value is None:
+                    raise EvaluationAborted(f"read of uninitialized variable '{node.repr}'")
+                return value
+            case NodeType.NODE_AFFECT:
+                target = node.children[0]
+                if target.type != NodeType.NODE_REF:
+                    raise EvaluationAborted("write through a pointer")
+                value = self._eval(node.children[1], frame)
+                frame[target.index] = value
+                return value
+            case NodeType.NODE_CALL:
+                args = tuple(self._eval(arg, frame) for arg in node.children[1:])
+                return self._call(node.children[0].repr, args)
+            case NodeType.NODE_AND | NodeType.NODE_OR:
+                # the right operand is only evaluated if the left one does not decide (like in C)
+                left = self._eval(node.children[0], frame) != 0
+                if left == (node.type == NodeType.NODE_OR):
+                    return int(left)
+                return int(self._eval(node.children[1], frame) != 0)
+            case _ if node.type in self.unary:
+                return self._check(self.unary[node.type](self._eval(node.children[0], frame)))
+            case _ if node.type in self.binary:
+                left = self._eval(node.children[0], frame)
+                right = self._eval(node.children[1], frame)
+                if node.type in (NodeType.NODE_DIV, NodeType.NODE_MOD) and right == 0:
+                    raise EvaluationAborted("division by zero")
+                return self._check(self.binary[node.type](left, right))
+        raise EvaluationAborted(f"unsupported expression {node.type.name}")
+
+    @staticmethod
+    def _check(value: int) -> int:
+        if not INT_MIN <= value <= INT_MAX:
+            raise EvaluationAborted("integer overflow")
+        return value
+
+
+class ConstantCallEvaluation:
+    """
+    Replace calls to known functions with constant arguments by their result,
+    computed at compile time by the `Interpreter`:
+    ```
+    (CALL (REF square) (CONST 12))  =>  (CONST 144)
+    ```
+    Calls that cannot be evaluated (impure callee, budget exhausted, ...) are kept.
+    """
+
+    name = "eval"
+
+    def __init__(self, interpreter: Interpreter) -> None:
+        self.interpreter = interpreter
+        self._failed: set[tuple[str, tuple[int, ...]]] = set()
+
+    def run(self, func: Node) -> int:
+        """Run the pass on a function node. Return the number of calls replaced."""
+        if not func.children:
+            return 0
+        return self._visit(func.children[-1])
+
+    def _visit(self, node: Node) -> int:
+        changes = sum(self._visit(child) for child in node.children)
+        if node.type != NodeType.NODE_CALL:
+            return changes
+        if any(arg.type != NodeType.NODE_CONST for arg in node.children[1:]):
+            return changes
+
+        key = (node.children[0].repr, tuple(arg.value for arg in node.children[1:]))
+        if key in self._failed:
+            return changes
+        try:
+            value = self.interpreter.call(*key)
+        except EvaluationAborted:
+            self._failed.add(key)
+            return changes
+        replace(node, Node(NodeType.NODE_CONST, value=value))
+        return changes + 1
@@ -0,0 +1,36 @@
+from ..node import Node, NodeType
+
+from .analysis import called_functions
+
+
+class DeadFunctionElimination:
+    """
+    Remove the functions that cannot be reached from `main` through calls.
+    This is a whole-program pass: it needs every function of the program at once.
+    """
+
+    name = "dfe"
+
+    def __init__(self, root: str = "main") -> None:
+        self.root = root
+        self.removed: list[str] = []
+
+    def run(self, functions: list[Node]) -> list[Node]:
+        """Return the reachable functions (in their original order), and record the removed ones."""
+        by_name = {f.repr: f for f in functions if f.type == NodeType.NODE_FUNCTION}
+        if self.root not in by_name:
+            # nothing to start from, let the code generator report the missing entry point
+            return functions
+
+        reachable: set[str] = set()
+        worklist = [self.root]
+        while worklist:
+            name = worklist.pop()
+            if name in reachable or name not in by_name:
+                continue
+            reachable.add(name)
+            worklist.extend(called_functions(by_name[name]))
+
+        kept = [f for f in functions if f.type != NodeType.NODE_FUNCTION or f.repr in reachable]
+        self.removed.extend(f.repr for f in functions if f.type == NodeType.NODE_FUNCTION and f.repr not in reachable)
+        return kept
@@ -0,0 +1,119 @@
+from ..node import Node, NodeType
+
+from .alias import aliased_slots
+from .analysis import is_pure, renumber_slots, replace
+
+
+class DeadStoreElimination:
+    """
+    Remove assignments to local variables whose value is never read afterwards,
+    then drop the unused slots from the function frame.
+
+    Liveness is computed backwards over the AST, following the evaluation order of
+    the code generator (loops are iterated until their live sets are stable).
+    A dead store `x = e` is replaced by `e`, so the side effects of the initializer
+    are kept; if `e` is pure too, the whole statement is removed.
+    Variables whose address is taken are always considered live.
+    """
+
+    name = "dse"
+
+    def __init__(self) -> None:
+        self._aliased: set[int] = set()
+        self._needed: dict[int, bool] = {}
+        self._loops: list[dict[str, frozenset[int]]] = []
+
+    def run(self, func: Node) -> int:
+        """Run the pass on a function node. Return the number of removed stores and slots."""
+        if func.type != NodeType.NODE_FUNCTION or not func.children:
+            return 0
+        body = func.children[-1]
+        self._aliased = aliased_slots(func)
+        self._needed = {}
+        self._loops = []
+        self._live(body, frozenset())
+
+        changes = self._remove_dead_stores(body)
+        changes += renumber_slots(func)
+        return changes
+
+    # Liveness
+
+    def _live(self, node: Node, live: frozenset[int]) -> frozenset[int]:
+        """Return the slots live before `node`, given the slots live after it."""
+        match node.type:
+            case NodeType.NODE_REF:
+                if node.index is None:
+                    return live
+                return live | {node.index}
+
+            case NodeType.NODE_AFFECT:
+                target, value = node.children
+                if target.type == NodeType.NODE_REF:
+                    self._needed[id(node)] = self._needed.get(id(node), False) or self._is_live(target.index, live)
+                    return self._live(value, live - {target.index})
+                # value is evaluated before the address
+                return self._live(value, self._live(target.children[0], live))
+
+            case NodeType.NODE_COND:
+                after_then = self._live(node.children[1], live) if len(node.children) > 1 else live
+                after_else = self._live(node.children[2], live) if len(node.children) > 2 else live
+                return self._live(node.children[0], after_then | after_else)
+
+            case NodeType.NODE_AND | NodeType.NODE_OR:
+                # the right operand is only evaluated if the left one does not decide
+                left, right = node.children
+                return self._live(left, live | self._live(right, live))
+
+            case NodeType.NODE_LOOP:
+                head = frozenset()
+                while True:
+                    self._loops.append({"break": live, "continue": head, "head": head})
+                    try:
+                        new_head = self._live_sequence(node.children, head)
+                    finally:
+                        self._loops.pop()
+                    if new_head == head:
+                        return head
+                    head = new_head
+
+            case NodeType.NODE_TARGET:
+                loop = self._loops[-1]
+                loop["continue"] = live if node.value else loop["head"]
+                return live
+
+            case NodeType.NODE_BREAK:
+                return self._loops[-1]["break"]
+
+            case NodeType.NODE_CONTINUE:
+                return self._loops[-1]["continue"]
+
+            case NodeType.NODE_RETURN:
+                return self._live_sequence(node.children, frozenset())
+
+            case NodeType.NODE_CALL:
+                return self._live_sequence(node.children[1:], live)
+
+            case _:
+                return self._live_sequence(node.children, live)
+
+    def _live_sequence(self, nodes: list[Node], live: frozenset[int]) -> frozenset[int]:
+        for node in reversed(nodes):
+            live = self._live(node, live)
+        return live
+
+    def _is_live(self, index: int, live: frozenset[int]) -> bool:
+        return index in live or index in self._aliased
+
+    # Rewriting
+
+    def _remove_dead_stores(self, node: Node) -> int:
+        changes = sum(self._remove_dead_stores(child) for child in node.children)
+
+        if node.type == NodeType.NODE_AFFECT and self._needed.get(id(node)) is False:
+            replace(node, node.children[1])
+            changes += 1
+        if node.type == NodeType.NODE_DROP and node.children and is_pure(node.children[0]):
+            # nothing left to evaluate: turn the statement into an empty sequence
+            replace(node, Node(NodeType.NODE_SEQ))
+        return changes
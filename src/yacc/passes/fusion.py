@@ -0,0 +1,201 @@
+from ..node import Node, NodeType
+
+from .alias import AliasAnalysis
+from .analysis import induction_step, is_pure, structural_key, walk, writes_memory, written_slots
+
+
+class ForLoop:
+    """A `for (i = start; test; i = i +/- step) body` loop, with its init statement."""
+
+    def __init__(self, items: list[Node], init: Node, test: Node, seq: Node, counter: int) -> None:
+        # statements of the enclosing list the loop was made of (init and loop)
+        self.items = items
+        self.init = init
+        self.test = test
+        # (SEQ body (TARGET) increment)
+        self.seq = seq
+        self.counter = counter
+
+    @property
+    def body(self) -> Node:
+        return self.seq.children[0]
+
+    @property
+    def increment(self) -> Node:
+        return self.seq.children[2]
+
+    @property
+    def header(self) -> tuple:
+        return structural_key(self.init), structural_key(self.test), structural_key(self.increment)
+
+
+class LoopFusion:
+    """
+    Fuse consecutive `for` loops with the same header into one loop.
+
+    Two loops are fused if their init statement, test and increment are identical
+    and have no side effect other than setting the counter, if neither body writes
+    the counter or the variables of the header, and if running the bodies one
+    iteration after the other cannot change the result: the bodies do not exit
+    the loop (`break`, `continue`, `return`), no variable written by one body is
+    read or written by the other, and they do not both access memory written by
+    one of them or both print:
+    ```
+    for (i = 0; i < n; i++) s = s + i;
+    for (i = 0; i < n; i++) t = t + i * i;
+    =>
+    for (i = 0; i < n; i++) { s = s + i; t = t + i * i; }
+    ```
+    The fused loops are listed in `fused` (function name and counter).
+    """
+
+    name = "fuse"
+
+    def __init__(self) -> None:
+        self.fused: list[str] = []
+        self._alias: AliasAnalysis | None = None
+
+    def run(self, func: Node) -> int:
+        """Run the pass on a function node. Return the number of fused loops."""
+        if func.type != NodeType.NODE_FUNCTION or not func.children:
+            return 0
+        self._alias = AliasAnalysis(func)
+        changes = 0
+        for node in list(walk(func.children[-1])):
+            if node.type in (NodeType.NODE_BLOCK, NodeType.NODE_SEQ):
+                fused = self._fuse_list(node)
+                for counter in fused:
+                    self.fused.append(f"{func.repr} ({counter})")
+                changes += len(fused)
+        return changes
+
+    def _fuse_list(self, node: Node) -> list[str]:
+        """Fuse the loops of a statement list. Return the counter name of each fusion."""
+        fused: list[str] = []
+        index = 0
+        while index < len(node.children):
+            first = self._match(node.children, index)
+            if first is None:
+                index += 1
+                continue
+            after = index + len(first.items)
+            second = self._match(node.children, after)
+            if second is None or not self._can_fuse(first, second):
+                index = after
+                continue
+            # append the second body to the first loop, and drop the second loop
+            first.seq.children[0] = Node(NodeType.NODE_BLOCK, children=[first.body, second.body])
+            del node.children[after:after + len(second.items)]
+            fused.append(first.init.children[0].children[0].repr or f"@{first.counter}")
+        return fused
+
+    # Recognition
+
+    @staticmethod
+    def _match(items: list[Node], index: int) -> ForLoop | None:
+        """Match a `for` loop at `items[index]`: `(SEQ init loop)`, or `init` followed by `loop`."""
+        if index >= len(items):
+            return None
+        item = items[index]
+        if item.type == NodeType.NODE_SEQ and len(item.children) == 2:
+            init, loop = item.children
+            statements = [item]
+        elif index + 1 < len(items):
+            init, loop = item, items[index + 1]
+            statements = [init, loop]
+        else:
+            return None
+
+        if loop.type != NodeType.NODE_LOOP or len(loop.children) != 1 or loop.children[0].type != NodeType.NODE_COND:
+            return None
+        if init.type != NodeType.NODE_DROP or init.children[0].type != NodeType.NODE_AFFECT:
+            return None
+        target = init.children[0].children[0]
+        if target.type != NodeType.NODE_REF:
+            return None
+        cond = loop.children[0]
+        if len(cond.children) != 3 or cond.children[2].type != NodeType.NODE_BREAK:
+            return None
+        test, seq = cond.children[0], cond.children[1]
+        if seq.type != NodeType.NODE_SEQ or len(seq.children) != 3:
+            return None
+        body, marker, increment = seq.children
+        if marker.type != NodeType.NODE_TARGET or not marker.value:
+            return None
+        if induction_step(increment, target.index) is None:
+            return None
+        return ForLoop(statements, init, test, seq, target.index)
+
+    def _can_fuse(self, first: ForLoop, second: ForLoop) -> bool:
+        if first.header != second.header:
+            return False
+        if not is_pure(first.init.children[0].children[1]) or not is_pure(first.test):
+            return False
+        if first.counter in self._alias.aliased:
+            return False
+
+        header_reads = self._reads(first.init) | self._reads(first.test) | {first.counter}
+        reads = [self._reads(first.body), self._reads(second.body)]
+        writes = [self._writes(first.body), self._writes(second.body)]
+        if (writes[0] | writes[1]) & header_reads:
+            return False
+        if writes[0] & (reads[1] | writes[1]) or writes[1] & reads[0]:
+            return False
+        if not self._stays_in_loop(first.body) or not self._stays_in_loop(second.body):
+            return False
+
+        memory = [self._accesses_memory(first.body), self._accesses_memory(second.body)]
+        memory_writes = [writes_memory(first.body), writes_memory(second.body)]
+        if (memory_writes[0] and memory[1]) or (memory_writes[1] and memory[0]):
+            return False
+        if any(memory_writes) and (self._accesses_memory(first.init) or self._accesses_memory(first.test)):
+            return False
+        # the output of the loops and the point where they may fault must not be interleaved
+        effects = [self._has_output(first.body), self._has_output(second.body)]
+        faults = [self._may_fault(first.body), self._may_fault(second.body)]
+        return not (effects[0] and (effects[1] or faults[1])) and not (effects[1] and faults[0])
+
+    # Effects
+
+    def _reads(self, node: Node) -> set[int]:
+        """Slots read in `node`, directly or through pointers."""
+        slots: set[int] = set()
+        targets = {id(n.children[0]) for n in walk(node) if n.type == NodeType.NODE_AFFECT}
+        for n in walk(node):
+            if n.type == NodeType.NODE_REF and n.index is not None and id(n) not in targets:
+                slots.add(n.index)
+            elif n.type == NodeType.NODE_DEREF:
+                slots |= self._alias.points_to(n.children[0])
+        return slots
+
+    def _writes(self, node: Node) -> set[int]:
+        """Slots written in `node`, directly or through pointers and calls."""
+        return written_slots(node) | self._alias.clobbered(node)
+
+    @staticmethod
+    def _stays_in_loop(body: Node) -> bool:
+        """Check that `body` has no `return`, and no `break` or `continue` of the enclosing loop."""
+        def visit(node: Node, depth: int) -> bool:
+            if node.type == NodeType.NODE_RETURN:
+                return False
+            if node.type in (NodeType.NODE_BREAK, NodeType.NODE_CONTINUE) and depth == 0:
+                return False
+            inner = depth + (node.type == NodeType.NODE_LOOP)
+            return all(visit(child, inner) for child in node.children)
+        return visit(body, 0)
+
+    @staticmethod
+    def _accesses_memory(node: Node) -> bool:
+        return any(n.type in (NodeType.NODE_DEREF, NodeType.NODE_CALL) for n in walk(node))
+
+    @staticmethod
+    def _has_output(node: Node) -> bool:
+        return any(n.type in (NodeType.NODE_DEBUG, NodeType.NODE_CALL) for n in walk(node))
+
+    @staticmethod
+    def _may_fault(node: Node) -> bool:
+        """Check if `node` may stop the program (division by a value that is not a constant)."""
+        return any(
+            n.type in (NodeType.NODE_DIV, NodeType.NODE_MOD) and n.children[1].type != NodeType.NODE_CONST
+            for n in walk(node)
+        )
@@ -0,0 +1,228 @@
+from ..node import Node, NodeType
+
+from .alias import AliasAnalysis
+from .analysis import (
+    clone,
+    induction_step,
+    new_slot,
+    replace,
+    structural_key,
+    walk,
+    written_slots,
+)
+
+# comparisons of `base - i` and `base - n` for a comparison of `i` and `n`
+_REVERSED = {
+    NodeType.NODE_LOWER: NodeType.NODE_GREATER,
+    NodeType.NODE_LOWER_EQ: NodeType.NODE_GREATER_EQ,
+    NodeType.NODE_GREATER: NodeType.NODE_LOWER,
+    NodeType.NODE_GREATER_EQ: NodeType.NODE_LOWER_EQ,
+    NodeType.NODE_EQ: NodeType.NODE_EQ,
+    NodeType.NODE_NOT_EQ: NodeType.NODE_NOT_EQ,
+}
+
+
+class DerivedAddress:
+    """An occurrence of `base + sign * (i + offset)` in a loop on the counter `i`."""
+
+    def __init__(self, node: Node, base: Node, sign: int, offset: int, counter_ref: Node) -> None:
+        self.node = node
+        self.base = base
+        self.sign = sign
+        self.offset = offset
+        self.counter_ref = counter_ref
+
+    @property
+    def key(self) -> tuple:
+        return structural_key(self.base), self.sign
+
+
+class StrengthReduction:
+    """
+    Induction variable strength reduction on `for` loops.
+
+    Addresses derived from the loop counter and dereferenced, `*(base + i)` or
+    `*(base - i)` where `base` is not written in the loop, are computed once before the loop into
+    a new pointer slot, which is then incremented along with the counter. If the
+    counter is not read anywhere else in the loop, the loop test is rewritten on the
+    pointer and the counter increment is removed; the counter is computed back from
+    the pointer after the loop, and `dse` removes what is not needed anymore:
+    ```
+    for (i = 0; i < n; i++) s = s + *(p - i);
+    =>
+    $ptr0 = p - i; $end0 = p - n;
+    for (; $ptr0 > $end0; $ptr0 = $ptr0 - 1) s = s + *$ptr0;
+    i = p - $ptr0;
+    ```
+    Offsets left by partial unrolling (`p - (i + 2)`) become offsets of the pointer.
+    Indexes are not scaled on MSM, so a derived address only saves its `get i; add`:
+    a loop is only rewritten if this saves more than the new increments cost.
+    """
+
+    name = "ivsr"
+
+    # instructions executed by an increment `x = x + c`, and saved by each derived address
+    INCREMENT_COST = 4
+    USE_SAVING = 2
+
+    def __init__(self) -> None:
+        self._func: Node | None = None
+        self._counter: int = 0
+
+    def run(self, func: Node) -> int:
+        """Run the pass on a function node. Return the number of strength-reduced addresses."""
+        if func.type != NodeType.NODE_FUNCTION or not func.children:
+            return 0
+        self._func = func
+        self._counter = 0
+        loops = [node for node in walk(func.children[-1]) if node.type == NodeType.NODE_LOOP]
+        return sum(self._reduce(loop) for loop in loops)
+
+    def _reduce(self, loop: Node) -> int:
+        # for (...; test; increment) body
+        if len(loop.children) != 1 or loop.children[0].type != NodeType.NODE_COND:
+            return 0
+        cond = loop.children[0]
+        if len(cond.children) != 3 or cond.children[2].type != NodeType.NODE_BREAK:
+            return 0
+        test, seq = cond.children[0], cond.children[1]
+        if seq.type != NodeType.NODE_SEQ or len(seq.children) != 3:
+            return 0
+        body, target, increment = seq.children
+        if target.type != NodeType.NODE_TARGET or not target.value:
+            return 0
+        if increment.type != NodeType.NODE_DROP or increment.children[0].type != NodeType.NODE_AFFECT:
+            return 0
+        counter = increment.children[0].children[0].index
+        step = induction_step(increment, counter)
+        alias = AliasAnalysis(self._func)  # new pointer slots of the loops already rewritten
+        if step is None or counter in alias.aliased or counter in written_slots(body) | written_slots(test):
+            return 0
+
+        written = written_slots(loop) | alias.clobbered(loop)
+        # only addresses that are read or written: other sums of the counter may overflow
+        uses = [
+            use for node in (*walk(test), *walk(body))
+            if node.type == NodeType.NODE_DEREF and (use := self._derived(node.children[0], counter, written)) is not None
+        ]
+        groups: dict[tuple, DerivedAddress] = {}
+        for use in uses:
+            groups.setdefault(use.key, use)
+        if not groups:
+            return 0
+
+        allowed = {id(use.counter_ref) for use in uses} | {id(test.children[0]), id(increment.children[0].children[1].children[0])}
+        removable = self._exit_test(test, counter, written) and self._only_reads(loop, counter, allowed)
+        saved = self.USE_SAVING * len(uses) + (self.INCREMENT_COST if removable else 0)
+        if saved <= self.INCREMENT_COST * len(groups):
+            return 0
+
+        preheader: list[Node] = []
+        increments: list[Node] = []
+        pointers: dict[tuple, Node] = {}
+        for key, use in groups.items():
+            pointer = new_slot(self._func, f"$ptr{self._counter}")
+            counter_ref = Node(NodeType.NODE_REF, index=counter, repr=use.counter_ref.repr)
+            preheader.append(self._assign(pointer, self._shift(clone(use.base), use.sign, counter_ref)))
+            increments.append(self._assign(pointer, self._add(clone(pointer), use.sign * step)))
+            pointers[key] = pointer
+        for use in uses:
+            replace(use.node, self._add(clone(pointers[use.key]), use.sign * use.offset))
+
+        if removable:
+            # i <op> n  =>  base + i <op> base + n  (comparison reversed for base - i)
+            first = next(iter(groups.values()))
+            end = new_slot(self._func, f"$end{self._counter}")
+            preheader.append(self._assign(end, self._shift(clone(first.base), first.sign, test.children[1])))
+            compare = test.type if first.sign > 0 else _REVERSED[test.type]
+            replace(test, Node(compare, children=[clone(pointers[first.key]), clone(end)]))
+            seq.children = [body, target, *increments]
+            # value of the counter after the loop (removed by `dse` if it is never read)
+            counter_ref = Node(NodeType.NODE_REF, index=counter, repr=first.counter_ref.repr)
+            pointer, base = clone(pointers[first.key]), clone(first.base)
+            index = [pointer, base] if first.sign > 0 else [base, pointer]
+            exit_value = [self._assign(counter_ref, Node(NodeType.NODE_SUB, children=index))]
+        else:
+            seq.children = [body, target, increment, *increments]
+            exit_value = []
+        self._counter += 1
+
+        rewritten = Node(NodeType.NODE_LOOP, children=loop.children)
+        rewritten.counts = loop.counts
+        replace(loop, Node(NodeType.NODE_SEQ, children=[*preheader, rewritten, *exit_value]))
+        return len(uses)
+
+    # Recognition
+
+    def _derived(self, node: Node, counter: int, written: set[int]) -> DerivedAddress | None:
+        """Match `base + i`, `i + base` and `base - i`, where `i` may also be `i + k`."""
+        if node.type not in (NodeType.NODE_ADD, NodeType.NODE_SUB):
+            return None
+        left, right = node.children
+        orders = [(left, right), (right, left)] if node.type == NodeType.NODE_ADD else [(left, right)]
+        sign = 1 if node.type == NodeType.NODE_ADD else -1
+        for base, index in orders:
+            matched = self._counter_term(index, counter)
+            if matched is not None and self._is_base(base, written):
+                counter_ref, offset = matched
+                return DerivedAddress(node, base, sign, offset, counter_ref)
+        return None
+
+    @staticmethod
+    def _counter_term(node: Node, counter: int) -> tuple[Node, int] | None:
+        """`i` or `i + k`: the read of the counter and the offset `k`."""
+        if node.type == NodeType.NODE_REF and node.index == counter:
+            return node, 0
+        if node.type == NodeType.NODE_ADD:
+            ref, amount = node.children
+            if ref.type == NodeType.NODE_REF and ref.index == counter and amount.type == NodeType.NODE_CONST:
+                return ref, amount.value
+        return None
+
+    @staticmethod
+    def _is_base(node: Node, written: set[int]) -> bool:
+        """A loop-invariant address: a variable not written in the loop, or `&x`."""
+        if node.type == NodeType.NODE_REF:
+            return node.index is not None and node.index not in written
+        return node.type == NodeType.NODE_ADDRESS and node.children[0].type == NodeType.NODE_REF
+
+    @staticmethod
+    def _exit_test(test: Node, counter: int, written: set[int]) -> bool:
+        """Check if the loop test is `i <op> n`, with `n` a constant or a variable not written in the loop."""
+        if test.type not in _REVERSED:
+            return False
+        ref, bound = test.children
+        if ref.type != NodeType.NODE_REF or ref.index != counter:
+            return False
+        return bound.type == NodeType.NODE_CONST or (bound.type == NodeType.NODE_REF and bound.index not in written)
+
+    @staticmethod
+    def _only_reads(loop: Node, counter: int, allowed: set[int]) -> bool:
+        """Check that the counter is only read by the given nodes in the loop."""
+        targets = {id(n.children[0]) for n in walk(loop) if n.type == NodeType.NODE_AFFECT}
+        return all(
+            id(n) in allowed or id(n) in targets
+            for n in walk(loop)
+            if n.type == NodeType.NODE_REF and n.index == counter
+        )
+
+    # Construction
+
+    @staticmethod
+    def _add(node: Node, amount: int) -> Node:
+        """`node + amount` (`node - |amount|` for a negative amount)."""
+        if amount == 0:
+            return node
+        op = NodeType.NODE_ADD if amount > 0 else NodeType.NODE_SUB
+        return Node(op, children=[node, Node(NodeType.NODE_CONST, value=abs(amount))])
+
+    @staticmethod
+    def _shift(base: Node, sign: int, amount: Node) -> Node:
+        """`base + amount` or `base - amount`."""
+        return Node(NodeType.NODE_ADD if sign > 0 else NodeType.NODE_SUB, children=[base, clone(amount)])
+
+    @staticmethod
+    def _assign(slot: Node, value: Node) -> Node:
+        """`slot = value;` statement."""
+        affect = Node(NodeType.NODE_AFFECT, children=[clone(slot), value])
+        return Node(NodeType.NODE_DROP, children=[affect])
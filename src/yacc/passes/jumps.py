@@ -0,0 +1,205 @@
+from typing import Container
+
+from ..asm import Assembly, Instruction, Opcode
+
+_JUMPS = {Opcode.JUMP, Opcode.JUMPT, Opcode.JUMPF}
+_INVERTED = {Opcode.JUMPT: Opcode.JUMPF, Opcode.JUMPF: Opcode.JUMPT}
+# instructions after which the next one is not executed
+_TERMINATORS = {Opcode.JUMP, Opcode.RET, Opcode.HALT}
+
+
+class JumpThreading:
+    """
+    Clean up the jumps and labels of the assembly of one function.
+
+    The code generator gives every `if` and loop its own labels, so the code has
+    jumps to jumps, branches over a jump and labels that nothing jumps to:
+    ```
+    jumpf L1_else; ...; .L1_else; jump L0_loop_end  =>  jumpf L0_loop_end; ...
+    jumpf L2_else; jump L0_loop_end; .L2_else        =>  jumpt L0_loop_end
+    jump L3_end; .L3_end                             =>  (nothing)
+    ret; push 0; ret                                 =>  ret
+    ```
+    Labels at the same address are merged, jumps go straight to the end of jump
+    chains, a conditional branch over a jump is inverted, jumps to the next
+    instruction are removed, then the code that cannot be reached and the labels
+    that nothing refers to are removed, until nothing changes. The remaining labels
+    are renamed in order (`L0_else`, `L1_loop_end`, ...), numbered across the
+    whole program since they must be unique.
+    Labels in `keep` (e.g. the function name) may be referred to from other code:
+    they are never removed nor renamed, and the code that follows them is reachable.
+    """
+
+    name = "jump"
+
+    def __init__(self) -> None:
+        # labels renamed so far
+        self.labels: int = 0
+
+    def run(self, assembly: Assembly, keep: Container[str] = ()) -> int:
+        """Clean up the assembly of a function in place. Return the number of changes."""
+        code = list(assembly)
+        changes = 0
+        while True:
+            count = self._merge_labels(code, keep)
+            count += self._thread(code)
+            count += self._simplify_branches(code)
+            count += self._remove_unreachable(code, keep)
+            count += self._remove_labels(code, keep)
+            if not count:
+                break
+            changes += count
+        self._rename(code, keep)
+        assembly[:] = code
+        return changes
+
+    @staticmethod
+    def _merge_labels(code: list[Instruction], keep: Container[str]) -> int:
+        """Make the jumps to labels at the same address use the same label (a local one if any)."""
+        aliases: dict[str, str] = {}
+        i = 0
+        while i < len(code):
+            if code[i][0] != Opcode.LABEL:
+                i += 1
+                continue
+            start = i
+            while i < len(code) and code[i][0] == Opcode.LABEL:
+                i += 1
+            names = [name for _, name in code[start:i]]
+            canonical = next((name for name in names if name not in keep), names[0])
+            aliases.update((name, canonical) for name in names if name != canonical and name not in keep)
+        return _retarget(code, aliases)
+
+    @staticmethod
+    def _thread(code: list[Instruction]) -> int:
+        """Make the jumps to a `jump` go to its target instead (to the end of the chain)."""
+        targets = _targets(code)
+        changes = 0
+        for i, (opcode, label) in enumerate(code):
+            if opcode not in _JUMPS:
+                continue
+            seen = {label}
+            target = label
+            while targets.get(target, len(code)) < len(code) and code[targets[target]][0] == Opcode.JUMP and code[targets[target]][1] not in seen:
+                target = code[targets[target]][1]
+                seen.add(target)
+            if target != label:
+                code[i] = (opcode, target)
+                changes += 1
+        return changes
+
+    @staticmethod
+    def _simplify_branches(code: list[Instruction]) -> int:
+        """
+        `jumpf A; jump B; .A`  =>  `jumpt B; .A` (and the opposite),
+        `jump A; .A`  =>  `.A`, and `jumpf A; .A`  =>  `drop 1; .A`
+        """
+        changes = 0
+        i = 0
+        while i < len(code):
+            opcode, label = code[i]
+            if opcode in _INVERTED and i + 1 < len(code) and code[i + 1][0] == Opcode.JUMP and label in _labels_at(code, i + 2):
+                code[i:i + 2] = [(_INVERTED[opcode], code[i + 1][1])]
+                changes += 1
+            elif opcode == Opcode.JUMP and label in _labels_at(code, i + 1):
+                del code[i]
+                changes += 1
+                continue
+            elif opcode in _INVERTED and label in _labels_at(code, i + 1):
+                # the condition is still popped
+                code[i] = (Opcode.DROP, 1)
+                changes += 1
+            i += 1
+        return changes
+
+    @staticmethod
+    def _remove_unreachable(code: list[Instruction], keep: Container[str]) -> int:
+        """Remove the instructions that no path from the start or from a kept label reaches."""
+        if not code:
+            return 0
+        targets = _targets(code)
+        entries = [0] + [i for i, (opcode, label) in enumerate(code) if opcode == Opcode.LABEL and label in keep]
+        # calls may return to a label of the function in other code
+        entries += [targets[label] for opcode, label in code if opcode == Opcode.PREP and label in targets]
+        reached = [False] * len(code)
+        stack = entries
+        while stack:
+            i = stack.pop()
+            while i < len(code) and not reached[i]:
+                reached[i] = True
+                opcode, label = code[i]
+                if opcode in _JUMPS and label in targets:
+                    stack.append(targets[label])
+                if opcode in _TERMINATORS:
+                    break
+                i += 1
+        # labels go with the code that follows them (the ones at the end are kept)
+        reached.append(True)
+        for i in range(len(code) - 1, -1, -1):
+            if code[i][0] == Opcode.LABEL and (code[i][1] in keep or reached[i + 1]):
+                reached[i] = True
+        reached.pop()
+        removed = reached.count(False)
+        if removed:
+            code[:] = [instruction for instruction, live in zip(code, reached) if live]
+        return removed
+
+    @staticmethod
+    def _remove_labels(code: list[Instruction], keep: Container[str]) -> int:
+        """Remove the labels that nothing refers to."""
+        used = {label for opcode, label in code if opcode in _JUMPS or opcode == Opcode.PREP}
+        size = len(code)
+        code[:] = [(opcode, label) for opcode, label in code if opcode != Opcode.LABEL or label in keep or label in used]
+        return size - len(code)
+
+    def _rename(self, code: list[Instruction], keep: Container[str]) -> None:
+        """Rename the labels of the function in order, keeping their kind (`else`, `loop_end`, ...)."""
+        names: dict[str, str] = {}
+        for opcode, label in code:
+            if opcode == Opcode.LABEL and label not in keep:
+                names[label] = f"L{self.labels}_{_kind(label)}"
+                self.labels += 1
+        for i, (opcode, label) in enumerate(code):
+            if opcode == Opcode.LABEL or opcode in _JUMPS:
+                code[i] = (opcode, names.get(label, label))
+
+
+def _targets(code: list[Instruction]) -> dict[str, int]:
+    """Index of the instruction that each label of the code refers to."""
+    targets: dict[str, int] = {}
+    pending: list[str] = []
+    for i, (opcode, label) in enumerate(code):
+        if opcode == Opcode.LABEL:
+            pending.append(label)
+        else:
+            targets.update((name, i) for name in pending)
+            pending.clear()
+    # labels at the end of the code refer to the end of the code
+    targets.update((name, len(code)) for name in pending)
+    return targets
+
+
+def _labels_at(code: list[Instruction], index: int) -> set[str]:
+    """Labels at `index` (before the next instruction)."""
+    labels: set[str] = set()
+    while index < len(code) and code[index][0] == Opcode.LABEL:
+        labels.add(code[index][1])
+        index += 1
+    return labels
+
+
+def _retarget(code: list[Instruction], names: dict[str, str]) -> int:
+    """Replace the labels of `names` in the jumps. Return the number of changed jumps."""
+    changes = 0
+    for i, (opcode, label) in enumerate(code):
+        if opcode in _JUMPS and label in names:
+            code[i] = (opcode, names[label])
+            changes += 1
+    return changes
+
+
+def _kind(label: str) -> str:
+    """Kind of a generated label: `L3_loop_end` -> `loop_end`, `f.bb2` -> `bb2`."""
+    if "." in label:
+        return label.rpartition(".")[2]
+    return label.partition("_")[2] or label
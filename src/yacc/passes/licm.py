@@ -0,0 +1,152 @@
+from ..node import Node, NodeType
+
+from .alias import AliasAnalysis
+from .analysis import (
+    SAFE_OPERATORS,
+    clone,
+    new_slot,
+    replace,
+    structural_key,
+    writes_memory,
+    written_slots,
+)
+
+
+class LoopInvariantCodeMotion:
+    """
+    Hoist loop-invariant computations out of loops.
+
+    Every maximal invariant expression of a loop (e.g. `n * 4 + base` when the loop
+    never writes `n` nor `base`) is evaluated once into a new temporary slot in a
+    preheader placed right before the loop, and its occurrences are replaced by reads
+    of that slot:
+    ```
+    (LOOP ... (MUL (REF n) (CONST 4)) ...)
+    =>
+    (SEQ (DROP (AFFECT (REF $inv0) (MUL (REF n) (CONST 4))))
+         (LOOP ... (REF $inv0) ...))
+    ```
+    Variables accessed through pointers are only considered invariant if no pointer
+    write or call of the loop may modify them (see `AliasAnalysis`), and loads `*p`
+    only if no slot that `p` may point to is written in the loop (nor memory outside
+    of the frame, by a pointer write or a call, if `p` may point there). Expressions
+    that may fault (`*p`, `a / b`) are only hoisted from the loop entry condition,
+    which is evaluated at least once anyway.
+    """
+
+    name = "licm"
+
+    def __init__(self) -> None:
+        self._func: Node | None = None
+        self._counter: int = 0
+        # pointers of the function, and whether the current loop writes memory outside of its slots
+        self._alias: AliasAnalysis | None = None
+        self._writes_memory: bool = False
+
+    def run(self, func: Node) -> int:
+        """Run the pass on a function node. Return the number of hoisted expressions."""
+        if func.type != NodeType.NODE_FUNCTION or not func.children:
+            return 0
+        self._func = func
+        self._counter = 0
+        return self._visit(func.children[-1])
+
+    def _visit(self, node: Node) -> int:
+        # inner loops first, so that their preheaders can be hoisted again
+        changes = sum(self._visit(child) for child in node.children)
+        if node.type == NodeType.NODE_LOOP:
+            changes += self._hoist(node)
+        return changes
+
+    def _hoist(self, loop: Node) -> int:
+        # computed again for each loop: hoisted temporaries may hold pointers
+        self._alias = AliasAnalysis(self._func)
+        self._writes_memory = writes_memory(loop)
+        written = written_slots(loop) | self._alias.clobbered(loop)
+
+        candidates: list[Node] = []
+        always_evaluated = self._always_evaluated(self._entry_condition(loop))
+        for child in loop.children:
+            self._collect(child, written, always_evaluated, candidates)
+        if not candidates:
+            return 0
+
+        temps: dict[tuple, Node] = {}
+        preheader: list[Node] = []
+        for expr in candidates:
+            key = structural_key(expr)
+            if key not in temps:
+                temps[key] = new_slot(self._func, f"$inv{self._counter}")
+                self._counter += 1
+                affect = Node(NodeType.NODE_AFFECT, children=[clone(temps[key]), clone(expr)])
+                preheader.append(Node(NodeType.NODE_DROP, children=[affect]))
+            replace(expr, clone(temps[key]))
+
+        body = Node(NodeType.NODE_LOOP, children=loop.children)
+        body.counts = loop.counts
+        replace(loop, Node(NodeType.NODE_SEQ, children=[*preheader, body]))
+        return len(candidates)
+
+    def _collect(self, node: Node, written: set[int], always_evaluated: set[int], out: list[Node]) -> None:
+        """Collect the maximal hoistable subtrees of `node`."""
+        may_fault = id(node) in always_evaluated
+        if self._is_invariant(node, written, may_fault) and self._is_worth_hoisting(node):
+            out.append(node)
+            return
+        for child in node.children:
+            self._collect(child, written, always_evaluated, out)
+
+    def _is_invariant(self, node: Node, written: set[int], may_fault: bool) -> bool:
+        match node.type:
+            case NodeType.NODE_CONST:
+                return True
+            case NodeType.NODE_REF:
+                return node.index is not None and node.index not in written
+            case NodeType.NODE_ADDRESS:
+                target = node.children[0]
+                if target.type == NodeType.NODE_REF:
+                    return True
+                return self._is_invariant(target.children[0], written, may_fault)
+            case NodeType.NODE_DEREF:
+                address = node.children[0]
+                if not may_fault or self._alias.may_point_anywhere(address) or self._alias.points_to(address) & written:
+                    return False
+                if self._writes_memory and self._alias.may_point_outside(address):
+                    return False
+            case NodeType.NODE_DIV | NodeType.NODE_MOD:
+                divisor = node.children[1]
+                if not may_fault and not (divisor.type == NodeType.NODE_CONST and divisor.value != 0):
+                    return False
+            case _ if node.type not in SAFE_OPERATORS:
+                return False
+        return all(self._is_invariant(c, written, may_fault) for c in node.children)
+
+    @staticmethod
+    def _is_worth_hoisting(node: Node) -> bool:
+        # a constant or a single variable read costs as much as reading the temporary
+        return node.type not in (NodeType.NODE_CONST, NodeType.NODE_REF)
+
+    @staticmethod
+    def _entry_condition(loop: Node) -> Node | None:
+        """Condition evaluated first on each iteration (`while` and `for` loops), if any."""
+        for child in loop.children:
+            if child.type == NodeType.NODE_TARGET:
+                continue
+            if child.type == NodeType.NODE_COND:
+                return child.children[0]
+            return None
+        return None
+
+    @staticmethod
+    def _always_evaluated(cond: Node | None) -> set[int]:
+        """Ids of the nodes of `cond` evaluated whenever `cond` is (right operands of `&&`/`||` are not)."""
+        ids: set[int] = set()
+        stack = [cond] if cond is not None else []
+        while stack:
+            node = stack.pop()
+            ids.add(id(node))
+            if node.type in (NodeType.NODE_AND, NodeType.NODE_OR):
+                stack.append(node.children[0])
+            else:
+                stack.extend(node.children)
+        return ids
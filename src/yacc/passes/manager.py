@@ -0,0 +1,90 @@
+import time
+from collections import deque
+from typing import Callable
+
+from ..node import Node
+
+# A pass transforms a function node in place and returns its number of changes
+PassFunction = Callable[[Node], int]
+# A hook is called after each pass run with the pass name and the function node
+PassHook = Callable[[str, Node], None]
+
+
+class PassStats:
+    def __init__(self) -> None:
+        self.runs: int = 0
+        self.changes: int = 0
+        self.seconds: float = 0.0
+
+
+class PassManager:
+    """
+    Run a list of named function passes until none of them changes anything.
+
+    Passes are kept in a worklist, in pipeline order. Whenever a pass changes the
+    function, every other pass is queued again since it may now find new
+    opportunities. The number of pass runs per function is bounded by
+    `max_rounds` times the number of passes, so that passes undoing each other
+    cannot loop forever.
+    """
+
+    def __init__(self, max_rounds: int = 8) -> None:
+        self.max_rounds = max_rounds
+        self._passes: dict[str, PassFunction] = {}
+        self._hooks: list[PassHook] = []
+        self.stats: dict[str, PassStats] = {}
+
+    @property
+    def names(self) -> list[str]:
+        return list(self._passes)
+
+    def add(self, name: str, run: PassFunction) -> None:
+        """Append a pass to the pipeline."""
+        if name in self._passes:
+            raise ValueError(f"Pass '{name}' is already registered")
+        self._passes[name] = run
+        self.stats[name] = PassStats()
+
+    def add_hook(self, hook: PassHook) -> None:
+        """Register a hook called after every pass run (e.g. a verifier)."""
+        self._hooks.append(hook)
+
+    def run(self, func: Node) -> int:
+        """Run the passes on a function until a fixed point is reached. Return the number of changes."""
+        order = list(self._passes)
+        worklist = deque(order)
+        queued = set(order)
+        budget = self.max_rounds * len(order)
+        total = 0
+
+        while worklist and budget > 0:
+            name = worklist.popleft()
+            queued.discard(name)
+            budget -= 1
+
+            start = time.perf_counter()
+            changes = self._passes[name](func)
+            stats = self.stats[name]
+            stats.seconds += time.perf_counter() - start
+            stats.runs += 1
+            stats.changes += changes
+
+            for hook in self._hooks:
+                hook(name, func)
+
+            if changes:
+                total += changes
+                for other in order:
+                    if other != name and other not in queued:
+                        worklist.append(other)
+                        queued.add(other)
+                # keep pipeline order among queued passes
+                worklist = deque(sorted(worklist, key=order.index))
+        return total
+
+    def report(self) -> str:
+        """Per-pass statistics, one line per pass."""
+        lines = [f"{'pass':<12}{'runs':>6}{'changes':>9}{'time (ms)':>12}"]
+        for name, stats in self.stats.items():
+            lines.append(f"{name:<12}{stats.runs:>6}{stats.changes:>9}{stats.seconds * 1000:>12.3f}")
+        return "\n".join(lines)
@@ -0,0 +1,135 @@
+from ..node import Node, NodeType
+
+from .analysis import called_functions, clone, new_slot, param_count, replace, walk, written_slots
+
+
+class Memoization:
+    """
+    Cache the results of pure recursive functions in tables (`--auto-memoize`).
+
+    A function is memoized if it calls itself, has 1 to `MAX_PARAMS` parameters and
+    is pure: no `debug`, no pointer (`*p`, `&x`) and only calls to itself or to pure
+    functions already compiled. Its result then only depends on its arguments, so
+    each call first looks its arguments up in a direct-mapped table, and every
+    `return` stores the arguments and the result in the table:
+    ```
+    $memo = *0 + base + entry * (hash(n) % size);
+    if (*$memo && *($memo + 1) == n) return *($memo + 2);
+    ... { $result = e; *$memo = 1; *($memo + 1) = n; *($memo + 2) = $result; return $result; } ...
+    ```
+    Tables live in the free memory that follows the program (MSM stores the size
+    of the code in `mem[0]`, and memory starts zeroed, so entries start empty).
+    Each table has `size` entries of `parameters + 2` words (used flag, arguments,
+    result), and all tables fit in `max_words` words: functions that would exceed
+    it are not memoized.
+    """
+
+    name = "memo"
+
+    MAX_PARAMS = 3
+    HASH_MULTIPLIER = 31
+
+    def __init__(self, functions: dict[str, Node], size: int = 1024, max_words: int = 16384) -> None:
+        self.functions = functions
+        self.size = size
+        self.max_words = max_words
+        # words of free memory used by the tables
+        self.words: int = 0
+        self.memoized: list[str] = []
+        # memoized functions as they were before adding their table
+        self.originals: dict[str, Node] = {}
+
+    def run(self, func: Node) -> int:
+        """Memoize a function node in place if possible. Return 1 if it was memoized, else 0."""
+        if func.type != NodeType.NODE_FUNCTION or not func.children or func.repr in self.originals:
+            return 0
+        params = param_count(func)
+        body = func.children[-1]
+        if not 1 <= params <= self.MAX_PARAMS or func.repr not in called_functions(body):
+            return 0
+        if not self.is_pure(func):
+            return 0
+        entry_words = params + 2
+        if self.size < 1 or self.words + self.size * entry_words > self.max_words:
+            return 0
+        base = self.words
+        self.words += self.size * entry_words
+        self.originals[func.repr] = clone(func)
+        self.memoized.append(func.repr)
+
+        prologue: list[Node] = []
+        keys = [Node(NodeType.NODE_REF, repr=param.repr, index=index) for index, param in enumerate(func.children[:-1])]
+        if written_slots(body) & set(range(params)):
+            # the body changes its parameters: keep the arguments for the stores
+            for index, key in enumerate(keys):
+                copy = new_slot(func, f"$key{index}")
+                prologue.append(_assign(copy, key))
+                keys[index] = copy
+        entry = new_slot(func, "$memo")
+        result = new_slot(func, "$result")
+
+        # entry address: *0 + base + entry_words * (hash % size), with a positive modulo
+        hash_value = clone(keys[0])
+        for key in keys[1:]:
+            scaled = Node(NodeType.NODE_MUL, children=[hash_value, _const(self.HASH_MULTIPLIER)])
+            hash_value = Node(NodeType.NODE_ADD, children=[scaled, clone(key)])
+        modulo = Node(NodeType.NODE_MOD, children=[hash_value, _const(self.size)])
+        slot = Node(NodeType.NODE_MOD, children=[Node(NodeType.NODE_ADD, children=[modulo, _const(self.size)]), _const(self.size)])
+        start = Node(NodeType.NODE_ADD, children=[Node(NodeType.NODE_DEREF, children=[_const(0)]), _const(base)])
+        address = Node(NodeType.NODE_ADD, children=[start, Node(NodeType.NODE_MUL, children=[_const(entry_words), slot])])
+        prologue.append(_assign(entry, address))
+
+        # lookup: used entry with the same arguments
+        hit = _field(entry, 0)
+        for index, key in enumerate(keys):
+            same = Node(NodeType.NODE_EQ, children=[_field(entry, index + 1), clone(key)])
+            hit = Node(NodeType.NODE_AND, children=[hit, same])
+        cached = Node(NodeType.NODE_RETURN, children=[_field(entry, params + 1)])
+        prologue.append(Node(NodeType.NODE_COND, children=[hit, cached]))
+
+        def store(value: Node) -> Node:
+            statements = [_assign(result, value), _assign(_field(entry, 0), _const(1))]
+            for index, key in enumerate(keys):
+                statements.append(_assign(_field(entry, index + 1), clone(key)))
+            statements.append(_assign(_field(entry, params + 1), clone(result)))
+            statements.append(Node(NodeType.NODE_RETURN, children=[clone(result)]))
+            return Node(NodeType.NODE_SEQ, children=statements)
+
+        for ret in [n for n in walk(body) if n.type == NodeType.NODE_RETURN]:
+            replace(ret, store(ret.children[0] if ret.children else _const(0)))
+        # falling off the end of the function returns 0
+        func.children[-1] = Node(NodeType.NODE_BLOCK, children=[*prologue, body, store(_const(0))])
+        return 1
+
+    def is_pure(self, func: Node, visiting: frozenset[str] = frozenset()) -> bool:
+        """Check if a function has no effect other than returning a value that only depends on its arguments."""
+        if not func.children:
+            return False
+        visiting = visiting | {func.repr}
+        for node in walk(func.children[-1]):
+            if node.type in (NodeType.NODE_DEBUG, NodeType.NODE_DEREF, NodeType.NODE_ADDRESS):
+                return False
+            if node.type == NodeType.NODE_CALL:
+                name = node.children[0].repr
+                if name in visiting:
+                    continue
+                callee = self.originals.get(name, self.functions.get(name))
+                if callee is None or not self.is_pure(callee, visiting):
+                    return False
+        return True
+
+
+def _const(value: int) -> Node:
+    return Node(NodeType.NODE_CONST, value=value)
+
+
+def _field(entry: Node, offset: int) -> Node:
+    """`*(entry + offset)`: a word of a table entry."""
+    address = clone(entry) if not offset else Node(NodeType.NODE_ADD, children=[clone(entry), _const(offset)])
+    return Node(NodeType.NODE_DEREF, children=[address])
+
+
+def _assign(target: Node, value: Node) -> Node:
+    """`target = value;` statement."""
+    affect = Node(NodeType.NODE_AFFECT, children=[clone(target), value])
+    return Node(NodeType.NODE_DROP, children=[affect])
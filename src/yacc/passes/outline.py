@@ -0,0 +1,156 @@
+from ..asm import Assembly, Instruction, Opcode
+
+# values each instruction pops (at least) and pushes, for the instructions an outlined
+# sequence may contain (`drop n` and `call n` pop their operand, see `_stack_effect`)
+_EFFECTS: dict[Opcode, tuple[int, int]] = {
+    Opcode.DUP: (1, 2), Opcode.SWAP: (2, 2), Opcode.PUSH: (0, 1), Opcode.GET: (0, 1),
+    Opcode.READ: (1, 1), Opcode.WRITE: (2, 0), Opcode.NOT: (1, 1), Opcode.PREP: (0, 2),
+    Opcode.SEND: (1, 0), Opcode.RECV: (0, 1), Opcode.DBG: (1, 0),
+    **{opcode: (2, 1) for opcode in (
+        Opcode.ADD, Opcode.SUB, Opcode.MUL, Opcode.DIV, Opcode.MOD, Opcode.AND, Opcode.OR,
+        Opcode.CMPEQ, Opcode.CMPNE, Opcode.CMPLT, Opcode.CMPLE, Opcode.CMPGT, Opcode.CMPGE,
+    )},
+}
+
+OUTLINED_PREFIX = "$outline"
+
+
+def _stack_effect(instruction: Instruction) -> tuple[int, int] | None:
+    """Values popped and pushed by an instruction, or None if it cannot be outlined."""
+    opcode, operand = instruction
+    if opcode == Opcode.DROP:
+        return operand, 0
+    if opcode == Opcode.CALL:
+        # the arguments and the two words of `prep`
+        return operand + 2, 1
+    if opcode == Opcode.PREP and operand == "start":
+        return None  # reads the frame pointer
+    return _EFFECTS.get(opcode)
+
+
+def size(code: Assembly) -> int:
+    """Number of instructions of the code (labels excluded)."""
+    return sum(1 for opcode, _ in code if opcode != Opcode.LABEL)
+
+
+class Outlining:
+    """
+    Move the instruction sequences repeated in the program into shared subroutines
+    (`-Os`). This is a whole-program pass, on the assembly.
+
+    An outlined sequence is called with `prep`/`call` and ends with `ret`, so it runs
+    in its own frame: it may only use the values it pushes itself, and leave one
+    (the value returned) or none (then `push 0` is returned, and dropped by the
+    caller). The frame slots it reads (`get`) are passed as arguments, so that
+    sequences reading different slots share the subroutine:
+    ```
+    get 2; push 3; mul; get 5; add; dbg   =>   prep $outline0; get 2; get 5; call 2; drop 1
+    ...                                        .$outline0; get 0; push 3; mul; get 1; add; dbg; push 0; ret
+    ```
+    Sequences never contain labels, jumps, `ret`, stores to the frame (`set`) or
+    frame addresses (`prep start`), nor a `get` after a `write` or a call, which
+    could change the slot through a pointer.
+    Sequences of `MIN_LENGTH` to `MAX_LENGTH` instructions are outlined, the most
+    profitable first, if replacing all their copies makes the program smaller.
+    The program size before and after is kept in `size_before` and `size_after`.
+    """
+
+    name = "outline"
+
+    MIN_LENGTH = 6
+    MAX_LENGTH = 24
+
+    def __init__(self) -> None:
+        # subroutine names, with the number of sequences they replace
+        self.outlined: list[tuple[str, int]] = []
+        self.size_before: int = 0
+        self.size_after: int = 0
+
+    def run(self, assembly: Assembly) -> int:
+        """Outline the repeated sequences of a program in place. Return the number of replaced sequences."""
+        code = list(assembly)
+        self.size_before = size(assembly)
+        candidates = self._candidates(code)
+
+        # the most profitable sequences first, each copy replaced at most once
+        used = bytearray(len(code))
+        replacements: dict[int, tuple[int, str, list[int], bool]] = {}
+        subroutines: list[Instruction] = []
+        order = sorted(candidates.items(), key=lambda item: -self._saving(item[0], len(item[1])))
+        for key, occurrences in order:
+            free = []
+            for start, args in occurrences:
+                if not any(used[start:start + len(key[0])]):
+                    free.append((start, args))
+                    used[start:start + len(key[0])] = b"\x01" * len(key[0])
+            if self._saving(key, len(free)) <= 0:
+                for start, _ in free:
+                    used[start:start + len(key[0])] = bytes(len(key[0]))
+                continue
+            name = f"{OUTLINED_PREFIX}{len(self.outlined)}"
+            self.outlined.append((name, len(free)))
+            body, returns = key
+            for start, args in free:
+                replacements[start] = (len(body), name, args, returns)
+            subroutines.append((Opcode.LABEL, name))
+            subroutines.extend(body)
+            if not returns:
+                subroutines.append((Opcode.PUSH, 0))
+            subroutines.append((Opcode.RET, None))
+
+        result: list[Instruction] = []
+        i = 0
+        while i < len(code):
+            if i not in replacements:
+                result.append(code[i])
+                i += 1
+                continue
+            length, name, args, returns = replacements[i]
+            result.append((Opcode.PREP, name))
+            result.extend((Opcode.GET, slot) for slot in args)
+            result.append((Opcode.CALL, len(args)))
+            if not returns:
+                result.append((Opcode.DROP, 1))
+            i += length
+        result.extend(subroutines)
+        assembly[:] = result
+        self.size_after = size(assembly)
+        return len(replacements)
+
+    @staticmethod
+    def _saving(key: tuple[tuple[Instruction, ...], bool], copies: int) -> int:
+        """Instructions saved by outlining `copies` copies of a sequence."""
+        body, returns = key
+        # prep, the arguments, call (and drop) instead of each copy
+        call = 2 + len({operand for opcode, operand in body if opcode == Opcode.GET}) + (not returns)
+        # the body, (push 0 and) ret
+        subroutine = len(body) + 1 + (not returns)
+        return copies * (len(body) - call) - subroutine
+
+    def _candidates(self, code: list[Instruction]) -> dict[tuple[tuple[Instruction, ...], bool], list[tuple[int, list[int]]]]:
+        """
+        Sequences that can be outlined, by subroutine body (with the slots read turned
+        into parameters) and whether they return a value: start of each copy and slots
+        to pass as arguments.
+        """
+        candidates: dict[tuple[tuple[Instruction, ...], bool], list[tuple[int, list[int]]]] = {}
+        for start in range(len(code)):
+            body: list[Instruction] = []
+            params: dict[int, int] = {}
+            depth = 0
+            clobbered = False
+            for opcode, operand in code[start:start + self.MAX_LENGTH]:
+                effect = _stack_effect((opcode, operand))
+                if effect is None or effect[0] > depth:
+                    break
+                if opcode == Opcode.GET:
+                    if clobbered:
+                        break
+                    operand = params.setdefault(operand, len(params))
+                elif opcode in (Opcode.WRITE, Opcode.CALL):
+                    clobbered = True
+                depth += effect[1] - effect[0]
+                body.append((opcode, operand))
+                if len(body) >= self.MIN_LENGTH and depth <= 1:
+                    candidates.setdefault((tuple(body), depth == 1), []).append((start, list(params)))
+        return {key: occurrences for key, occurrences in candidates.items() if len(occurrences) > 1}
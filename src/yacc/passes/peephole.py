@@ -0,0 +1,157 @@
+from pathlib import Path
+
+from ..asm import Assembly, Instruction, Opcode, format_instruction, parse_instruction
+from ..utils.errors import CompilationError
+from .stack import cost
+
+# rules shipped with the compiler (found by the superoptimizer, see `yacc.superopt`)
+DEFAULT_RULES = Path(__file__).with_name("peephole.rules")
+
+# frame slots are variables in the rules (`get a`): they match any slot,
+# different variables matching different slots
+SLOT_VARIABLES = ("a", "b")
+SLOT_OPCODES = {Opcode.GET, Opcode.SET}
+
+Sequence = tuple[Instruction, ...]
+
+
+def format_sequence(code: Sequence) -> str:
+    """Text of a sequence of a rule: `get a; push 1; add`."""
+    return "; ".join(format_instruction(opcode, operand) for opcode, operand in code)
+
+
+def parse_sequence(text: str) -> Sequence:
+    """Sequence of a rule (inverse of `format_sequence`)."""
+    code: list[Instruction] = []
+    for part in text.split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        mnemonic, _, operand = part.partition(" ")
+        try:
+            opcode = Opcode.from_mnemonic(mnemonic)
+            if opcode in SLOT_OPCODES:
+                if operand not in SLOT_VARIABLES:
+                    raise ValueError(operand)
+                code.append((opcode, operand))
+            else:
+                code.append(parse_instruction(part))
+        except (KeyError, ValueError):
+            raise CompilationError(f"Invalid peephole rule instruction '{part}'") from None
+        if opcode in (Opcode.LABEL, Opcode.JUMP, Opcode.JUMPT, Opcode.JUMPF, Opcode.PREP, Opcode.CALL, Opcode.RET, Opcode.HALT):
+            raise CompilationError(f"Peephole rules are straight-line code, found '{part}'")
+    return tuple(code)
+
+
+def _shape(code: Sequence) -> Sequence:
+    """Sequence without its frame slots (the key rules are looked up with)."""
+    return tuple((opcode, None if opcode in SLOT_OPCODES else operand) for opcode, operand in code)
+
+
+class RuleDatabase:
+    """
+    Rewrite rules for short straight-line instruction sequences: each pattern is
+    replaced by an equivalent sequence that is cheaper (see `passes.stack.cost`).
+    The rules are found by the superoptimizer (`python -m yacc.superopt`).
+
+    Text format, one rule per line (`#` starts a comment), an empty right-hand
+    side removing the pattern:
+    ```
+    push 0; add =>
+    swap; cmplt => cmpgt
+    set a; get a => dup; set a
+    ```
+    """
+
+    def __init__(self, rules: dict[Sequence, Sequence]) -> None:
+        self.rules = rules
+        self.max_length = max((len(pattern) for pattern in rules), default=0)
+        # rules by pattern shape (several patterns may differ only by their slots)
+        self._index: dict[Sequence, list[tuple[Sequence, Sequence]]] = {}
+        for pattern, replacement in rules.items():
+            self._index.setdefault(_shape(pattern), []).append((pattern, replacement))
+
+    @classmethod
+    def parse(cls, text: str) -> "RuleDatabase":
+        rules: dict[Sequence, Sequence] = {}
+        for number, line in enumerate(text.splitlines(), 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            pattern_text, arrow, replacement_text = line.partition("=>")
+            if not arrow:
+                raise CompilationError(f"Invalid peephole rule on line {number} (expected 'pattern => replacement')")
+            pattern, replacement = parse_sequence(pattern_text), parse_sequence(replacement_text)
+            if not pattern:
+                raise CompilationError(f"Invalid peephole rule on line {number} (empty pattern)")
+            slots = {operand for opcode, operand in pattern if opcode in SLOT_OPCODES}
+            if any(opcode in SLOT_OPCODES and operand not in slots for opcode, operand in replacement):
+                raise CompilationError(f"Invalid peephole rule on line {number} (slot not in the pattern)")
+            if cost(list(replacement)) >= cost(list(pattern)):
+                # rewrites always make the code cheaper, so that they end
+                raise CompilationError(f"Invalid peephole rule on line {number} (the replacement is not cheaper)")
+            rules[pattern] = replacement
+        return cls(rules)
+
+    @classmethod
+    def from_path(cls, path: str | Path) -> "RuleDatabase":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.parse(f.read())
+
+    def format(self) -> str:
+        """Text of the rules (see `parse`)."""
+        return "".join(f"{format_sequence(pattern)} => {format_sequence(replacement)}".rstrip() + "\n" for pattern, replacement in self.rules.items())
+
+    def match(self, code: list[Instruction], start: int) -> tuple[int, list[Instruction]] | None:
+        """Longest rule that applies at `start`: length of the pattern and instructions replacing it."""
+        for length in range(min(self.max_length, len(code) - start), 0, -1):
+            window = code[start:start + length]
+            for pattern, replacement in self._index.get(_shape(window), ()):
+                slots: dict[str, int] = {}
+                if all(
+                    opcode not in SLOT_OPCODES or slots.setdefault(variable, slot) == slot
+                    for (opcode, variable), (_, slot) in zip(pattern, window)
+                ) and len(set(slots.values())) == len(slots):
+                    return length, [(opcode, slots[operand] if opcode in SLOT_OPCODES else operand) for opcode, operand in replacement]
+        return None
+
+
+class Peephole:
+    """
+    Replace short instruction sequences by cheaper equivalent ones, on the assembly
+    of a function, with the rules of a `RuleDatabase`:
+    ```
+    get 2; push 0; add; push 0; cmpeq  =>  get 2; not
+    get 3; set 3                       =>  (nothing)
+    ```
+    The longest pattern is replaced first, and the code around a replacement is
+    looked at again since it may now match another rule, until no rule applies.
+    Labels are never matched, so a rewrite never spans two paths.
+    The number of rewrites is counted in `rewrites`.
+    """
+
+    name = "peephole"
+
+    def __init__(self, database: RuleDatabase) -> None:
+        self.database = database
+        self.rewrites: int = 0
+
+    def run(self, assembly: Assembly) -> int:
+        """Rewrite the assembly of a function in place. Return the number of rewrites."""
+        code = list(assembly)
+        changes = 0
+        i = 0
+        while i < len(code):
+            match = self.database.match(code, i)
+            if match is None:
+                i += 1
+                continue
+            length, replacement = match
+            code[i:i + length] = replacement
+            changes += 1
+            # the replacement may complete a pattern that starts before it
+            i = max(0, i - self.database.max_length + 1)
+        if changes:
+            assembly[:] = code
+        self.rewrites += changes
+        return changes
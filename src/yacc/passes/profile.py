@@ -0,0 +1,159 @@
+from ..asm import Assembly, Opcode
+from ..node import Node, NodeType
+from ..utils.errors import CompilationError
+
+from .analysis import walk
+
+# Line printed by instrumented programs before their counters
+PROFILE_HEADER = "yacc-profile"
+# Label of the code that prints the counters (not a valid function name)
+PROFILE_LABEL = "$profile"
+
+
+def profile_sites(func: Node) -> list[Node]:
+    """
+    Nodes of a function that get execution counters: the function itself, then its
+    loops and conditions in pre-order.
+    Sites are numbered in this order on the analyzed (not yet optimized) AST, so that
+    a profile collected with `--profile-generate` matches the same source compiled
+    with `--profile-use`, whatever the optimization options.
+    """
+    if func.type != NodeType.NODE_FUNCTION or not func.children:
+        return []
+    loops_and_conds = (NodeType.NODE_LOOP, NodeType.NODE_COND)
+    return [func, *(n for n in walk(func.children[-1]) if n.type in loops_and_conds)]
+
+
+def counter_count(site: Node) -> int:
+    """Counters of a site: one per branch of a condition (then, else), one execution count otherwise."""
+    return 2 if site.type == NodeType.NODE_COND else 1
+
+
+class ProfileInstrumentation:
+    """
+    Add execution counters to functions (`--profile-generate`).
+
+    Counters live in the free memory that follows the program: MSM stores the size
+    of the code in `mem[0]`, so counter `k` is `*(*0 + k)` and is incremented with
+    plain AST nodes (the optimizer and the back ends see a pointer write):
+    - function: one counter at the start of the body (calls)
+    - loop: one counter at the head (iterations)
+    - condition: one counter per branch (an empty `else` is added if needed)
+
+    When `main` returns, the program prints the `yacc-profile` header, the number of
+    counters, then the value of each counter on its own line: the entry code jumps to
+    the code that prints them (see `exit` and `output`), which is added at the end of
+    the program since the number of counters is only known once every function is.
+    """
+
+    name = "profile"
+
+    def __init__(self) -> None:
+        self.counters: int = 0
+
+    def run(self, func: Node) -> int:
+        """Instrument a function node in place. Return the number of added counters."""
+        first = self.counters
+        for site in profile_sites(func):
+            match site.type:
+                case NodeType.NODE_FUNCTION:
+                    site.children[-1] = self._prepend(site.children[-1])
+                case NodeType.NODE_LOOP:
+                    site.children.insert(0, self._increment())
+                case NodeType.NODE_COND:
+                    site.children[1] = self._prepend(site.children[1])
+                    if len(site.children) > 2:
+                        site.children[2] = self._prepend(site.children[2])
+                    else:
+                        site.children.append(self._increment())
+        return self.counters - first
+
+    def exit(self, code: Assembly) -> Assembly:
+        """Jump to the output of the counters instead of halting, in the entry code (once `main` has returned)."""
+        return Assembly((Opcode.JUMP, PROFILE_LABEL) if opcode == Opcode.HALT else (opcode, operand) for opcode, operand in code)
+
+    def output(self) -> Assembly:
+        """Code that prints the counters then halts."""
+        dump = Assembly()
+        dump.label(PROFILE_LABEL)
+        for char in PROFILE_HEADER + "\n":
+            dump.extend([(Opcode.PUSH, ord(char)), (Opcode.SEND, None)])
+        dump.extend([(Opcode.PUSH, self.counters), (Opcode.DBG, None)])
+        for index in range(self.counters):
+            dump.extend([(Opcode.PUSH, 0), (Opcode.READ, None), (Opcode.PUSH, index), (Opcode.ADD, None), (Opcode.READ, None), (Opcode.DBG, None)])
+        dump.emit(Opcode.HALT)
+        return dump
+
+    def _prepend(self, statement: Node) -> Node:
+        return Node(NodeType.NODE_SEQ, children=[self._increment(), statement])
+
+    def _increment(self) -> Node:
+        """`*(*0 + k) = *(*0 + k) + 1;` for the next counter `k`."""
+        index = self.counters
+        self.counters += 1
+
+        def counter() -> Node:
+            base = Node(NodeType.NODE_DEREF, children=[Node(NodeType.NODE_CONST, value=0)])
+            address = Node(NodeType.NODE_ADD, children=[base, Node(NodeType.NODE_CONST, value=index)])
+            return Node(NodeType.NODE_DEREF, children=[address])
+
+        value = Node(NodeType.NODE_ADD, children=[counter(), Node(NodeType.NODE_CONST, value=1)])
+        return Node(NodeType.NODE_DROP, children=[Node(NodeType.NODE_AFFECT, children=[counter(), value])])
+
+
+class Profile:
+    """
+    Execution counts read back from the output of an instrumented program (`--profile-use`).
+
+    `annotate` attaches the counts to the nodes they were collected for (`Node.counts`):
+    `(calls,)` for functions, `(iterations,)` for loops and `(then, else)` for conditions.
+    Passes keep the counts when they copy or move nodes (`clone`, `replace`).
+    """
+
+    # sites executed at least 1/HOT_RATIO times as often as the hottest one are hot
+    HOT_RATIO = 10
+
+    def __init__(self, counters: list[int]) -> None:
+        self.counters = counters
+        self._next: int = 0
+
+    @classmethod
+    def parse(cls, output: str) -> "Profile":
+        """Read the profile printed at the end of the output of an instrumented program."""
+        lines = [line.strip() for line in output.splitlines()]
+        if PROFILE_HEADER not in lines:
+            raise CompilationError("No profile found (expected the output of a program compiled with --profile-generate)")
+        start = len(lines) - lines[::-1].index(PROFILE_HEADER)
+        try:
+            count = int(lines[start])
+            counters = [int(line) for line in lines[start + 1:start + 1 + count]]
+        except (IndexError, ValueError):
+            raise CompilationError("Invalid profile: counters are missing or are not integers")
+        if len(counters) != count:
+            raise CompilationError(f"Invalid profile: expected {count} counters, found {len(counters)}")
+        return cls(counters)
+
+    @classmethod
+    def from_path(cls, path: str) -> "Profile":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.parse(f.read())
+
+    def annotate(self, func: Node) -> int:
+        """Attach the next counters to the sites of a function node. Return the number of annotated sites."""
+        sites = profile_sites(func)
+        for site in sites:
+            end = self._next + counter_count(site)
+            if end > len(self.counters):
+                raise CompilationError("The profile does not match the program (not enough counters)")
+            site.counts = tuple(self.counters[self._next:end])
+            self._next = end
+        return len(sites)
+
+    def check_complete(self) -> None:
+        """Check that every counter of the profile was used (the profile was collected on the same source)."""
+        if self._next != len(self.counters):
+            raise CompilationError(f"The profile does not match the program ({len(self.counters)} counters, {self._next} used)")
+
+    def is_hot(self, count: int) -> bool:
+        """Check if a site executed `count` times is among the most executed of the program."""
+        return count > 0 and count * self.HOT_RATIO >= max(self.counters, default=0)
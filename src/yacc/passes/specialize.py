@@ -0,0 +1,137 @@
+from ..node import Node, NodeType
+
+from .alias import AliasAnalysis
+from .analysis import address_taken_slots, clone, param_count, replace, walk, written_slots
+
+
+class FunctionSpecialization:
+    """
+    Clone functions for the constant arguments they are called with.
+    This is a whole-program pass: it needs every function of the program at once.
+
+    A call with constant arguments, `scale(x, 4)`, is redirected to a copy of the
+    callee where the parameter is replaced by the constant, so that the passes
+    run on the copy can fold it, and the parameter is removed:
+    ```
+    int scale(int x, int k) { return x * k; }   scale(a, 4)
+    =>
+    int scale$_$4(int x) { return x * 4; }      scale$_$4(a)
+    ```
+    Calls with the same constants share a clone (named after the callee and the
+    constants, `_` for the parameters that are kept). Only the parameters that
+    the callee neither assigns nor accesses through a pointer are specialized,
+    and only functions of at most `MAX_SIZE` nodes are cloned, at most
+    `max_clones` times in the whole program. Calls in the clones are specialized
+    too, so a recursive call that passes the parameter along calls the clone.
+    """
+
+    name = "spec"
+
+    MAX_SIZE = 256
+
+    def __init__(self, functions: dict[str, Node], max_clones: int = 8) -> None:
+        # functions of the program, by name (what clones are copied from)
+        self.functions = functions
+        self.max_clones = max_clones
+        self.clones: list[Node] = []
+        self._by_signature: dict[tuple[str, tuple[int | None, ...]], Node] = {}
+        self._specializable: dict[str, set[int]] = {}
+        # function each clone was copied from (the original one for clones of clones)
+        self._origins: dict[str, str] = {}
+
+    def run(self, functions: list[Node]) -> list[Node]:
+        """
+        Redirect the calls with constant arguments to clones, and return the functions
+        with the new clones (each one after the function it was copied from).
+        The pass can run again once the clones are optimized, to specialize the
+        calls whose arguments became constant.
+        """
+        worklist = [f for f in functions if f is not None and f.type == NodeType.NODE_FUNCTION and f.children]
+        while worklist:
+            func = worklist.pop(0)
+            for call in self._calls(func.children[-1]):
+                signature = self._signature(call)
+                target = self._specialize(call.children[0].repr, signature) if signature is not None else None
+                if target is None:
+                    continue
+                name = call.children[0].repr
+                if target.repr not in self._origins:
+                    self._origins[target.repr] = self._origins.get(name, name)
+                    worklist.append(target)
+                call.children = [
+                    Node(NodeType.NODE_REF, repr=target.repr),
+                    *(arg for arg, value in zip(call.children[1:], signature) if value is None),
+                ]
+
+        present = {id(node) for node in functions}
+        result: list[Node] = []
+        for node in functions:
+            result.append(node)
+            if node is not None and node.type == NodeType.NODE_FUNCTION and node.repr not in self._origins:
+                result.extend(c for c in self.clones if self._origins[c.repr] == node.repr and id(c) not in present)
+        return result
+
+    @staticmethod
+    def _calls(node: Node) -> list[Node]:
+        """Calls in `node`, except in the statements that follow a `return` (left by folding a test)."""
+        calls: list[Node] = [node] if node.type == NodeType.NODE_CALL else []
+        for child in node.children:
+            calls.extend(FunctionSpecialization._calls(child))
+            if child.type == NodeType.NODE_RETURN and node.type in (NodeType.NODE_BLOCK, NodeType.NODE_SEQ):
+                break
+        return calls
+
+    def _specialize(self, name: str, signature: tuple[int | None, ...]) -> Node | None:
+        """Clone of `name` for the constants of `signature` (created if needed), or None over the budget."""
+        key = (name, signature)
+        if key not in self._by_signature:
+            callee = self.functions[name]
+            if len(self.clones) >= self.max_clones or sum(1 for _ in walk(callee)) > self.MAX_SIZE:
+                return None
+            specialized = self._clone(callee, signature)
+            self._by_signature[key] = specialized
+            self.functions[specialized.repr] = specialized
+            self.clones.append(specialized)
+        return self._by_signature[key]
+
+    def _signature(self, call: Node) -> tuple[int | None, ...] | None:
+        """Constant of each specialized argument of a call (None for the others), or None if there is none."""
+        if not call.children or call.children[0].repr is None:
+            return None
+        callee = self.functions.get(call.children[0].repr)
+        if callee is None or not callee.children or param_count(callee) != len(call.children) - 1:
+            return None
+        specializable = self._specializable_params(callee)
+        signature = tuple(
+            arg.value if index in specializable and arg.type == NodeType.NODE_CONST else None
+            for index, arg in enumerate(call.children[1:])
+        )
+        return signature if any(value is not None for value in signature) else None
+
+    def _specializable_params(self, func: Node) -> set[int]:
+        """Parameters that keep the value of their argument in the whole function."""
+        if func.repr not in self._specializable:
+            body = func.children[-1]
+            changed = written_slots(body) | address_taken_slots(body) | AliasAnalysis(func).aliased
+            self._specializable[func.repr] = set(range(param_count(func))) - changed
+        return self._specializable[func.repr]
+
+    @staticmethod
+    def _clone(func: Node, signature: tuple[int | None, ...]) -> Node:
+        """Copy of `func` with the constants of `signature` instead of their parameters."""
+        specialized = clone(func)
+        specialized.repr = func.repr + "".join(f"${'_' if value is None else value}" for value in signature)
+        params = param_count(func)
+        kept = [index for index, value in enumerate(signature) if value is None]
+        slots = {old: new for new, old in enumerate(kept)}
+        body = specialized.children[-1]
+        for ref in [n for n in walk(body) if n.type == NodeType.NODE_REF and n.index is not None]:
+            if ref.index >= params:
+                # locals move down to the slots of the removed parameters
+                ref.index -= params - len(kept)
+            elif signature[ref.index] is not None:
+                replace(ref, Node(NodeType.NODE_CONST, value=signature[ref.index]))
+            else:
+                ref.index = slots[ref.index]
+        specialized.children = [specialized.children[index] for index in kept] + [body]
+        return specialized
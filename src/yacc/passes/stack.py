@@ -0,0 +1,151 @@
+from ..asm import Assembly, Instruction, Opcode
+
+_COMMUTATIVE = {Opcode.ADD, Opcode.MUL, Opcode.AND, Opcode.OR, Opcode.CMPEQ, Opcode.CMPNE}
+# comparisons with swapped operands: a < b <=> b > a
+_SWAPPED = {Opcode.CMPLT: Opcode.CMPGT, Opcode.CMPLE: Opcode.CMPGE, Opcode.CMPGT: Opcode.CMPLT, Opcode.CMPGE: Opcode.CMPLE}
+_BINARY = _COMMUTATIVE | set(_SWAPPED) | {Opcode.SUB, Opcode.DIV, Opcode.MOD}
+
+_DUP: Instruction = (Opcode.DUP, None)
+_DROP_ONE: Instruction = (Opcode.DROP, 1)
+
+
+def cost(code: list[Instruction]) -> tuple[int, int]:
+    """Executed instructions, then frame accesses (`get`/`set`), of a straight-line sequence."""
+    return len(code), sum(1 for opcode, _ in code if opcode in (Opcode.GET, Opcode.SET))
+
+
+class StackScheduling:
+    """
+    Keep short-lived values on the operand stack instead of storing them in their
+    frame slot and reading them back, on the assembly of one function.
+
+    Values stored by an assignment statement stay on the stack for the next
+    instruction reading the same slot (`dup`/`swap` take the place of the `get`),
+    repeated reads of a slot become a `dup`:
+    ```
+    add; dup; set 3; drop 1; get 3   =>  add; dup; set 3
+    add; dup; set 3; drop 1; push 1; get 3; sub  =>  add; dup; set 3; push 1; swap; sub
+    get 3; get 3  =>  get 3; dup
+    ```
+    A rewrite is only applied if it is profitable: it must execute fewer
+    instructions, or as many instructions with fewer frame accesses.
+    Once every read of a local has been forwarded that way, the local only lives on
+    the stack and its stores are removed (unless an address is taken in the
+    function, since the slot may then be read through a pointer).
+    Rewrites never span a label, so forwarded values are always on the stack.
+    """
+
+    name = "stack"
+
+    def run(self, assembly: Assembly) -> int:
+        """Schedule the assembly of a function in place. Return the number of rewrites."""
+        code = list(assembly)
+        changes = 0
+        while True:
+            count = self._forward(code)
+            count += self._remove_stores(code)
+            count += self._combine(code)
+            if not count:
+                break
+            changes += count
+        assembly[:] = code
+        return changes
+
+    # Forwarding of stored values
+
+    def _forward(self, code: list[Instruction]) -> int:
+        changes = 0
+        i = 0
+        while i < len(code):
+            for size, rewrite in ((6, self._forward_operand), (4, self._forward_store), (3, self._keep_store), (2, self._forward_get)):
+                window = code[i:i + size]
+                if len(window) < size or any(opcode == Opcode.LABEL for opcode, _ in window):
+                    continue
+                replacement = rewrite(window)
+                if replacement is not None and cost(replacement) < cost(window):
+                    code[i:i + size] = replacement
+                    changes += 1
+                    break
+            i += 1
+        return changes
+
+    @staticmethod
+    def _forward_store(window: list[Instruction]) -> list[Instruction] | None:
+        """`dup; set n; drop 1; get n`  =>  `dup; set n`"""
+        (a, _), (b, slot), drop, (d, other) = window
+        if a == Opcode.DUP and b == Opcode.SET and drop == _DROP_ONE and d == Opcode.GET and other == slot:
+            return window[:2]
+        return None
+
+    @staticmethod
+    def _forward_operand(window: list[Instruction]) -> list[Instruction] | None:
+        """`dup; set n; drop 1; X; get n; op`  =>  `dup; set n; X; [swap;] op` (X pushes one value)"""
+        (a, _), (b, slot), drop, operand, (e, other), (op, _) = window
+        if not (a == Opcode.DUP and b == Opcode.SET and drop == _DROP_ONE and e == Opcode.GET and other == slot and op in _BINARY):
+            return None
+        if operand[0] not in (Opcode.PUSH, Opcode.GET) or operand == (Opcode.GET, slot):
+            return None
+        if op in _COMMUTATIVE:
+            return [*window[:2], operand, (op, None)]
+        if op in _SWAPPED:
+            return [*window[:2], operand, (_SWAPPED[op], None)]
+        return [*window[:2], operand, (Opcode.SWAP, None), (op, None)]
+
+    @staticmethod
+    def _keep_store(window: list[Instruction]) -> list[Instruction] | None:
+        """`dup; set n; drop 1`  =>  `set n`"""
+        (a, _), set_, drop = window
+        if a == Opcode.DUP and set_[0] == Opcode.SET and drop == _DROP_ONE:
+            return [set_]
+        return None
+
+    @staticmethod
+    def _forward_get(window: list[Instruction]) -> list[Instruction] | None:
+        """`set n; get n`  =>  `dup; set n`, and `get n; get n`  =>  `get n; dup`"""
+        first, second = window
+        if first[0] == Opcode.SET and second == (Opcode.GET, first[1]):
+            return [_DUP, first]
+        if first[0] == Opcode.GET and second == first:
+            return [first, _DUP]
+        return None
+
+    # Stack-resident locals
+
+    @staticmethod
+    def _remove_stores(code: list[Instruction]) -> int:
+        """Remove the stores to locals that are never read from their slot anymore."""
+        if (Opcode.PREP, "start") in code:
+            return 0  # an address is taken: any slot may be read through a pointer
+        read = {operand for opcode, operand in code if opcode == Opcode.GET}
+        changes = 0
+        i = 0
+        while i < len(code):
+            opcode, operand = code[i]
+            if opcode == Opcode.SET and operand not in read:
+                if i > 0 and code[i - 1] == _DUP:
+                    del code[i - 1:i + 1]
+                    i -= 1
+                else:
+                    code[i] = _DROP_ONE
+                    i += 1
+                changes += 1
+            else:
+                i += 1
+        return changes
+
+    @staticmethod
+    def _combine(code: list[Instruction]) -> int:
+        """Clean up the values dropped after the removal of stores."""
+        changes = 0
+        i = 0
+        while i + 1 < len(code):
+            (opcode, operand), (next_opcode, next_operand) = code[i], code[i + 1]
+            if next_opcode == Opcode.DROP and next_operand == 1 and opcode in (Opcode.PUSH, Opcode.GET, Opcode.DUP):
+                del code[i:i + 2]
+            elif opcode == Opcode.DROP and next_opcode == Opcode.DROP:
+                code[i:i + 2] = [(Opcode.DROP, operand + next_operand)]
+            else:
+                i += 1
+                continue
+            changes += 1
+        return changes
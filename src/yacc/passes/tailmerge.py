@@ -0,0 +1,70 @@
+from typing import Callable
+
+from ..asm import Assembly, Instruction, Opcode
+
+
+class TailMerging:
+    """
+    Merge the identical sequences that end a path of the assembly of one function
+    (with a `ret` or a `jump`, `-Os`): all but one copy of the sequence jump to the
+    last one instead.
+    ```
+    get 1; push 1; add; ret; ...; get 1; push 1; add; ret
+    =>
+    jump L7_tail; ...; .L7_tail; get 1; push 1; add; ret
+    ```
+    Both copies run the same instructions on the same frame, so the stack they start
+    from does not matter. Only sequences of at least `MIN_LENGTH` instructions are
+    merged (each merge trades them for a `jump`, and adds a jump to one path).
+    The number of instructions removed is counted in `removed`.
+    """
+
+    name = "tailmerge"
+
+    MIN_LENGTH = 3
+
+    def __init__(self) -> None:
+        self.removed: int = 0
+
+    def run(self, assembly: Assembly, new_label: Callable[[], str]) -> int:
+        """Merge the tails of a function in place, labelled with `new_label()`. Return the number of merges."""
+        code = list(assembly)
+        merges = 0
+        while True:
+            best = self._longest_tail(code)
+            if best is None:
+                break
+            first, last, length = best
+            start = last - length + 1
+            if start > 0 and code[start - 1][0] == Opcode.LABEL:
+                label = code[start - 1][1]
+            else:
+                label = new_label()
+                code.insert(start, (Opcode.LABEL, label))
+            code[first - length + 1:first + 1] = [(Opcode.JUMP, label)]
+            self.removed += length - 1
+            merges += 1
+        assembly[:] = code
+        return merges
+
+    def _longest_tail(self, code: list[Instruction]) -> tuple[int, int, int] | None:
+        """Longest tail shared by two paths: (end of the first copy, end of the last one, length)."""
+        ends: dict[Instruction, list[int]] = {}
+        for i, instruction in enumerate(code):
+            if instruction[0] in (Opcode.RET, Opcode.JUMP):
+                ends.setdefault(instruction, []).append(i)
+        best: tuple[int, int, int] | None = None
+        for positions in ends.values():
+            for index, first in enumerate(positions):
+                for last in positions[index + 1:]:
+                    length = 1
+                    # the copies cannot overlap, nor contain a label (a jump into the middle)
+                    while (
+                        first - length >= 0 and last - length > first
+                        and code[first - length] == code[last - length]
+                        and code[first - length][0] != Opcode.LABEL
+                    ):
+                        length += 1
+                    if length >= self.MIN_LENGTH and (best is None or length > best[2]):
+                        best = (first, last, length)
+        return best
@@ -0,0 +1,234 @@
+from ..node import Node, NodeType
+
+from .alias import aliased_slots
+from .analysis import clone, induction_step, replace, walk, written_slots
+from .profile import Profile
+
+_COMPARISONS = {
+    NodeType.NODE_LOWER: lambda a, b: a < b,
+    NodeType.NODE_LOWER_EQ: lambda a, b: a <= b,
+    NodeType.NODE_GREATER: lambda a, b: a > b,
+    NodeType.NODE_GREATER_EQ: lambda a, b: a >= b,
+    NodeType.NODE_NOT_EQ: lambda a, b: a != b,
+}
+
+
+class CountedLoop:
+    """A `for (i = start; i <op> bound; i = i +/- step)` loop with a constant trip count."""
+
+    def __init__(self, loop: Node, counter: int, name: str | None, start: int, step: int, trips: int, body: Node) -> None:
+        self.loop = loop
+        self.counter = counter
+        self.name = name
+        self.start = start
+        self.step = step
+        self.trips = trips
+        self.body = body
+
+    @property
+    def end(self) -> int:
+        return self.start + self.trips * self.step
+
+
+class LoopUnrolling:
+    """
+    Unroll counted loops with a constant trip count and no `break`/`continue`.
+
+    Small loops are fully unrolled: the body is repeated once per iteration, with the
+    counter replaced by its value in each copy. Larger loops are partially unrolled:
+    the body is repeated `factor` times per iteration (reading `i + k * step` in the
+    k-th copy), the counter is incremented once, and the remaining iterations follow
+    the loop as straight-line copies.
+    The size of the unrolled code (in AST nodes) never exceeds `max_size`.
+
+    With a profile, loops (and functions) that never ran are left alone, since
+    unrolling them only grows the code, and hot loops get `HOT_SIZE_FACTOR` times
+    the size budget.
+    """
+
+    name = "unroll"
+
+    # loops running more iterations are not simulated to count their trips
+    MAX_TRIPS = 1 << 16
+    HOT_SIZE_FACTOR = 4
+
+    def __init__(self, factor: int = 4, max_size: int = 256, profile: Profile | None = None) -> None:
+        self.factor = factor
+        self.max_size = max_size
+        self.profile = profile
+        self._done: list[Node] = []
+        self._aliased: set[int] = set()
+
+    def run(self, func: Node) -> int:
+        """Run the pass on a function node. Return the number of unrolled loops."""
+        if func.type != NodeType.NODE_FUNCTION or not func.children:
+            return 0
+        if func.counts is not None and not func.counts[0]:
+            return 0  # never called
+        self._aliased = aliased_slots(func)
+        return self._visit(func.children[-1])
+
+    def _visit(self, node: Node) -> int:
+        changes = sum(self._visit(child) for child in node.children)
+        if node.type not in (NodeType.NODE_BLOCK, NodeType.NODE_SEQ):
+            return changes
+        for position, child in enumerate(node.children):
+            if child.type != NodeType.NODE_LOOP or any(child is done for done in self._done):
+                continue
+            counted = self._match(node.children, position)
+            if counted is not None and self._unroll(counted):
+                changes += 1
+        return changes
+
+    # Recognition
+
+    def _match(self, siblings: list[Node], position: int) -> CountedLoop | None:
+        loop = siblings[position]
+        if len(loop.children) != 1 or loop.children[0].type != NodeType.NODE_COND:
+            return None
+        cond = loop.children[0]
+        if len(cond.children) != 3 or cond.children[2].type != NodeType.NODE_BREAK:
+            return None
+        test, seq = cond.children[0], cond.children[1]
+
+        # i <op> bound
+        if test.type not in _COMPARISONS:
+            return None
+        ref, bound = test.children
+        if ref.type != NodeType.NODE_REF or bound.type != NodeType.NODE_CONST:
+            return None
+        counter = ref.index
+        if counter in self._aliased:
+            return None
+
+        # { body } <continue target> i = i +/- step
+        if seq.type != NodeType.NODE_SEQ or len(seq.children) != 3:
+            return None
+        body, target, increment = seq.children
+        if target.type != NodeType.NODE_TARGET or not target.value:
+            return None
+        step = induction_step(increment, counter)
+        if step is None or counter in written_slots(body) or self._has_loop_control(body):
+            return None
+
+        start = self._match_start(siblings, position, counter)
+        if start is None:
+            return None
+
+        trips = 0
+        value = start
+        compare = _COMPARISONS[test.type]
+        while compare(value, bound.value):
+            trips += 1
+            value += step
+            if trips > self.MAX_TRIPS:
+                return None
+        return CountedLoop(loop, counter, ref.repr, start, step, trips, body)
+
+    @staticmethod
+    def _match_start(siblings: list[Node], position: int, counter: int) -> int | None:
+        """Constant stored into the counter by the last statement writing it before the loop."""
+        for sibling in reversed(siblings[:position]):
+            if sibling.type == NodeType.NODE_TARGET:
+                return None  # a `continue` of an enclosing loop could skip the initialization
+            if counter not in written_slots(sibling):
+                continue
+            if sibling.type != NodeType.NODE_DROP or sibling.children[0].type != NodeType.NODE_AFFECT:
+                return None
+            target, value = sibling.children[0].children
+            if target.type != NodeType.NODE_REF or value.type != NodeType.NODE_CONST:
+                return None
+            return value.value
+        return None
+
+    @staticmethod
+    def _has_loop_control(body: Node) -> bool:
+        """Check for `break`/`continue` statements of the loop itself (not of nested loops)."""
+        stack = [body]
+        while stack:
+            node = stack.pop()
+            if node.type in (NodeType.NODE_BREAK, NodeType.NODE_CONTINUE, NodeType.NODE_TARGET):
+                return True
+            if node.type != NodeType.NODE_LOOP:
+                stack.extend(node.children)
+        return False
+
+    # Transformation
+
+    def _max_size(self, loop: Node) -> int:
+        """Size budget of a loop, scaled by its execution count if it was profiled."""
+        if self.profile is None or loop.counts is None:
+            return self.max_size
+        iterations = loop.counts[0]
+        if not iterations:
+            return 0
+        if self.profile.is_hot(iterations):
+            return self.max_size * self.HOT_SIZE_FACTOR
+        return self.max_size
+
+    def _unroll(self, counted: CountedLoop) -> bool:
+        size = sum(1 for _ in walk(counted.body))
+        max_size = self._max_size(counted.loop)
+        if counted.trips * size <= max_size:
+            copies = [self._copy(counted, Node(NodeType.NODE_CONST, value=counted.start + k * counted.step)) for k in range(counted.trips)]
+            copies.append(self._assign(counted, Node(NodeType.NODE_CONST, value=counted.end)))
+            replace(counted.loop, Node(NodeType.NODE_SEQ, children=copies))
+            return True
+
+        # largest factor for which the loop body and the remaining iterations fit in the budget
+        factor = min(self.factor, counted.trips)
+        while factor >= 2 and (factor + counted.trips % factor) * size > max_size:
+            factor -= 1
+        if factor < 2:
+            return False
+        main_trips = counted.trips - counted.trips % factor
+        main_end = counted.start + main_trips * counted.step
+
+        copies = []
+        for k in range(factor):
+            offset = Node(NodeType.NODE_CONST, value=k * counted.step)
+            counter = Node(NodeType.NODE_REF, index=counted.counter, repr=counted.name)
+            value = counter if k == 0 else Node(NodeType.NODE_ADD, children=[counter, offset])
+            copies.append(self._copy(counted, value))
+        increment = Node(NodeType.NODE_ADD, children=[
+            Node(NodeType.NODE_REF, index=counted.counter, repr=counted.name),
+            Node(NodeType.NODE_CONST, value=factor * counted.step),
+        ])
+        test = Node(NodeType.NODE_NOT_EQ, children=[
+            Node(NodeType.NODE_REF, index=counted.counter, repr=counted.name),
+            Node(NodeType.NODE_CONST, value=main_end),
+        ])
+        seq = Node(NodeType.NODE_SEQ, children=[*copies, Node(NodeType.NODE_TARGET, value=True), self._assign(counted, increment)])
+        cond = Node(NodeType.NODE_COND, children=[test, seq, Node(NodeType.NODE_BREAK)])
+        loop = Node(NodeType.NODE_LOOP, children=[cond])
+        self._done.append(loop)
+        # profiled counts: the unrolled loop runs `factor` times fewer iterations
+        if counted.loop.counts is not None:
+            loop.counts = (counted.loop.counts[0] // factor,)
+        original = counted.loop.children[0].counts
+        if original is not None:
+            cond.counts = (original[0] // factor, original[1])
+
+        remainder = [
+            self._copy(counted, Node(NodeType.NODE_CONST, value=counted.start + k * counted.step))
+            for k in range(main_trips, counted.trips)
+        ]
+        if remainder:
+            remainder.append(self._assign(counted, Node(NodeType.NODE_CONST, value=counted.end)))
+        replace(counted.loop, Node(NodeType.NODE_SEQ, children=[loop, *remainder]))
+        return True
+
+    @staticmethod
+    def _copy(counted: CountedLoop, value: Node) -> Node:
+        """Copy of the loop body, with every read of the counter replaced by `value`."""
+        body = clone(counted.body)
+        for node in list(walk(body)):
+            if node.type == NodeType.NODE_REF and node.index == counted.counter:
+                replace(node, clone(value))
+        return body
+
+    @staticmethod
+    def _assign(counted: CountedLoop, value: Node) -> Node:
+        """`i = value;` statement on the loop counter."""
+        target = Node(NodeType.NODE_REF, index=counted.counter, repr=counted.name)
+        return Node(NodeType.NODE_DROP, children=[Node(NodeType.NODE_AFFECT, children=[target, value])])
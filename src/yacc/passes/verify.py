@@ -0,0 +1,72 @@
+from ..node import Node, NodeType
+
+from ..utils.errors import CompilationError
+
+from .analysis import param_count
+
+_UNARY: set[NodeType] = {
+    NodeType.NODE_NOT, NodeType.NODE_NEG, NodeType.NODE_DEREF, NodeType.NODE_ADDRESS,
+    NodeType.NODE_DROP, NodeType.NODE_DEBUG,
+}
+_BINARY: set[NodeType] = {
+    NodeType.NODE_ADD, NodeType.NODE_SUB, NodeType.NODE_MUL, NodeType.NODE_DIV, NodeType.NODE_MOD,
+    NodeType.NODE_AND, NodeType.NODE_OR,
+    NodeType.NODE_EQ, NodeType.NODE_NOT_EQ,
+    NodeType.NODE_LOWER, NodeType.NODE_LOWER_EQ, NodeType.NODE_GREATER, NodeType.NODE_GREATER_EQ,
+    NodeType.NODE_AFFECT,
+}
+
+
+def verify_function(func: Node, after: str | None = None) -> None:
+    """
+    Check the structural invariants of an analyzed function that the code generator
+    relies on (operand counts, slot indices inside the frame, loop control inside loops).
+    Raise a `CompilationError` naming the pass `after` which the check ran, if any.
+    """
+    try:
+        if func.type != NodeType.NODE_FUNCTION or not func.children:
+            raise ValueError("function node without body")
+        frame = param_count(func) + (func.value or 0)
+        _verify(func.children[-1], frame, loop_depth=0, is_call_target=False)
+    except ValueError as e:
+        where = f" after pass '{after}'" if after else ""
+        raise CompilationError(f"Invalid AST in function '{func.repr}'{where}: {e}")
+
+
+def _verify(node: Node, frame: int, loop_depth: int, is_call_target: bool) -> None:
+    arity = len(node.children)
+    match node.type:
+        case NodeType.NODE_CONST:
+            if not isinstance(node.value, int) or arity:
+                raise ValueError(f"malformed constant {node!r}")
+        case NodeType.NODE_REF:
+            if node.index is None and not is_call_target:
+                raise ValueError(f"unresolved variable '{node.repr}'")
+            if node.index is not None and not 0 <= node.index < frame:
+                raise ValueError(f"slot {node.index} of '{node.repr}' outside of a frame of {frame} slots")
+        case NodeType.NODE_COND:
+            if arity not in (2, 3):
+                raise ValueError(f"conditional with {arity} operands")
+        case NodeType.NODE_BREAK | NodeType.NODE_CONTINUE | NodeType.NODE_TARGET:
+            if loop_depth == 0:
+                raise ValueError(f"{node.type.name} outside of a loop")
+        case NodeType.NODE_CALL:
+            if not arity or node.children[0].type != NodeType.NODE_REF or not node.children[0].repr:
+                raise ValueError("call without named target")
+        case NodeType.NODE_RETURN if arity > 1:
+            raise ValueError("return with several values")
+        case NodeType.NODE_FUNCTION:
+            raise ValueError("nested function")
+        case _ if node.type in _UNARY and arity != 1:
+            raise ValueError(f"{node.type.name} with {arity} operands")
+        case _ if node.type in _BINARY and arity != 2:
+            raise ValueError(f"{node.type.name} with {arity} operands")
+
+    if node.type == NodeType.NODE_AFFECT and node.children[0].type not in (NodeType.NODE_REF, NodeType.NODE_DEREF):
+        raise ValueError("assignment to a non-lvalue")
+    if node.type == NodeType.NODE_ADDRESS and node.children[0].type not in (NodeType.NODE_REF, NodeType.NODE_DEREF):
+        raise ValueError("address of a non-lvalue")
+
+    depth = loop_depth + (node.type == NodeType.NODE_LOOP)
+    for i, child in enumerate(node.children):
+        _verify(child, frame, depth, is_call_target=node.type == NodeType.NODE_CALL and i == 0)
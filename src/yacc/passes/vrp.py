@@ -0,0 +1,401 @@
+from typing import Callable
+
+from ..node import Node, NodeType
+
+from .alias import aliased_slots
+from .analysis import is_pure, replace
+from .consteval import INT_MAX, INT_MIN, c_div
+
+
+class Interval:
+    """Range of values `[lo, hi]` of an `int` (the full range when nothing is known)."""
+
+    def __init__(self, lo: int = INT_MIN, hi: int = INT_MAX) -> None:
+        self.lo = lo
+        self.hi = hi
+
+    @classmethod
+    def of(cls, lo: int, hi: int) -> "Interval":
+        """Interval of an exact result: the full range if it may overflow (values wrap around)."""
+        if lo < INT_MIN or hi > INT_MAX:
+            return cls()
+        return cls(lo, hi)
+
+    @property
+    def constant(self) -> int | None:
+        return self.lo if self.lo == self.hi else None
+
+    def join(self, other: "Interval") -> "Interval":
+        return Interval(min(self.lo, other.lo), max(self.hi, other.hi))
+
+    def widen(self, other: "Interval") -> "Interval":
+        """Join that jumps to the end of the range for bounds still moving (ensures termination)."""
+        return Interval(self.lo if other.lo >= self.lo else INT_MIN, self.hi if other.hi <= self.hi else INT_MAX)
+
+    def __contains__(self, value: int) -> bool:
+        return self.lo <= value <= self.hi
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Interval) and (self.lo, self.hi) == (other.lo, other.hi)
+
+    def __repr__(self) -> str:
+        return f"Interval({self.lo}, {self.hi})"
+
+
+BOOLEAN = Interval(0, 1)
+
+# Ranges of the variables at one point of the program (missing variables can have any value),
+# None where the program cannot go
+Env = dict[int, Interval] | None
+
+_MIRRORED = {
+    NodeType.NODE_LOWER: NodeType.NODE_GREATER,
+    NodeType.NODE_LOWER_EQ: NodeType.NODE_GREATER_EQ,
+    NodeType.NODE_GREATER: NodeType.NODE_LOWER,
+    NodeType.NODE_GREATER_EQ: NodeType.NODE_LOWER_EQ,
+    NodeType.NODE_EQ: NodeType.NODE_EQ,
+    NodeType.NODE_NOT_EQ: NodeType.NODE_NOT_EQ,
+}
+_NEGATED = {
+    NodeType.NODE_LOWER: NodeType.NODE_GREATER_EQ,
+    NodeType.NODE_LOWER_EQ: NodeType.NODE_GREATER,
+    NodeType.NODE_GREATER: NodeType.NODE_LOWER_EQ,
+    NodeType.NODE_GREATER_EQ: NodeType.NODE_LOWER,
+    NodeType.NODE_EQ: NodeType.NODE_NOT_EQ,
+    NodeType.NODE_NOT_EQ: NodeType.NODE_EQ,
+}
+# comparison of two intervals: True / False if it holds / fails for every pair of values
+_COMPARE: dict[NodeType, Callable[[Interval, Interval], bool | None]] = {
+    NodeType.NODE_LOWER: lambda a, b: True if a.hi < b.lo else False if a.lo >= b.hi else None,
+    NodeType.NODE_LOWER_EQ: lambda a, b: True if a.hi <= b.lo else False if a.lo > b.hi else None,
+    NodeType.NODE_GREATER: lambda a, b: True if a.lo > b.hi else False if a.hi <= b.lo else None,
+    NodeType.NODE_GREATER_EQ: lambda a, b: True if a.lo >= b.hi else False if a.hi < b.lo else None,
+    NodeType.NODE_EQ: lambda a, b: True if a.constant is not None and a == b else False if a.hi < b.lo or b.hi < a.lo else None,
+    NodeType.NODE_NOT_EQ: lambda a, b: False if a.constant is not None and a == b else True if a.hi < b.lo or b.hi < a.lo else None,
+}
+
+# nodes whose value is recorded, and folded if it is always the same
+_FOLDED = {*_COMPARE, NodeType.NODE_NOT, NodeType.NODE_AND, NodeType.NODE_OR}
+
+
+def join(a: Env, b: Env) -> Env:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return {slot: a[slot].join(b[slot]) for slot in a.keys() & b.keys()}
+
+
+def widen(old: Env, new: Env) -> Env:
+    if old is None or new is None:
+        return new if old is None else old
+    return {slot: old[slot].widen(new[slot]) for slot in old.keys() & new.keys()}
+
+
+class ValueRangePropagation:
+    """
+    Interval analysis of the local variables of a function, used to fold comparisons.
+
+    The body is interpreted abstractly, in evaluation order: every variable has a
+    range of possible values, set by assignments and narrowed by the conditions of
+    `if` statements and loops (`x` is in `[11, INT_MAX]` in the then branch of
+    `if (x > 10)`). Ranges are joined where control flow merges, and loops are
+    iterated until their ranges are stable (with widening, then one narrowing step
+    that recovers the bounds of the loop condition).
+
+    Comparisons whose result is the same on every execution become constants, as
+    do conditions of `if` statements and loops that are always true or always
+    false, so that dead code elimination removes the unreachable branches:
+    ```
+    for (i = 0; i < n; i++) { if (i >= 0) s = s + i; }  =>  ... { if (1) s = s + i; }
+    ```
+    Variables whose address is taken are not tracked, and arithmetic that may
+    overflow gives the full range.
+    """
+
+    name = "vrp"
+
+    def __init__(self) -> None:
+        self._aliased: set[int] = set()
+        self._loops: list[dict[str, Env]] = []
+        # results of the comparisons and conditions, over every execution
+        self._facts: dict[int, tuple[Node, Interval]] = {}
+        self._tests: set[int] = set()
+        self._record: bool = True
+
+    def run(self, func: Node) -> int:
+        """Run the pass on a function node. Return the number of folded comparisons."""
+        if func.type != NodeType.NODE_FUNCTION or not func.children:
+            return 0
+        self._aliased = aliased_slots(func)
+        self._loops = []
+        self._facts = {}
+        self._tests = set()
+        self._record = True
+        self._exec(func.children[-1], {})
+
+        changes = 0
+        for key, (node, interval) in self._facts.items():
+            if not is_pure(node):
+                continue
+            value = interval.constant
+            if key in self._tests and _truth(interval) is not None:
+                value = int(_truth(interval))  # only the truth value of a condition matters
+            if value is not None and node.type != NodeType.NODE_CONST:
+                replace(node, Node(NodeType.NODE_CONST, value=value))
+                changes += 1
+        return changes
+
+    # Statements
+
+    def _exec(self, node: Node, env: Env) -> Env:
+        if node.type == NodeType.NODE_TARGET and node.value:
+            # `continue` statements jump here, even if the code before cannot be reached
+            env = join(env, self._loops[-1]["continue"])
+            self._loops[-1]["continue"] = None
+        if env is None:
+            return None
+        match node.type:
+            case NodeType.NODE_BLOCK | NodeType.NODE_SEQ:
+                for child in node.children:
+                    env = self._exec(child, env)
+                return env
+
+            case NodeType.NODE_DECLARE:
+                return env
+
+            case NodeType.NODE_DROP | NodeType.NODE_DEBUG:
+                return self._eval(node.children[0], env)[1]
+
+            case NodeType.NODE_RETURN:
+                if node.children:
+                    self._eval(node.children[0], env)
+                return None
+
+            case NodeType.NODE_COND:
+                env = self._condition(node.children[0], env)
+                then_env = self._exec(node.children[1], self._refine(node.children[0], env, True))
+                else_env = self._refine(node.children[0], env, False)
+                if len(node.children) > 2:
+                    else_env = self._exec(node.children[2], else_env)
+                return join(then_env, else_env)
+
+            case NodeType.NODE_LOOP:
+                return self._loop(node, env)
+
+            case NodeType.NODE_BREAK:
+                self._loops[-1]["break"] = join(self._loops[-1]["break"], env)
+                return None
+
+            case NodeType.NODE_CONTINUE:
+                self._loops[-1]["continue"] = join(self._loops[-1]["continue"], env)
+                return None
+
+            case NodeType.NODE_TARGET:
+                return env
+
+        return self._eval(node, env)[1]
+
+    def _condition(self, test: Node, env: Env) -> Env:
+        """Evaluate the test of a condition (its truth value may be folded)."""
+        interval, env = self._eval(test, env)
+        if self._record:
+            self._tests.add(id(test))
+            self._remember(test, interval)
+        return env
+
+    def _loop(self, loop: Node, entry: Env) -> Env:
+        # find ranges at the loop head that hold on every iteration, without recording
+        record, self._record = self._record, False
+        head = entry
+        while True:
+            back, _ = self._iterate(loop, head)
+            new = widen(head, join(entry, back))
+            if new == head:
+                break
+            head = new
+        back, _ = self._iterate(loop, head)
+        head = join(entry, back)
+        self._record = record
+        return self._iterate(loop, head)[1]
+
+    def _iterate(self, loop: Node, head: Env) -> tuple[Env, Env]:
+        """Run one iteration of a loop from `head`. Return the ranges at the back edge and at the exit."""
+        self._loops.append({"break": None, "continue": None})
+        env = head
+        for child in loop.children:
+            env = self._exec(child, env)
+        state = self._loops.pop()
+        # without a continue target, `continue` goes back to the head
+        return join(env, state["continue"]), state["break"]
+
+    # Expressions
+
+    def _eval(self, node: Node, env: Env) -> tuple[Interval, Env]:
+        """Range of an expression, and the ranges after its evaluation (assignments)."""
+        match node.type:
+            case NodeType.NODE_CONST:
+                # out of the int range (left by `fold`), the value wraps around in MSM
+                return Interval.of(node.value, node.value), env
+
+            case NodeType.NODE_REF:
+                return env.get(node.index, Interval()), env
+
+            case NodeType.NODE_ADDRESS:
+                return Interval(), env
+
+            case NodeType.NODE_AFFECT:
+                target, expr = node.children
+                if target.type == NodeType.NODE_DEREF:
+                    interval, env = self._eval(expr, env)
+                    return interval, self._eval(target.children[0], env)[1]
+                interval, env = self._eval(expr, env)
+                if target.index not in self._aliased:
+                    env = {**env, target.index: interval}
+                return interval, env
+
+            case NodeType.NODE_AND | NodeType.NODE_OR:
+                # the right operand is only evaluated if the left one does not decide
+                left, env = self._eval(node.children[0], env)
+                right, right_env = self._eval(node.children[1], env)
+                interval = self._apply(node.type, [left, right])
+                if self._record:
+                    self._remember(node, interval)
+                return interval, join(env, right_env)
+
+        intervals = []
+        operands = node.children[1:] if node.type == NodeType.NODE_CALL else node.children
+        for child in operands:
+            interval, env = self._eval(child, env)
+            intervals.append(interval)
+
+        interval = self._apply(node.type, intervals)
+        if self._record and node.type in _FOLDED:
+            self._remember(node, interval)
+        return interval, env
+
+    def _value(self, node: Node, env: Env) -> Interval:
+        """Range of a pure expression, without recording it."""
+        record, self._record = self._record, False
+        interval = self._eval(node, env)[0]
+        self._record = record
+        return interval
+
+    def _remember(self, node: Node, interval: Interval) -> None:
+        previous = self._facts.get(id(node))
+        self._facts[id(node)] = (node, interval if previous is None else previous[1].join(interval))
+
+    @staticmethod
+    def _apply(op: NodeType, args: list[Interval]) -> Interval:
+        match op:
+            case NodeType.NODE_NEG:
+                (a,) = args
+                return Interval.of(-a.hi, -a.lo)
+            case NodeType.NODE_NOT:
+                (a,) = args
+                truth = _truth(a)
+                return BOOLEAN if truth is None else Interval(int(not truth), int(not truth))
+            case NodeType.NODE_ADD:
+                a, b = args
+                return Interval.of(a.lo + b.lo, a.hi + b.hi)
+            case NodeType.NODE_SUB:
+                a, b = args
+                return Interval.of(a.lo - b.hi, a.hi - b.lo)
+            case NodeType.NODE_MUL:
+                a, b = args
+                products = [x * y for x in (a.lo, a.hi) for y in (b.lo, b.hi)]
+                return Interval.of(min(products), max(products))
+            case NodeType.NODE_DIV:
+                a, b = args
+                if 0 in b:
+                    return Interval()
+                quotients = [c_div(x, y) for x in (a.lo, a.hi) for y in (b.lo, b.hi)]
+                return Interval.of(min(quotients), max(quotients))
+            case NodeType.NODE_MOD:
+                a, b = args
+                if 0 in b:
+                    return Interval()
+                bound = max(abs(b.lo), abs(b.hi)) - 1
+                if a.lo >= 0:
+                    return Interval(0, min(a.hi, bound))
+                if a.hi <= 0:
+                    return Interval(max(a.lo, -bound), 0)
+                return Interval(-bound, bound)
+            case NodeType.NODE_AND | NodeType.NODE_OR:
+                truth = [_truth(x) for x in args]
+                if op == NodeType.NODE_AND:
+                    if False in truth:
+                        return Interval(0, 0)
+                    return Interval(1, 1) if truth == [True, True] else BOOLEAN
+                if True in truth:
+                    return Interval(1, 1)
+                return Interval(0, 0) if truth == [False, False] else BOOLEAN
+            case _ if op in _COMPARE:
+                a, b = args
+                result = _COMPARE[op](a, b)
+                return BOOLEAN if result is None else Interval(int(result), int(result))
+        return Interval()
+
+    # Conditions
+
+    def _refine(self, cond: Node, env: Env, truth: bool) -> Env:
+        """Ranges where the condition `cond` has the truth value `truth` (None if it cannot)."""
+        if env is None or not is_pure(cond):
+            return env
+        value = self._value(cond, env)
+        if _truth(value) not in (None, truth):
+            return None
+
+        match cond.type:
+            case NodeType.NODE_NOT:
+                return self._refine(cond.children[0], env, not truth)
+            case NodeType.NODE_AND | NodeType.NODE_OR:
+                left, right = cond.children
+                if truth == (cond.type == NodeType.NODE_AND):
+                    # both operands have this truth value
+                    return self._refine(right, self._refine(left, env, truth), truth)
+                return join(self._refine(left, env, truth), self._refine(right, env, truth))
+            case NodeType.NODE_REF:
+                return self._narrow(env, cond, NodeType.NODE_NOT_EQ if truth else NodeType.NODE_EQ, Interval(0, 0))
+            case _ if cond.type in _COMPARE:
+                op = cond.type if truth else _NEGATED[cond.type]
+                left, right = cond.children
+                env = self._narrow(env, left, op, self._value(right, env))
+                if env is not None:
+                    env = self._narrow(env, right, _MIRRORED[op], self._value(left, env))
+                return env
+        return env
+
+    def _narrow(self, env: Env, node: Node, op: NodeType, bound: Interval) -> Env:
+        """Ranges where `node <op> bound` holds, if `node` is a tracked variable."""
+        if node.type != NodeType.NODE_REF or node.index in self._aliased:
+            return env
+        current = env.get(node.index, Interval())
+        lo, hi = current.lo, current.hi
+        match op:
+            case NodeType.NODE_LOWER:
+                hi = min(hi, bound.hi - 1)
+            case NodeType.NODE_LOWER_EQ:
+                hi = min(hi, bound.hi)
+            case NodeType.NODE_GREATER:
+                lo = max(lo, bound.lo + 1)
+            case NodeType.NODE_GREATER_EQ:
+                lo = max(lo, bound.lo)
+            case NodeType.NODE_EQ:
+                lo, hi = max(lo, bound.lo), min(hi, bound.hi)
+            case NodeType.NODE_NOT_EQ:
+                if bound.constant is not None and lo == bound.constant:
+                    lo += 1
+                if bound.constant is not None and hi == bound.constant:
+                    hi -= 1
+        if lo > hi:
+            return None
+        return {**env, node.index: Interval(lo, hi)}
+
+
+def _truth(interval: Interval) -> bool | None:
+    """Truth value of every value of an interval (None if it is not always the same)."""
+    if 0 not in interval:
+        return True
+    return False if interval.constant == 0 else None
+
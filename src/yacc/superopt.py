@@ -0,0 +1,251 @@
+"""
+Superoptimizer for the peephole rules (`python -m yacc.superopt`).
+
+Every straight-line sequence of up to N stack instructions (`drop`, `dup`, `swap`,
+`not`, arithmetic and comparisons, `push` of a few constants, `get`/`set` of two
+frame slots) is enumerated, shortest first. Sequences are grouped by what they
+compute on random input stacks, and each sequence that has a cheaper equivalent
+in its group becomes a rule, once the equivalence is checked on every input stack
+and frame over a domain of values (with the extremes, where arithmetic wraps
+around and division traps). Sequences that contain the pattern of a rule found
+before are skipped, since the peephole pass reduces them with that rule first.
+
+The rules are written in the format read by `passes.peephole.RuleDatabase`; the
+ones shipped with the compiler (`passes/peephole.rules`) are regenerated with:
+```
+python -m yacc.superopt -n 3 -o src/yacc/passes/peephole.rules
+```
+"""
+
+import argparse
+import random
+import sys
+
+from itertools import product
+from typing import Callable
+
+from .asm import Instruction, Opcode
+from .passes.peephole import SLOT_OPCODES, SLOT_VARIABLES, RuleDatabase, Sequence
+from .passes.stack import cost
+
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+# values of the exhaustive check, for every value of the input stack and frame
+VALUES = (-2, -1, 0, 1, 2, 3, INT_MIN, INT_MAX)
+# random input stacks that sequences are grouped by
+TESTS = 8
+
+
+class _Trap(Exception):
+    """Division by zero (or overflowing): the simulator stops."""
+
+
+def _wrap(value: int) -> int:
+    """Value of a 32-bit integer of the simulator."""
+    return (value - INT_MIN) % 2 ** 32 + INT_MIN
+
+
+def _div(a: int, b: int) -> int:
+    if b == 0 or (a == INT_MIN and b == -1):
+        raise _Trap
+    quotient = abs(a) // abs(b)
+    return -quotient if (a < 0) ^ (b < 0) else quotient
+
+
+def _mod(a: int, b: int) -> int:
+    return a - _div(a, b) * b
+
+
+_BINARY: dict[Opcode, Callable[[int, int], int]] = {
+    Opcode.ADD: lambda a, b: _wrap(a + b),
+    Opcode.SUB: lambda a, b: _wrap(a - b),
+    Opcode.MUL: lambda a, b: _wrap(a * b),
+    Opcode.DIV: _div,
+    Opcode.MOD: _mod,
+    Opcode.AND: lambda a, b: int(a != 0 and b != 0),
+    Opcode.OR: lambda a, b: int(a != 0 or b != 0),
+    Opcode.CMPEQ: lambda a, b: int(a == b),
+    Opcode.CMPNE: lambda a, b: int(a != b),
+    Opcode.CMPLT: lambda a, b: int(a < b),
+    Opcode.CMPLE: lambda a, b: int(a <= b),
+    Opcode.CMPGT: lambda a, b: int(a > b),
+    Opcode.CMPGE: lambda a, b: int(a >= b),
+}
+
+
+def execute(code: Sequence, stack: list[int], slots: dict[str, int]) -> None:
+    """Run a sequence on a stack (top last) and frame slots, in place, like the simulator."""
+    for opcode, operand in code:
+        match opcode:
+            case Opcode.DROP:
+                del stack[len(stack) - operand:]
+            case Opcode.DUP:
+                stack.append(stack[-1])
+            case Opcode.SWAP:
+                stack[-1], stack[-2] = stack[-2], stack[-1]
+            case Opcode.NOT:
+                stack[-1] = int(stack[-1] == 0)
+            case Opcode.PUSH:
+                stack.append(operand)
+            case Opcode.GET:
+                stack.append(slots[operand])
+            case Opcode.SET:
+                slots[operand] = stack.pop()
+            case _:
+                b = stack.pop()
+                stack[-1] = _BINARY[opcode](stack[-1], b)
+
+
+def depth(code: Sequence) -> int:
+    """Number of values of the stack that a sequence reads."""
+    height = lowest = 0
+    for opcode, operand in code:
+        if opcode == Opcode.DROP:
+            height -= operand
+        elif opcode in (Opcode.DUP, Opcode.NOT):
+            lowest = min(lowest, height - 1)
+            height += opcode == Opcode.DUP
+        elif opcode == Opcode.SWAP or opcode in _BINARY:
+            lowest = min(lowest, height - 2)
+            height -= opcode != Opcode.SWAP
+        elif opcode == Opcode.SET:
+            height -= 1
+        else:
+            height += 1
+        lowest = min(lowest, height)
+    return -lowest
+
+
+def alphabet(constants: tuple[int, ...] = (0, 1)) -> list[Instruction]:
+    """Instructions that sequences are made of."""
+    return [
+        (Opcode.DROP, 1), (Opcode.DROP, 2), (Opcode.DUP, None), (Opcode.SWAP, None), (Opcode.NOT, None),
+        *((opcode, None) for opcode in _BINARY),
+        *((Opcode.PUSH, constant) for constant in constants),
+        *((opcode, variable) for opcode in (Opcode.GET, Opcode.SET) for variable in SLOT_VARIABLES),
+    ]
+
+
+def canonical(code: Sequence) -> Sequence:
+    """Sequence with its slots renamed in order (`get b; set a` -> `get a; set b`)."""
+    names: dict[str, str] = {}
+    for opcode, operand in code:
+        if opcode in SLOT_OPCODES and operand not in names:
+            names[operand] = SLOT_VARIABLES[len(names)]
+    return tuple((opcode, names[operand] if opcode in SLOT_OPCODES else operand) for opcode, operand in code)
+
+
+class Superoptimizer:
+    """
+    Search the cheapest equivalent of every sequence of up to `max_length`
+    instructions of `alphabet(constants)` (see the module documentation).
+    """
+
+    def __init__(self, max_length: int = 3, constants: tuple[int, ...] = (0, 1), seed: int = 0) -> None:
+        self.max_length = max_length
+        self.alphabet = alphabet(constants)
+        # input stacks (deep enough for any sequence) and frames of the grouping tests
+        rng = random.Random(seed)
+        value = lambda: rng.choice(VALUES) if rng.random() < 0.5 else rng.randint(INT_MIN, INT_MAX)
+        self.tests = [
+            ([value() for _ in range(2 * max_length)], {variable: value() for variable in SLOT_VARIABLES})
+            for _ in range(TESTS)
+        ]
+        # sequences enumerated, and checked for equivalence
+        self.sequences: int = 0
+        self.checks: int = 0
+
+    def search(self) -> RuleDatabase:
+        """Rules from each sequence to its cheapest equivalent."""
+        groups: dict[tuple, list[Sequence]] = {}
+        rules: dict[Sequence, Sequence] = {}
+        for length in range(self.max_length + 1):
+            # cheapest first, so that every group is sorted by cost
+            sequences = [
+                code for code in product(self.alphabet, repeat=length)
+                if code == canonical(code) and not self._reducible(code, rules)
+            ]
+            sequences.sort(key=lambda code: cost(list(code)))
+            self.sequences += len(sequences)
+            for code in sequences:
+                key = self._fingerprint(code)
+                if key is None:
+                    continue
+                group = groups.setdefault(key, [])
+                for candidate in group:
+                    if cost(list(candidate)) < cost(list(code)) and self.equivalent(code, candidate):
+                        rules[code] = candidate
+                        break
+                else:
+                    group.append(code)
+        return RuleDatabase(rules)
+
+    def equivalent(self, first: Sequence, second: Sequence) -> bool:
+        """Check that two sequences have the same effect on every input stack and frame over `VALUES`."""
+        self.checks += 1
+        size = max(depth(first), depth(second))
+        variables = sorted({operand for opcode, operand in first + second if opcode in SLOT_OPCODES})
+        for values in product(VALUES, repeat=size + len(variables)):
+            stack, frame = list(values[:size]), dict(zip(variables, values[size:]))
+            if _result(first, stack, frame) != _result(second, stack, frame):
+                return False
+        return True
+
+    def _fingerprint(self, code: Sequence) -> tuple | None:
+        """Results of a sequence on the test inputs (None if it always traps)."""
+        results = tuple(_result(code, stack, frame) for stack, frame in self.tests)
+        if all(result is None for result in results):
+            return None
+        return results
+
+    @staticmethod
+    def _reducible(code: Sequence, rules: dict[Sequence, Sequence]) -> bool:
+        """Check if a part of a sequence is the pattern of a rule."""
+        return any(
+            canonical(code[start:end]) in rules
+            for start in range(len(code))
+            for end in range(start + 1, len(code) + 1)
+            if end - start < len(code)
+        )
+
+
+def _result(code: Sequence, stack: list[int], frame: dict[str, int]) -> tuple | None:
+    """Stack and frame after a sequence (None if it traps)."""
+    stack, frame = list(stack), dict(frame)
+    try:
+        execute(code, stack, frame)
+    except _Trap:
+        return None
+    return tuple(stack), tuple(sorted(frame.items()))
+
+
+def main() -> None:
+    """Write the peephole rules found for sequences up to a length (`python -m yacc.superopt -n 3`)."""
+    ap = argparse.ArgumentParser(description="Search the cheapest equivalent of short MSM instruction sequences, as peephole rules")
+    ap.add_argument("-n", "--max-length", dest="max_length", type=int, default=3, metavar="N", help="Maximum length of the sequences (default: 3)")
+    ap.add_argument("--constants", dest="constants", default="0,1", metavar="C,...", help="Constants that sequences may push (default: 0,1)")
+    ap.add_argument("-o", "--output", dest="output", default=None, help="Output file path (default: standard output)")
+    args = ap.parse_args()
+    try:
+        constants = tuple(int(constant) for constant in args.constants.split(","))
+    except ValueError:
+        ap.error(f"Invalid constants '{args.constants}'")
+
+    superoptimizer = Superoptimizer(args.max_length, constants)
+    database = superoptimizer.search()
+    text = (
+        f"# Peephole rules found by the superoptimizer (python -m yacc.superopt -n {args.max_length} --constants {args.constants})\n"
+        "# pattern => cheaper equivalent sequence (nothing: removed); a and b are two different frame slots\n"
+        + database.format()
+    )
+    print(f"{len(database.rules)} rules ({superoptimizer.sequences} sequences, {superoptimizer.checks} checked)", file=sys.stderr)
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
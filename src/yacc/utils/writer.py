@@ -0,0 +1,136 @@
+import io
+import os
+import sys
+
+from typing import BinaryIO, Callable, Iterable, TextIO
+
+from ..asm import Assembly
+from ..binary import HEADER, WORD, Encoder, offset
+
+class AssemblyWriter:
+    """
+    Output of the generated code, written part by part (e.g. one function at a time)
+    with buffered writes, so that the whole program is never held in memory.
+
+    Every part goes through `transform` first (e.g. the assembly optimizer), and is
+    only formatted as text when it is written.
+    A file is written to a temporary path next to it and only replaces the output
+    file in `close`: a compilation that fails (`discard`) leaves no partial file.
+    """
+
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self, output_path: str = None, to_stdout: bool = False, transform: Callable[[Assembly], Assembly] = None) -> None:
+        if not to_stdout and output_path is None:
+            raise ValueError("No output path specified for code generation.")
+        self.output_path = output_path
+        self._to_stdout = to_stdout
+        self.transform = transform
+        self._file: TextIO | None = None
+        self._temp_path: str | None = None
+
+    def write(self, code: Assembly) -> None:
+        """Write a part of the program."""
+        if self.transform is not None:
+            code = self.transform(code)
+        self._write(code.lines())
+
+    def close(self, lines: Assembly | Iterable[str] = ()) -> None:
+        """
+        Write the last code as it is (e.g. code added at the end by the optimizer,
+        or any text like the IR) and complete the output.
+        """
+        self._write(lines.lines() if isinstance(lines, Assembly) else lines)
+        if self._to_stdout:
+            if self._file is not None:
+                self._file.flush()
+            return
+        self._open().close()
+        os.replace(self._temp_path, self.output_path)
+        self._file = self._temp_path = None
+
+    def discard(self) -> None:
+        """Drop the output written so far (if it can still be dropped: stdout cannot)."""
+        if self._to_stdout or self._file is None:
+            return
+        self._file.close()
+        os.remove(self._temp_path)
+        self._file = self._temp_path = None
+
+    def _write(self, lines: Iterable[str]) -> None:
+        text = "\n".join(lines)
+        if text:
+            self._open().write(text + "\n")
+
+    def _open(self) -> TextIO:
+        if self._file is None:
+            if self._to_stdout:
+                self._file = sys.stdout
+            else:
+                self._temp_path = f"{self.output_path}.tmp"
+                self._file = open(self._temp_path, "w", encoding="utf-8", buffering=self.BUFFER_SIZE)
+        return self._file
+
+
+class BinaryWriter(AssemblyWriter):
+    """
+    Output of the generated code as a pre-assembled MSM program (`--emit binary`,
+    see `binary.py`), encoded part by part like the assembly.
+
+    The labels used before they are defined (e.g. calls to the next functions) and
+    the header are patched in `close`: in place in the file, while a program printed
+    to stdout is kept in memory until then.
+    """
+
+    def __init__(self, output_path: str = None, to_stdout: bool = False, transform: Callable[[Assembly], Assembly] = None) -> None:
+        super().__init__(output_path, to_stdout, transform)
+        self.encoder = Encoder()
+
+    def write(self, code: Assembly) -> None:
+        """Write a part of the program."""
+        if self.transform is not None:
+            code = self.transform(code)
+        self._write(self.encoder.encode(code))
+
+    def close(self, lines: Assembly | Iterable[str] = ()) -> None:
+        """Write the last code as it is, resolve the remaining labels and complete the output."""
+        code = lines if isinstance(lines, Assembly) else Assembly.parse(lines)
+        self._write(self.encoder.encode(code))
+        header, fixups = self.encoder.finish()
+        file = self._open()
+        for address, value in fixups:
+            file.seek(offset(address))
+            file.write(WORD.pack(value))
+        file.seek(0)
+        file.write(header)
+        if self._to_stdout:
+            sys.stdout.flush()
+            sys.stdout.buffer.write(file.getvalue())
+            sys.stdout.buffer.flush()
+            self._file = None
+            return
+        file.close()
+        os.replace(self._temp_path, self.output_path)
+        self._file = self._temp_path = None
+
+    def discard(self) -> None:
+        """Drop the output written so far."""
+        if self._to_stdout:
+            self._file = None
+        else:
+            super().discard()
+
+    def _write(self, words: bytes) -> None:
+        if words:
+            self._open().write(words)
+
+    def _open(self) -> BinaryIO:
+        if self._file is None:
+            if self._to_stdout:
+                self._file = io.BytesIO()
+            else:
+                self._temp_path = f"{self.output_path}.tmp"
+                self._file = open(self._temp_path, "w+b", buffering=self.BUFFER_SIZE)
+            # room for the header
+            self._file.write(bytes(HEADER.size))
+        return self._file
@@ -68,3 +68,124 @@ def test_cli_invalid_program_raises_compilation_error(capsys):
     with pytest.raises(CompilationError):
         run_main_with_args(["--string", program, "--stdout"], capsys)
 
+
+def test_cli_failed_compilation_leaves_no_output_file(capsys, tmp_path: Path):
+    output_file = tmp_path / "out.asm"
+    program = "int f() { debug 1; return 0; }"
+    with pytest.raises(CompilationError, match="main"):
+        run_main_with_args(["--string", program, "-o", str(output_file)], capsys)
+    assert list(tmp_path.iterdir()) == []
+
+
+
+def test_cli_optimization_level_zero_keeps_expressions(capsys):
+    program = "int main() { debug !0; }"
+    out = run_main_with_args(["--string", program, "--stdout", "-O0"], capsys)
+    assert out == ".start\nprep main\ncall 0\nhalt\n.main\npush 0\nnot\ndbg\npush 0\nret\n"
+
+
+def test_cli_pass_flag_disables_one_pass(capsys):
+    program = "int main() { debug 1 + 2; }"
+    out = run_main_with_args(["--string", program, "--stdout", "-fno-fold"], capsys)
+    assert out == ".start\nprep main\ncall 0\nhalt\n.main\npush 1\npush 2\nadd\ndbg\npush 0\nret\n"
+
+
+def test_cli_unknown_pass_flag_is_rejected(capsys):
+    with pytest.raises(SystemExit):
+        run_main_with_args(["--string", "int main() { return 0; }", "--stdout", "-fno-nothing"], capsys)
+
+
+def test_cli_whole_program_drops_unreachable_functions(capsys):
+    program = "int unused() { debug 1; return 0; } int main() { debug 2; return 0; }"
+    out = run_main_with_args(["--string", program, "--stdout", "--whole-program"], capsys)
+    assert out == ".start\nprep main\ncall 0\nhalt\n.main\npush 2\ndbg\npush 0\nret\n"
+
+
+def test_cli_pass_stats_reports_fused_loops(capsys):
+    program = "int main() { int i; int s; int t; for (i = 0; i < 9; i++) { s = s + i; } for (i = 0; i < 9; i++) { t = t + 2; } return s + t; }"
+    from yacc.__main__ import main
+
+    old_argv = sys.argv
+    try:
+        sys.argv = [old_argv[0], "--string", program, "--stdout", "-fno-unroll", "--pass-stats"]
+        main()
+    finally:
+        sys.argv = old_argv
+    assert "Fused loops: main (i)" in capsys.readouterr().err
+
+
+def test_cli_auto_memoize_reads_and_writes_the_table(capsys):
+    program = "int fib(int n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); } int main() { return 0; }"
+    plain = run_main_with_args(["--string", program, "--stdout"], capsys)
+    memoized = run_main_with_args(["--string", program, "--stdout", "--auto-memoize", "--memo-size", "16"], capsys)
+    assert "write" not in plain.split("\n")
+    assert "write" in memoized.split("\n")
+    assert "push 16" in memoized.split("\n")
+
+
+def test_cli_emit_ir_prints_ssa_form(capsys):
+    program = "int main() { int i; i = 0; while (i < 3) { i = i + 1; } return i; }"
+    out = run_main_with_args(["--string", program, "--stdout", "--emit-ir"], capsys)
+    assert out.startswith("function main(params: 0, frame: 1) {\nbb0:\n")
+    assert " = phi " in out
+    assert "prep" not in out
+
+
+def test_cli_via_ir_generates_assembly(capsys):
+    program = "int main() { int a; a = 2; debug a * 3; return 0; }"
+    out = run_main_with_args(["--string", program, "--stdout", "--via-ir", "-O0"], capsys)
+    assert out == ".start\nprep main\ncall 0\nhalt\n.main\npush 2\npush 3\nmul\ndbg\npush 0\nret\n"
+
+
+def test_cli_profile_generate_then_use(capsys, tmp_path: Path):
+    program = "int main() { int i; for (i = 0; i < 3; i++) { if (i != 9) debug i; else debug 0; } return 0; }"
+    out = run_main_with_args(["--string", program, "--stdout", "--profile-generate"], capsys)
+    assert "push 0\nread\npush 5\nadd\nread\ndbg\nhalt\n" in out
+
+    # output of the instrumented program: the counts of main, the loop and the branches of both conditions
+    profile = tmp_path / "profile.txt"
+    profile.write_text("0\n1\n2\nyacc-profile\n6\n1\n4\n3\n1\n3\n0\n", encoding="utf-8")
+    out = run_main_with_args(["--string", program, "--stdout", "-O0", "--profile-use", str(profile)], capsys)
+    # the loop exits with a direct branch, the hot `then` branch is laid out last
+    assert "jumpf L0_loop_end" in out and "jumpt L1_then" in out and out.count("jump") == 4
+
+    profile.write_text("yacc-profile\n1\n1\n", encoding="utf-8")
+    with pytest.raises(CompilationError):
+        run_main_with_args(["--string", program, "--stdout", "--profile-use", str(profile)], capsys)
+
+
+def test_cli_emit_binary_writes_preassembled_program(capsys, tmp_path: Path):
+    from yacc.asm import Assembly
+    from yacc.binary import assemble, disassemble
+
+    program = "int f(int x) { return x * 2; } int main() { debug f(read()); return 0; } int read() { return 21; }"
+    output_file = tmp_path / "out.bin"
+    text = run_main_with_args(["--string", program, "--stdout"], capsys)
+    run_main_with_args(["--string", program, "-o", str(output_file), "--emit", "binary"], capsys)
+    binary = output_file.read_bytes()
+    assert binary.startswith(b"\x7fMSM")
+    assert binary == assemble(Assembly.parse(text.splitlines()))
+    # same instructions, with labels named after their address
+    opcodes = [line.split()[0] for line in text.splitlines() if not line.startswith(".")]
+    assert [line.split()[0] for line in disassemble(binary).lines() if not line.startswith(".")] == opcodes
+
+
+def test_cli_size_level_outlines_and_reports_code_size(capsys):
+    from yacc.__main__ import main
+
+    line = "debug (x * 3 + y * 5 - (x + y) * 2) / 7;"
+    program = f"int f(int x, int y) {{ {line} return 0; }} int g(int x, int y) {{ {line} return 1; }} int main() {{ f(1, 2); g(3, 4); return 0; }}"
+    default = run_main_with_args(["--string", program, "--stdout"], capsys)
+
+    old_argv = sys.argv
+    try:
+        sys.argv = [old_argv[0], "--string", program, "--stdout", "-Os", "--pass-stats"]
+        main()
+    finally:
+        sys.argv = old_argv
+    captured = capsys.readouterr()
+    assert ".$outline0\n" in captured.out
+    assert captured.out.count("call 2\n") == 4
+    size = sum(1 for line in captured.out.splitlines() if not line.startswith("."))
+    assert size < sum(1 for line in default.splitlines() if not line.startswith("."))
+    assert f"-> {size} instructions (1 outlined subroutines)" in captured.err
@@ -1,10 +1,19 @@
 from yacc.codegen import CodeGenerator
+from yacc.asm import Assembly, Opcode, parse_instruction
+from yacc.binary import HEADER, assemble, disassemble
+from yacc.passes.jumps import JumpThreading
+from yacc.passes.outline import Outlining
+from yacc.passes.peephole import DEFAULT_RULES, Peephole, RuleDatabase
+from yacc.passes.stack import StackScheduling, cost
+from yacc.passes.tailmerge import TailMerging
 from yacc.node import Node, NodeType
 from yacc.lexer import Lexer
 from yacc.parser import Parser
 from yacc.sema import SemanticAnalyzer
 from yacc.optimizer import Optimizer
 from yacc.source import Source
+from yacc.token import TokenType
+from yacc.superopt import Superoptimizer
 
 
 def gen_stdout_for_node(node, capsys, locals_count: int = 0):
@@ -122,13 +131,9 @@ def test_codegen_simple_while_loop(capsys):
             ".main\n"
             ".L0_loop_start\n"
             "push 1\n"
-            "jumpf L1_else\n"
+            "jumpf L0_loop_end\n"
             "push 1\n"
             "dbg\n"
-            "jump L1_end\n"
-            ".L1_else\n"
-            "jump L0_loop_end\n"
-            ".L1_end\n"
             "jump L0_loop_start\n"
             ".L0_loop_end\n"
             "push 0\n"
@@ -170,15 +175,11 @@ def test_codegen_continue_uses_custom_target(capsys):
             ".main\n"
             ".L0_loop_start\n"
             "push 1\n"
-            "jumpf L1_else\n"
+            "jumpf L0_loop_end\n"
             "jump L0_loop_continue\n"
             ".L0_loop_continue\n"
             "push 2\n"
             "drop 1\n"
-            "jump L1_end\n"
-            ".L1_else\n"
-            "jump L0_loop_end\n"
-            ".L1_end\n"
             "jump L0_loop_start\n"
             ".L0_loop_end\n"
             "push 0\n"
@@ -273,3 +274,321 @@ def test_codegen_cmp_eq_emits_cmpeq(capsys):
     out = gen_stdout_for_node(node, capsys)
     assert out == ".start\nprep main\ncall 0\nhalt\n.main\npush 3\npush 4\ncmpeq\ndbg\npush 0\nret\n"
 
+
+
+def compile_text(source: str, capsys, **codegen_options) -> str:
+    src = Source.from_string(source)
+    lexer = Lexer(src)
+    parser = Parser(lexer)
+    sema = SemanticAnalyzer()
+    opt = Optimizer()
+    cg = CodeGenerator(to_stdout=True, **codegen_options)
+
+    cg._start()
+    while lexer.T.type != TokenType.TOK_EOF:
+        node = opt.optimize_ast(sema.analyze(parser.parse()))
+        cg.codegen(node, nbVars=sema.symbol_table.nbVars)
+    cg._output(cg._finalize())
+    return capsys.readouterr().out
+
+
+def test_codegen_conditions_branch_and_short_circuit(capsys):
+    out = compile_text(
+        "int f(int a, int b) { while (a < 9 && !(b == 5)) a = a + b; if (a == 0 || b) debug a; return a; }"
+        "int main() { debug f(1, 2) && f(0, 0); return 0; }",
+        capsys,
+    )
+    # loop conditions jump straight out of the loop, `||` jumps over its right operand
+    assert "cmplt\njumpf L0_loop_end\nget 2\njumpf L0_loop_end\n" in out
+    assert "cmpeq\njumpt L2_skip\nget 1\njumpf L1_else\n.L2_skip\nget 0\ndbg\n" in out
+    # a value of `&&` with a call on the right: the call is skipped if the left operand is false
+    assert "call 2\njumpf L3_false\nprep f\npush 0\npush 0\ncall 2\njumpf L3_false\npush 1\njump L3_end\n.L3_false\npush 0\n.L3_end\ndbg\n" in out
+    assert "and" not in out.split("\n") and "or" not in out.split("\n")
+
+
+def test_codegen_rotated_loops_branch_back_once_per_iteration(capsys):
+    out = compile_text(
+        "int main() { int i; int j; i = 0; while (i < 3) { i = i + 1; if (i == 2) continue; debug i; }"
+        " for (j = 0; j < 2; j = j + 1) { if (j) continue; debug j; } return 0; }",
+        capsys,
+        rotate_loops=True,
+    )
+    # guard, body, then the condition again: `continue` goes to the condition of a `while`
+    assert (
+        "get 0\npush 3\ncmplt\njumpf L0_loop_end\n.L0_loop_start\n"
+        "get 0\npush 1\nadd\ndup\nset 0\ndrop 1\n"
+        "get 0\npush 2\ncmpeq\njumpt L0_loop_cond\nget 0\ndbg\n"
+        ".L0_loop_cond\nget 0\npush 3\ncmplt\njumpt L0_loop_start\n.L0_loop_end\n"
+    ) in out
+    # and to the step of a `for`
+    assert "get 1\njumpt L1_loop_continue\nget 1\ndbg\n.L1_loop_continue\n" in out
+    assert "get 1\npush 2\ncmplt\njumpt L1_loop_start\n.L1_loop_end\n" in out
+    assert "\njump " not in out
+
+
+def test_codegen_rotated_do_while_loop_branches_back_unless_it_exits(capsys):
+    out = compile_text("int main() { int i; i = 0; do { i = i + 1; } while (i < 3); return i; }", capsys, rotate_loops=True)
+    assert ".L0_loop_start\nget 0\npush 1\nadd\ndup\nset 0\ndrop 1\n.L0_loop_continue\nget 0\npush 3\ncmplt\njumpt L0_loop_start\n.L0_loop_end\n" in out
+    assert "\njump " not in out
+
+
+def test_codegen_self_tail_call_becomes_jump(capsys):
+    out = compile_text(
+        "int loop(int n, int acc) { if (n == 0) return acc; return loop(n - 1, acc + n); }"
+        "int main() { return loop(3, 0); }",
+        capsys,
+    )
+    assert out.startswith(
+        ".start\nprep main\ncall 0\nhalt\n"
+        ".loop\n"
+        ".L0_entry\n"
+        "get 0\npush 0\ncmpeq\njumpf L1_else\nget 1\nret\n.L1_else\n"
+        "get 0\npush 1\nsub\n"
+        "get 1\nget 0\nadd\n"
+        "set 1\nset 0\n"
+        "jump L0_entry\n"
+        "push 0\nret\n"
+    )
+
+
+def test_codegen_tail_calls_can_be_disabled(capsys):
+    out = compile_text(
+        "int loop(int n) { return loop(n); } int main() { return 0; }",
+        capsys,
+        tail_calls=False,
+    )
+    assert "jump" not in out
+    assert "prep loop\nget 0\ncall 1\nret\n" in out
+
+
+def test_codegen_tail_call_kept_when_an_address_is_taken(capsys):
+    out = compile_text(
+        "int f(int *p, int n) { int x; x = n; if (n == 0) return *p; return f(&x, n - 1); }"
+        "int main() { int y; y = 1; return f(&y, 2); }",
+        capsys,
+    )
+    assert "entry" not in out
+    assert "call 2\nret\n" in out
+
+
+def test_codegen_tail_call_skipped_for_other_function(capsys):
+    out = compile_text(
+        "int f(int n) { return n; } int g(int n) { return f(n); } int main() { return g(1); }",
+        capsys,
+    )
+    assert "_entry" not in out
+
+
+def test_codegen_stack_values_forward_stores_to_next_read(capsys):
+    out = compile_text(
+        "int main() { int a; int b; a = 2 * 3; b = 10 - a; debug b; return 0; }",
+        capsys,
+        stack_values=True,
+    )
+    # both locals only live on the operand stack: their stores are gone
+    assert "set" not in out and "get" not in out
+    assert ".main\nresn 2\npush 6\npush 10\nswap\nsub\ndbg\n" in out
+
+
+def test_codegen_stack_values_keep_stores_when_an_address_is_taken(capsys):
+    out = compile_text(
+        "int main() { int a; int b; int *p; p = &a; b = 5; debug *(p - 1); return 0; }",
+        capsys,
+        stack_values=True,
+    )
+    # b is only read through the pointer
+    assert "push 5\nset 1\n" in out
+
+
+def test_codegen_frame_base_is_computed_once_for_addresses(capsys):
+    out = compile_text(
+        "int main() { int a; int b; int *p; a = 1; b = 2; p = &a; debug *p; p = &b; debug *p; return 0; }",
+        capsys,
+        frame_base=True,
+    )
+    # the frame base goes to a hidden slot after the locals, then &a and &b read it
+    assert ".main\nresn 4\nprep start\nswap\ndrop 1\npush 1\nsub\nset 3\n" in out
+    assert out.count("prep start") == 1
+    assert "get 3\ndup\nset 2\n" in out and "get 3\npush 1\nsub\ndup\nset 2\n" in out
+
+
+def test_codegen_frame_base_not_cached_for_a_single_address(capsys):
+    program = "int main() { int a; int *p; a = 1; p = &a; debug *p; return 0; }"
+    assert compile_text(program, capsys, frame_base=True) == compile_text(program, capsys)
+    assert compile_text(program, capsys, frame_base=True).count("resn 2\n") == 1
+
+
+def test_jump_threading_cleans_up_jumps_and_labels():
+    code = Assembly.parse([
+        ".f", ".L0_loop_start", "get 0", "jumpf L1_else", "jump L0_loop_end", ".L1_else",
+        "get 0", "jumpf L2_else", "push 1", "dbg", ".L2_else", "jump L3_next", ".L3_next", "jump L0_loop_start",
+        ".L0_loop_end", ".L4_end", "push 0", "ret", "push 0", "ret",
+    ])
+    assert JumpThreading().run(code, keep={"f"}) > 0
+    # branch over a jump inverted, jump chain threaded, dead return and unused labels removed
+    assert list(code.lines()) == [
+        ".f", ".L0_loop_start", "get 0", "jumpt L1_loop_end",
+        "get 0", "jumpf L0_loop_start", "push 1", "dbg", "jump L0_loop_start",
+        ".L1_loop_end", "push 0", "ret",
+    ]
+
+
+def test_codegen_jump_threading_keeps_labels_unique(capsys):
+    program = (
+        "int f(int n) { while (1) { if (n > 9) break; n = n + 1; } return n; }"
+        "int main() { int i; for (i = 0; i < 3; i++) { if (i == 1) continue; debug f(i); } return 0; }"
+    )
+    out = compile_text(program, capsys, thread_jumps=True)
+    # labels are numbered in order across functions
+    numbers = [int(line[2:].partition("_")[0]) for line in out.split("\n") if line.startswith(".L")]
+    assert numbers == list(range(len(numbers))) and numbers
+    # no return after a return
+    assert "ret\npush 0\nret" not in out
+
+
+def test_tail_merging_jumps_to_the_last_copy():
+    code = Assembly.parse([
+        ".f", "get 0", "jumpf L0_else", "get 1", "push 1", "add", "ret",
+        ".L0_else", "get 2", "get 1", "push 1", "add", "ret",
+    ])
+    merging = TailMerging()
+    assert merging.run(code, lambda: "L1_tail") == 1
+    assert list(code.lines()) == [
+        ".f", "get 0", "jumpf L0_else", "jump L1_tail",
+        ".L0_else", "get 2", ".L1_tail", "get 1", "push 1", "add", "ret",
+    ]
+    assert merging.removed == 3
+
+
+def test_outlining_shares_repeated_sequences_with_slots_as_arguments():
+    def sequence(a: int, b: int) -> list[str]:
+        return [f"get {a}", "push 3", "mul", f"get {b}", "add", "push 1", "sub", "push 5", "mul", "push 2", "div", "dbg"]
+
+    code = Assembly.parse([
+        ".f", *sequence(0, 1), "push 0", "ret",
+        ".g", *sequence(2, 0), "get 2", "ret",
+        ".h", *sequence(1, 2), "push 0", "ret",
+    ])
+    outlining = Outlining()
+    assert outlining.run(code) == 3
+    assert outlining.outlined == [("$outline0", 3)]
+    assert (outlining.size_before, outlining.size_after) == (42, 33)
+    lines = list(code.lines())
+    assert lines[:8] == [".f", "prep $outline0", "get 0", "get 1", "call 2", "dbg", "push 0", "ret"]
+    assert lines[lines.index(".g") + 1:lines.index(".g") + 5] == ["prep $outline0", "get 2", "get 0", "call 2"]
+    assert lines[lines.index(".$outline0"):] == [".$outline0", *sequence(0, 1)[:-1], "ret"]
+
+
+def test_peephole_rules_apply_until_no_rule_matches():
+    import pytest
+
+    from yacc.utils.errors import CompilationError
+
+    database = RuleDatabase.parse("# test rules\npush 0; add =>\npush 0; cmpeq => not\nget a; set a =>\nget a; set b; get a => get a; dup; set b\n")
+    code = Assembly.parse([".f", "get 2", "push 0", "add", "push 0", "cmpeq", "get 3", "set 3", "get 1", "set 4", "get 1", "get 1", "set 1", "ret"])
+    peephole = Peephole(database)
+    assert peephole.run(code) == 5
+    # `get 1; set 1` only matches once the slots are the same
+    assert list(code.lines()) == [".f", "get 2", "not", "get 1", "dup", "set 4", "ret"]
+    with pytest.raises(CompilationError, match="not cheaper"):
+        RuleDatabase.parse("add => add")
+
+
+def test_superoptimizer_finds_verified_rules():
+    database = Superoptimizer(max_length=2, constants=(0,)).search()
+    rules = database.format().splitlines()
+    for rule in ("swap; add => add", "swap; cmplt => cmpgt", "push 0; add =>", "push 0; cmpeq => not", "get a; set a =>", "set a; get a => dup; set a"):
+        assert rule in rules
+    # `x / x` is not 1 when x is 0 (the division traps), `x * 0` is not worth a rule
+    assert not any(rule.startswith(("dup; div", "push 0; mul")) for rule in rules)
+    # the shipped rules were found the same way
+    shipped = RuleDatabase.from_path(DEFAULT_RULES)
+    assert all(shipped.rules[pattern] == replacement for pattern, replacement in database.rules.items())
+
+
+def test_stack_scheduling_rewrites_are_profitable():
+    code = Assembly.parse([".L0_loop_start", "get 0", "get 0", "mul", "push 1", "add", "dup", "set 0", "drop 1", ".L0_loop_end", "get 0", "ret"])
+    assert StackScheduling().run(code) == 2
+    lines = list(code.lines())
+    assert lines == [".L0_loop_start", "get 0", "dup", "mul", "push 1", "add", "set 0", ".L0_loop_end", "get 0", "ret"]
+    assert cost([parse_instruction(line) for line in lines[1:7]]) == (6, 2)
+
+
+def test_codegen_profiled_hot_then_branch_is_laid_out_last(capsys):
+    node = Node(
+        NodeType.NODE_COND,
+        children=[
+            Node(NodeType.NODE_CONST, value=1),
+            Node(NodeType.NODE_DEBUG, children=[Node(NodeType.NODE_CONST, value=2)]),
+            Node(NodeType.NODE_DEBUG, children=[Node(NodeType.NODE_CONST, value=3)]),
+        ],
+    )
+    node.counts = (10, 1)
+    out = gen_stdout_for_node(node, capsys)
+    assert out == ".start\nprep main\ncall 0\nhalt\n.main\npush 1\njumpt L0_then\npush 3\ndbg\njump L0_end\n.L0_then\npush 2\ndbg\n.L0_end\npush 0\nret\n"
+
+
+def test_codegen_writer_streams_each_function(tmp_path):
+    from yacc.utils.writer import AssemblyWriter
+
+    output = tmp_path / "out.asm"
+    chunks = []
+    writer = AssemblyWriter(str(output), transform=lambda code: chunks.append(code) or code)
+    cg = CodeGenerator(output_path=str(output), writer=writer)
+    cg._start()
+    for name in ("f", "main"):
+        body = Node(NodeType.NODE_BLOCK, children=[Node(NodeType.NODE_DEBUG, children=[Node(NodeType.NODE_CONST, value=1)])])
+        cg.codegen(Node(NodeType.NODE_FUNCTION, repr=name, children=[body]))
+        # only the function being generated is kept in memory
+        assert len(cg._code) == 0
+    assert [chunk[-5] for chunk in chunks] == [(Opcode.LABEL, "f"), (Opcode.LABEL, "main")]
+    # nothing replaces the output file before the end
+    assert not output.exists()
+    rest = cg._finalize()
+    rest.emit(Opcode.HALT)
+    cg._output(rest)
+    assert output.read_text(encoding="utf-8") == (
+        ".start\nprep main\ncall 0\nhalt\n.f\npush 1\ndbg\npush 0\nret\n.main\npush 1\ndbg\npush 0\nret\nhalt\n"
+    )
+
+
+def test_assembly_stores_typed_instructions():
+    lines = [".f", "resn 2", "push -3", "prep start", "jumpf L0_else", "get 1", "dbg", "ret"]
+    code = Assembly.parse(lines)
+    assert list(code.lines()) == lines
+    assert code[1] == (Opcode.RESN, 2) and code[4] == (Opcode.JUMPF, "L0_else")
+    # opcodes are stored as bytes numbered like in the simulator
+    assert code.opcodes.typecode == "B" and code.opcodes[2] == 3
+    del code[2:4]
+    code[0:1] = [(Opcode.LABEL, "g")]
+    assert list(code.lines())[:3] == [".g", "resn 2", "jumpf L0_else"]
+
+
+def test_binary_program_resolves_labels_and_disassembles():
+    code = Assembly.parse([".start", "prep main", "call 0", "halt", ".main", "push -2", "jumpf main", "ret"])
+    program = assemble(code)
+    magic, version, size, entry = HEADER.unpack_from(program)
+    assert (magic, version, size, entry) == (b"\x7fMSM", 1, 11, 1)
+    # prep main (forward label, patched at the end), call 0, halt, push -2, jumpf main, ret
+    words = [int.from_bytes(program[i:i + 4], "little", signed=True) for i in range(HEADER.size, len(program), 4)]
+    assert words == [25, 6, 26, 0, 32, 3, -2, 24, 6, 27]
+    assert list(disassemble(program).lines()) == [".start", "prep L6", "call 0", "halt", ".L6", "push -2", "jumpf L6", "ret"]
+    assert assemble(disassemble(program)) == program
+
+
+def test_binary_writer_patches_labels_across_parts(tmp_path):
+    import pytest
+
+    from yacc.utils.errors import CompilationError
+    from yacc.utils.writer import BinaryWriter
+
+    output = tmp_path / "out.bin"
+    writer = BinaryWriter(str(output))
+    writer.write(Assembly.parse([".start", "prep main", "call 0", "halt", ".f", "push 1", "dbg", "push 0", "ret"]))
+    writer.write(Assembly.parse([".main", "prep f", "call 0", "ret"]))
+    writer.close()
+    assert output.read_bytes() == assemble(Assembly.parse(
+        [".start", "prep main", "call 0", "halt", ".f", "push 1", "dbg", "push 0", "ret", ".main", "prep f", "call 0", "ret"]
+    ))
+    with pytest.raises(CompilationError, match="Undefined label 'g'"):
+        BinaryWriter(to_stdout=True).close(Assembly.parse([".start", "prep g", "call 0", "halt"]))
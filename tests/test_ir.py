@@ -0,0 +1,131 @@
+import pytest
+
+from yacc.ir.core import Instruction, IRType
+from yacc.ir.lower import lower_function
+from yacc.ir.msm import generate_msm
+from yacc.ir.verify import verify_ir
+from yacc.lexer import Lexer
+from yacc.optimizer import Optimizer
+from yacc.parser import Parser
+from yacc.sema import SemanticAnalyzer
+from yacc.source import Source
+from yacc.token import TokenType
+from yacc.utils.errors import CompilationError
+
+
+def lower_text(source: str, level: str = "0") -> dict:
+    """Lower every function of a program (optimized at `level`), by name."""
+    lexer = Lexer(Source.from_string(source))
+    parser = Parser(lexer)
+    sema = SemanticAnalyzer()
+    opt = Optimizer(level=level)
+    functions = {}
+    while lexer.T.type != TokenType.TOK_EOF:
+        node = opt.optimize_ast(sema.analyze(parser.parse()))
+        functions[node.repr] = lower_function(node)
+    return functions
+
+
+def opcodes(function) -> list[str]:
+    return [inst.opcode for inst in function.instructions()]
+
+
+def test_ir_straight_line_code_has_no_phi():
+    main = lower_text("int main() { int a; int b; a = 1; b = a + 2; return b * a; }")["main"]
+    verify_ir(main)
+    assert len(main.blocks) == 1
+    assert opcodes(main) == ["const", "const", "add", "mul", "ret"]
+
+
+def test_ir_loop_header_merges_variables_with_phis():
+    f = lower_text("int f(int n) { int s; int i; s = 0; for (i = 0; i < n; i++) { s = s + i; } return s; }")["f"]
+    verify_ir(f)
+    header = f.blocks[1]
+    assert len(header.phis) == 2
+    assert {len(phi.operands) for phi in header.phis} == {2}
+    assert f.entry.instructions[0].opcode == "param"
+
+
+def test_ir_if_else_join_has_phi():
+    f = lower_text("int f(int c) { int x; if (c) x = 1; else x = 2; return x; }")["f"]
+    verify_ir(f)
+    phis = [inst for inst in f.instructions() if inst.opcode == "phi"]
+    assert len(phis) == 1
+    assert sorted(operand.value for operand in phis[0].operands) == [1, 2]
+
+
+def test_ir_logical_operators_skip_a_right_operand_with_side_effects():
+    f = lower_text("int g(int x) { return x; } int f(int a) { return a && g(6); }")["f"]
+    verify_ir(f)
+    # the call is in its own block, only reached if `a` is true
+    (branch,) = [inst for inst in f.instructions() if inst.opcode == "branch"]
+    call = next(inst for inst in f.instructions() if inst.opcode == "call")
+    assert call.block is branch.targets[0] and call.block is not f.entry
+    (phi,) = [inst for inst in f.instructions() if inst.opcode == "phi"]
+    assert phi.operands[0].value == 0 and phi.operands[1].opcode == "cmpne"
+    assert "and" not in opcodes(f)
+
+
+def test_ir_address_taken_locals_stay_in_frame_slots():
+    main = lower_text("int main() { int a; int *p; a = 1; p = &a; *p = 2; return a; }")["main"]
+    verify_ir(main)
+    assert "phi" not in opcodes(main)
+    # only `a` is accessed through a pointer, `p` is an SSA value
+    assert opcodes(main).count("set") == 1
+    address = next(inst for inst in main.instructions() if inst.opcode == "addr")
+    assert address.type == IRType.PTR
+
+
+def test_ir_dump_names_values_and_blocks():
+    main = lower_text("int main() { int i; i = 0; while (i < 2) i = i + 1; debug i; return 0; }")["main"]
+    text = "\n".join(main.dump())
+    assert text.startswith("function main(params: 0, frame: 1) {\nbb0:\n    %0:int = const 0\n    jump bb1\n")
+    assert "  ; preds: bb0, " in text
+    assert "    debug %" in text
+
+
+def test_ir_verifier_rejects_missing_terminator():
+    main = lower_text("int main() { return 1; }")["main"]
+    main.entry.instructions.pop()
+    with pytest.raises(CompilationError, match="does not end with a terminator"):
+        verify_ir(main)
+
+
+def test_ir_verifier_rejects_use_before_definition():
+    main = lower_text("int main() { int a; a = 1; return a + 2; }")["main"]
+    add = next(inst for inst in main.instructions() if inst.opcode == "add")
+    early = Instruction("neg", [add])
+    early.block = main.entry
+    main.entry.instructions.insert(0, early)
+    with pytest.raises(CompilationError, match="before its definition"):
+        verify_ir(main)
+
+
+def test_ir_msm_keeps_single_use_values_on_the_stack():
+    f = lower_text("int f(int a, int b) { return 10 - (a + b) * 2; }")["f"]
+    assert list(generate_msm(f).lines()) == [".f", "push 10", "get 0", "get 1", "add", "push 2", "mul", "sub", "ret"]
+
+
+def test_ir_msm_phi_copies_share_slots():
+    f = lower_text("int f(int n) { int s; s = 0; while (n > 0) { s = s + n; n = n - 1; } return s; }")["f"]
+    asm = list(generate_msm(f).lines())
+    # the loop updates the variables in place: no copy between slots
+    assert asm.count("set 0") == 1
+    assert asm.count("set 1") == 2
+    assert "resn 1" in asm
+
+
+def test_ir_msm_self_tail_call_becomes_jump():
+    f = lower_text("int f(int n, int acc) { if (n == 0) return acc; return f(n - 1, acc + n); }")["f"]
+    asm = list(generate_msm(f).lines())
+    assert "prep f" not in asm
+    assert asm[:2] == [".f", ".f.entry"]
+    # the new arguments stay on the stack until they overwrite the parameters
+    assert asm[-9:] == ["get 0", "push 1", "sub", "get 1", "get 0", "add", "set 1", "set 0", "jump f.entry"]
+
+
+def test_ir_msm_tail_call_kept_when_an_address_is_taken():
+    # the argument points to the frame of the caller, which must not be overwritten
+    f = lower_text("int f(int *p, int n) { int x; x = n; if (n == 0) return *p; return f(&x, n - 1); }")["f"]
+    asm = list(generate_msm(f).lines())
+    assert "prep f" in asm and "jump f.entry" not in asm
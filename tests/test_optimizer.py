@@ -1,5 +1,8 @@
+import pytest
+
 from yacc.node import Node, NodeType
 from yacc.optimizer import Optimizer
+from yacc.utils.errors import CompilationError
 
 
 def test_optimizer_is_passthrough_identity():
@@ -61,3 +64,579 @@ def test_optimizer_does_not_fold_division_by_zero():
     assert out.type == NodeType.NODE_DIV
     assert out.children[0].value == 10
     assert out.children[1].value == 0
+
+
+def optimize_text(source: str, **options) -> Node:
+    return optimize_text_with(Optimizer(**options), source)
+
+
+def find_all(node: Node, node_type: NodeType) -> list[Node]:
+    found = [node] if node.type == node_type else []
+    for child in node.children:
+        found.extend(find_all(child, node_type))
+    return found
+
+
+def test_optimizer_right_operand_of_logical_operators_may_not_run():
+    # `n = 5` only runs if d != 0: the first store is still read, and n may still be 1
+    func = optimize_text("int f(int d) { int n; n = 1; if (d != 0 && (n = 5)) debug 0; return n == 5; }")
+    assert [affect.children[1].value for affect in find_all(func, NodeType.NODE_AFFECT)] == [1, 5]
+    assert find_all(func, NodeType.NODE_RETURN)[0].children[0].type == NodeType.NODE_EQ
+
+
+def test_optimizer_licm_hoists_invariant_expression():
+    func = optimize_text(
+        "int f(int n, int base) { int i; int s; for (i = 0; i < 10; i++) { s = s + (n * 4 + base); } return s; }",
+        disable=["unroll"],
+    )
+    body = func.children[-1]
+    loop = find_all(body, NodeType.NODE_LOOP)[0]
+
+    # the sum is computed once, in a new slot, before the loop
+    assert func.value == 3
+    assert find_all(loop, NodeType.NODE_MUL) == []
+    hoisted = [
+        affect for affect in find_all(body, NodeType.NODE_AFFECT)
+        if affect.children[0].index == 4
+    ]
+    assert len(hoisted) == 1
+    assert str(hoisted[0].children[1]) == "(NODE_ADD (NODE_MUL (NODE_REF) (NODE_CONST)) (NODE_REF))"
+
+
+def test_optimizer_licm_keeps_expression_using_modified_variable():
+    func = optimize_text(
+        "int f(int n) { int i; int s; for (i = 0; i < 10; i++) { s = s + n * 4; n = n - 1; } return s; }",
+        disable=["unroll"],
+    )
+    loop = find_all(func, NodeType.NODE_LOOP)[0]
+    assert len(find_all(loop, NodeType.NODE_MUL)) == 1
+    assert func.value == 2
+
+
+def test_optimizer_licm_respects_pointer_writes_to_address_taken_variable():
+    func = optimize_text(
+        "int f(int n) { int *p; int s; p = &n; while (s < 10) { s = s + n * 2; *p = 1; } return s; }"
+    )
+    loop = find_all(func, NodeType.NODE_LOOP)[0]
+    assert len(find_all(loop, NodeType.NODE_MUL)) == 1
+
+
+def test_optimizer_licm_keeps_loads_of_slots_written_in_the_loop():
+    # *&x and *p read x, which the loop assigns directly
+    for source in (
+        "int f() { int x; x = 0; while (*&x < 5) { x = x + 1; } return x; }",
+        "int f() { int x; int *p; int i; x = 0; p = &x; for (i = 0; *p < 3 && i < 10; i++) x++; return i; }",
+    ):
+        func = optimize_text(source, disable=["unroll"])
+        loop = find_all(func, NodeType.NODE_LOOP)[0]
+        assert len(find_all(loop.children[-1].children[0], NodeType.NODE_DEREF)) == 1
+
+
+def test_optimizer_licm_hoists_loads_that_pointer_writes_cannot_reach():
+    func = optimize_text(
+        "int f() { int x; int y; int *p; int *q; int s; x = 5; p = &x; q = &y; s = 0; "
+        "while (*p > s) { s = s + 1; *q = s; } return s + y; }",
+        disable=["unroll"],
+    )
+    loop = find_all(func, NodeType.NODE_LOOP)[0]
+    assert len(find_all(loop, NodeType.NODE_DEREF)) == 1  # only the store through q
+
+
+def test_optimizer_licm_hoists_variables_that_pointer_writes_cannot_reach():
+    func = optimize_text(
+        "int f(int n) { int x; int *p; int s; p = &x; while (s < 10) { s = s + n * 2; *p = s; } return s + x; }"
+    )
+    loop = find_all(func, NodeType.NODE_LOOP)[0]
+    assert find_all(loop, NodeType.NODE_MUL) == []
+
+
+def test_alias_analysis_follows_pointers_between_slots():
+    from yacc.passes.alias import AliasAnalysis
+
+    func = optimize_text(
+        "int f(int n) { int a; int b; int c; int *p; int **q; q = &p; *q = &b; *(p - 1) = 1; return a + b + c + n; }",
+        level="0",
+    )
+    alias = AliasAnalysis(func)
+    assert not alias.escaped
+    # p holds &b, and p - 1 is the slot after b
+    assert alias.contents[4] == {2}
+    assert alias.aliased == {3, 4}
+    assert alias.may_alias(Node(NodeType.NODE_REF, index=4), 2)
+    assert not alias.may_alias(Node(NodeType.NODE_REF, index=4), 1)
+
+    func = optimize_text("int f(int n) { int a; int b; g(&a); return a + b; }", level="0")
+    assert AliasAnalysis(func).aliased == {0, 1, 2}
+
+
+def test_optimizer_licm_does_not_hoist_division_from_body():
+    func = optimize_text(
+        "int f(int a, int b) { int s; while (s < 10) { if (b) { s = s + a / b; } s = s + 1; } return s; }"
+    )
+    loop = find_all(func, NodeType.NODE_LOOP)[0]
+    assert len(find_all(loop, NodeType.NODE_DIV)) == 1
+
+
+def test_optimizer_licm_can_be_disabled():
+    func = optimize_text(
+        "int f(int n) { int s; while (s < n * 2) { s = s + 1; } return s; }",
+        disable=["licm"],
+    )
+    loop = find_all(func, NodeType.NODE_LOOP)[0]
+    assert len(find_all(loop, NodeType.NODE_MUL)) == 1
+
+
+def test_optimizer_fuse_merges_loops_with_the_same_header():
+    opt = Optimizer(disable=["unroll"])
+    func = optimize_text_with(
+        opt,
+        "int f(int n) { int i; int s; int t; for (i = 0; i < n; i++) { s = s + i; } "
+        "for (i = 0; i < n; i++) { t = t + i * i; } return s + t; }",
+    )
+    loops = find_all(func, NodeType.NODE_LOOP)
+    assert len(loops) == 1
+    assert len(find_all(loops[0], NodeType.NODE_MUL)) == 1
+    assert opt.fused_loops == ["f (i)"]
+
+
+def test_optimizer_fuse_keeps_loops_reading_results_of_the_previous_one():
+    opt = Optimizer(disable=["unroll"])
+    func = optimize_text_with(
+        opt,
+        "int f(int n) { int i; int s; int t; for (i = 0; i < n; i++) { s = s + i; } "
+        "for (i = 0; i < n; i++) { t = t + s; } return t; }",
+    )
+    assert len(find_all(func, NodeType.NODE_LOOP)) == 2
+    assert opt.fused_loops == []
+
+
+def test_optimizer_auto_memoize_adds_a_table_to_pure_recursive_functions():
+    opt = Optimizer(auto_memoize=True, memo_size=64)
+    func = optimize_text_with(opt, "int fib(int n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); }")
+    assert opt.memoization.memoized == ["fib"]
+    # 64 entries of 3 words: used flag, argument, result
+    assert opt.memoization.words == 192
+    stores = [a for a in find_all(func, NodeType.NODE_AFFECT) if a.children[0].type == NodeType.NODE_DEREF]
+    assert len(stores) == 3 * 3  # two returns and the end of the function
+    # calls are still evaluated at compile time on the function without its table
+    assert not find_all(opt.functions["fib"], NodeType.NODE_DEREF)
+
+
+def test_optimizer_auto_memoize_skips_impure_functions():
+    opt = Optimizer(auto_memoize=True)
+    optimize_text_with(opt, "int f(int n) { debug n; if (n < 1) return 0; return f(n - 1); }")
+    optimize_text_with(opt, "int g(int a, int b, int c, int d) { if (a < 1) return 0; return g(a - 1, b, c, d); }")
+    assert opt.memoization.memoized == []
+
+
+def test_optimizer_dse_removes_unused_local_and_shrinks_frame():
+    func = optimize_text("int main() { int unused; int a; unused = 5; a = 2; return a; }")
+    assert func.value == 1
+    affects = find_all(func, NodeType.NODE_AFFECT)
+    assert len(affects) == 1
+    assert affects[0].children[0].index == 0
+    assert affects[0].children[1].value == 2
+
+
+def test_optimizer_dse_keeps_side_effects_of_dead_initializer():
+    func = optimize_text("int main() { int a; a = f(3); return 0; }")
+    assert func.value == 0
+    assert find_all(func, NodeType.NODE_AFFECT) == []
+    assert len(find_all(func, NodeType.NODE_CALL)) == 1
+
+
+def test_optimizer_dse_removes_overwritten_store():
+    func = optimize_text("int main() { int a; a = 1; a = 2; debug a; return 0; }")
+    affects = find_all(func, NodeType.NODE_AFFECT)
+    assert [a.children[1].value for a in affects] == [2]
+
+
+def test_optimizer_dse_keeps_store_read_by_next_iteration():
+    func = optimize_text(
+        "int main() { int i; int last; int s; i = 0; while (i < 3) { s = s + last; last = i; i++; } return s; }"
+    )
+    stored = {a.children[0].index for a in find_all(func, NodeType.NODE_AFFECT)}
+    assert len(stored) == 3
+
+
+def test_optimizer_dse_keeps_stores_when_an_address_is_taken():
+    func = optimize_text("int main() { int a; int b; int *p; a = 1; b = 2; p = &a; return *(p - 1); }")
+    assert func.value == 3
+    assert len(find_all(func, NodeType.NODE_AFFECT)) == 3
+
+
+def test_optimizer_dce_keeps_an_emptied_then_branch_before_the_else_branch():
+    func = optimize_text("int main() { int a; int b; a = 3; b = 0; if (a > 1) { b = 5; } else { debug 7; } debug a; return 0; }", level="1")
+    (cond,) = find_all(func, NodeType.NODE_COND)
+    assert len(cond.children) == 3
+    assert cond.children[1].type == NodeType.NODE_BLOCK and not cond.children[1].children
+    assert find_all(cond.children[2], NodeType.NODE_DEBUG)
+
+
+def test_optimizer_dse_keeps_unused_slots_next_to_an_address():
+    # p[1] is the slot of b: removing b would make it the slot of a
+    func = optimize_text("int main() { int a; int b; int c; int *p; a = 1; c = 3; p = &c; p[1] = 7; debug p[1]; debug a; return 0; }")
+    assert func.value == 4
+
+
+def test_optimizer_level_zero_disables_every_pass():
+    opt = Optimizer(level="0")
+    expr = Node(NodeType.NODE_ADD, children=[Node(NodeType.NODE_CONST, value=1), Node(NodeType.NODE_CONST, value=2)])
+    assert opt.optimize_ast(expr) is expr
+    assert expr.type == NodeType.NODE_ADD
+    assert not opt.is_enabled("tailcall")
+
+
+def test_optimizer_pass_flags_apply_on_top_of_level():
+    opt = Optimizer(level="1", enable=["licm"], disable=["dse"])
+    assert opt.enabled == ["fold", "dce", "licm", "tailcall", "rotate", "jump", "stack", "frame", "peephole", "dfe"]
+    assert opt.pass_manager.names == ["fold", "dce", "licm"]
+
+
+def test_optimizer_unknown_pass_raises():
+    with pytest.raises(ValueError):
+        Optimizer(disable=["unroll-everything"])
+
+
+def test_optimizer_pass_manager_reruns_passes_until_fixed_point():
+    opt = Optimizer(level="1")
+    optimize_text_with(opt, "int main() { int a; a = 1 + 2; if (0) { debug a; } return 0; }")
+    stats = opt.pass_manager.stats
+    # dse removes the store, which lets fold/dce run again before everything settles
+    assert stats["dse"].changes > 0
+    assert stats["fold"].runs >= 2
+    assert stats["dce"].runs >= 2
+    assert "dse" in opt.pass_manager.report()
+
+
+def test_optimizer_verification_hook_reports_broken_pass():
+    opt = Optimizer(level="0", verify=True)
+
+    def broken(func: Node) -> int:
+        func.children[-1].add_child(Node(NodeType.NODE_BREAK))
+        return 1
+
+    opt.pass_manager.add("broken", broken)
+    with pytest.raises(CompilationError, match="after pass 'broken'"):
+        optimize_text_with(opt, "int main() { return 0; }")
+
+
+def optimize_text_with(opt: Optimizer, source: str) -> Node:
+    from yacc.lexer import Lexer
+    from yacc.parser import Parser
+    from yacc.sema import SemanticAnalyzer
+    from yacc.source import Source
+
+    parser = Parser(Lexer(Source.from_string(source)))
+    return opt.optimize_ast(SemanticAnalyzer().analyze(parser.parse()))
+
+
+def optimize_program(source: str, **options) -> list[Node]:
+    from yacc.lexer import Lexer
+    from yacc.parser import Parser
+    from yacc.sema import SemanticAnalyzer
+    from yacc.source import Source
+    from yacc.token import TokenType
+
+    lexer = Lexer(Source.from_string(source))
+    parser = Parser(lexer)
+    sema = SemanticAnalyzer()
+    opt = Optimizer(**options)
+    functions = []
+    while lexer.T.type != TokenType.TOK_EOF:
+        functions.append(opt.optimize_ast(sema.analyze(parser.parse())))
+    return functions
+
+
+def test_optimizer_eval_replaces_pure_call_with_constant():
+    *_, main = optimize_program(
+        "int square(int x) { return x * x; }"
+        "int fib(int n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); }"
+        "int main() { debug square(12); debug fib(20); return 0; }"
+    )
+    assert find_all(main, NodeType.NODE_CALL) == []
+    assert [d.children[0].value for d in find_all(main, NodeType.NODE_DEBUG)] == [144, 6765]
+
+
+def test_optimizer_eval_uses_c_truncation():
+    *_, main = optimize_program(
+        "int f(int a, int b) { return a / b * 10 + a % b; } int main() { return f(-7, 2); }"
+    )
+    assert find_all(main, NodeType.NODE_RETURN)[0].children[0].value == -31
+
+
+def test_optimizer_eval_keeps_calls_with_side_effects():
+    *_, main = optimize_program("int loud(int x) { debug x; return x; } int main() { return loud(3); }")
+    assert len(find_all(main, NodeType.NODE_CALL)) == 1
+
+
+def test_optimizer_eval_keeps_calls_exceeding_the_budget():
+    source = "int spin(int n) { int i; for (i = 0; i < n; i++) {} return i; } int main() { return spin(1000); }"
+    *_, main = optimize_program(source, eval_budget=500)
+    assert len(find_all(main, NodeType.NODE_CALL)) == 1
+    *_, main = optimize_program(source)
+    assert find_all(main, NodeType.NODE_RETURN)[0].children[0].value == 1000
+
+
+def test_optimizer_eval_keeps_overflowing_calls():
+    *_, main = optimize_program("int big(int x) { return x * x; } int main() { return big(100000); }")
+    assert len(find_all(main, NodeType.NODE_CALL)) == 1
+
+
+def analyze_program(source: str) -> list[Node]:
+    from yacc.lexer import Lexer
+    from yacc.parser import Parser
+    from yacc.sema import SemanticAnalyzer
+    from yacc.source import Source
+    from yacc.token import TokenType
+
+    lexer = Lexer(Source.from_string(source))
+    parser = Parser(lexer)
+    sema = SemanticAnalyzer()
+    program = []
+    while lexer.T.type != TokenType.TOK_EOF:
+        program.append(sema.analyze(parser.parse()))
+    return program
+
+
+def test_optimizer_whole_program_removes_unreachable_functions():
+    opt = Optimizer()
+    program = analyze_program(
+        "int dead(int x) { return leaf(x); }"
+        "int leaf(int x) { debug x; return x; }"
+        "int main() { return helper(1); }"
+        "int helper(int x) { debug x; return x; }"
+    )
+    kept = opt.optimize_program(program)
+    # 'helper' is only called through its clone for the argument 1
+    assert [f.repr for f in kept] == ["main", "helper$1"]
+    assert opt.removed_functions == ["dead", "leaf", "helper"]
+
+
+def test_optimizer_whole_program_evaluates_calls_to_later_functions():
+    opt = Optimizer()
+    kept = opt.optimize_program(analyze_program("int main() { return twice(21); } int twice(int x) { return 2 * x; }"))
+    # the only call was evaluated, so 'twice' is not reachable anymore
+    assert [f.repr for f in kept] == ["main"]
+    assert find_all(kept[0], NodeType.NODE_RETURN)[0].children[0].value == 42
+
+
+def test_optimizer_spec_clones_functions_for_constant_arguments():
+    opt = Optimizer()
+    kept = opt.optimize_program(analyze_program(
+        "int scale(int x, int k) { debug k; return x * k; }"
+        "int run(int a) { debug scale(a, 4) + scale(a, 4) + scale(a, 3) + scale(a, a); return 0; }"
+    ))
+    assert [f.repr for f in kept] == ["scale", "scale$_$4", "scale$_$3", "run"]
+    assert opt.specialized_functions == ["scale$_$4", "scale$_$3"]
+    clone = kept[1]
+    # the constant parameter is gone, and folded into the body
+    assert [p.repr for p in clone.children[:-1]] == ["x"]
+    assert [d.children[0].value for d in find_all(clone, NodeType.NODE_DEBUG)] == [4]
+    assert find_all(clone, NodeType.NODE_MUL)[0].children[1].value == 4
+    calls = find_all(kept[3], NodeType.NODE_CALL)
+    assert [(c.children[0].repr, len(c.children) - 1) for c in calls] == [
+        ("scale$_$4", 1), ("scale$_$4", 1), ("scale$_$3", 1), ("scale", 2),
+    ]
+
+
+def test_optimizer_spec_skips_written_parameters_and_respects_budget():
+    source = (
+        "int down(int n) { while (n > 0) { debug n; n = n - 1; } return 0; }"
+        "int f(int x, int k) { debug x; return k; }"
+        "int run(int a) { debug down(4) + f(a, 1) + f(a, 2) + f(a, 3); return 0; }"
+    )
+    opt = Optimizer(spec_max_clones=2)
+    kept = opt.optimize_program(analyze_program(source))
+    assert opt.specialized_functions == ["f$_$1", "f$_$2"]
+    assert "f" in [f.repr for f in kept]
+    opt = Optimizer(disable=["spec"])
+    opt.optimize_program(analyze_program(source))
+    assert opt.specialized_functions == []
+
+
+def test_optimizer_whole_program_keeps_everything_without_main():
+    opt = Optimizer()
+    kept = opt.optimize_program(analyze_program("int f() { return 1; } int g() { return 2; }"))
+    assert [f.repr for f in kept] == ["f", "g"]
+    assert opt.removed_functions == []
+
+
+def test_optimizer_unroll_fully_unrolls_small_counted_loop():
+    func = optimize_text("int main() { int i; for (i = 0; i < 4; i++) { debug i * 10; } return 0; }")
+    assert find_all(func, NodeType.NODE_LOOP) == []
+    assert [d.children[0].value for d in find_all(func, NodeType.NODE_DEBUG)] == [0, 10, 20, 30]
+
+
+def test_optimizer_unroll_partially_unrolls_large_loop():
+    func = optimize_text(
+        "int main() { int i; int s; s = 0; for (i = 0; i < 10; i++) { s = s + i; } return s; }",
+        unroll_factor=4,
+        unroll_max_size=48,
+    )
+    loop = find_all(func, NodeType.NODE_LOOP)[0]
+    test = loop.children[0].children[0]
+    # 2 iterations of 4 copies, then 2 straight-line copies for i = 8 and i = 9
+    assert test.type == NodeType.NODE_NOT_EQ and test.children[1].value == 8
+    increment = loop.children[0].children[1].children[-1].children[0]
+    assert increment.children[1].children[1].value == 4
+    body_affects = find_all(loop, NodeType.NODE_AFFECT)
+    assert len(body_affects) == 5
+    remainder = [
+        a.children[1].children[1].value for a in find_all(func, NodeType.NODE_AFFECT)
+        if a not in body_affects and a.children[1].type == NodeType.NODE_ADD
+    ]
+    assert remainder == [8, 9]
+
+
+def test_optimizer_unroll_skips_loops_with_break():
+    func = optimize_text(
+        "int main() { int i; for (i = 0; i < 4; i++) { if (i == 2) break; debug i; } return 0; }"
+    )
+    assert len(find_all(func, NodeType.NODE_LOOP)) == 1
+
+
+def test_optimizer_unroll_respects_size_cap():
+    func = optimize_text(
+        "int main() { int i; for (i = 0; i < 100; i++) { debug i; } return 0; }",
+        unroll_max_size=3,
+    )
+    loop = find_all(func, NodeType.NODE_LOOP)[0]
+    assert loop.children[0].children[0].type == NodeType.NODE_LOWER
+
+
+def test_profile_instrumentation_counts_functions_loops_and_branches():
+    from yacc.passes.profile import ProfileInstrumentation
+
+    instrumentation = ProfileInstrumentation()
+    opt = Optimizer(level="0")
+    opt.instrumentation = instrumentation
+    func = optimize_text_with(opt, "int main() { int i; i = 0; while (i < 3) { if (i == 1) debug i; i = i + 1; } return 0; }")
+    # main, the loop, both branches of the loop condition and of the `if` (with an added else)
+    assert instrumentation.counters == 6
+    increments = [a for a in find_all(func, NodeType.NODE_AFFECT) if a.children[0].type == NodeType.NODE_DEREF]
+    assert len(increments) == 6
+    from yacc.asm import Assembly
+
+    asm = [*instrumentation.exit(Assembly.parse([".start", "prep main", "call 0", "halt"])).lines(), *instrumentation.output().lines()]
+    assert asm[3] == "jump $profile" and asm[-1] == "halt" and asm.count("dbg") == 7
+
+
+def test_profile_annotates_sites_and_rejects_mismatches():
+    from yacc.passes.profile import Profile
+
+    profile = Profile.parse("1\n2\nyacc-profile\n6\n1\n4\n3\n1\n1\n2\n")
+    func = optimize_text(
+        "int main() { int i; i = 0; while (i < 3) { if (i == 1) debug i; i = i + 1; } return 0; }",
+        level="0",
+        profile=profile,
+    )
+    assert func.counts == (1,)
+    assert find_all(func, NodeType.NODE_LOOP)[0].counts == (4,)
+    assert [cond.counts for cond in find_all(func, NodeType.NODE_COND)] == [(3, 1), (1, 2)]
+    profile.check_complete()
+
+    with pytest.raises(CompilationError):
+        optimize_text("int f() { return 0; }", profile=Profile.parse("yacc-profile\n0\n"))
+    with pytest.raises(CompilationError):
+        Profile.parse("yacc-profile\n3\n1\n")
+
+
+def test_optimizer_unroll_uses_profile_counts():
+    from yacc.passes.profile import Profile
+
+    source = "int main() { int i; for (i = 0; i < 40; i++) { debug i; } return 0; }"
+    # without profile, 40 copies of the body do not fit in the budget
+    assert find_all(optimize_text(source, unroll_max_size=100, unroll_factor=1), NodeType.NODE_LOOP)
+    # hot loop: the budget is larger
+    hot = Profile.parse("yacc-profile\n4\n1\n41\n40\n1\n")
+    assert not find_all(optimize_text(source, unroll_max_size=100, unroll_factor=1, profile=hot), NodeType.NODE_LOOP)
+    # loop that never ran: not even partially unrolled
+    cold = Profile.parse("yacc-profile\n4\n1\n0\n0\n0\n")
+    loop = find_all(optimize_text(source, profile=cold), NodeType.NODE_LOOP)[0]
+    assert loop.children[0].children[0].type == NodeType.NODE_LOWER
+
+
+def test_optimizer_ivsr_replaces_indexed_addresses_with_a_pointer():
+    func = optimize_text(
+        "int sum(int *p, int n) { int i; int s; s = 0; for (i = 0; i < n; i++) { s = s + *(p - i); } return s; }",
+        enable=["ivsr"],
+    )
+    loop = find_all(func, NodeType.NODE_LOOP)[0]
+    deref = find_all(loop, NodeType.NODE_DEREF)[0]
+    pointer = deref.children[0]
+    assert pointer.type == NodeType.NODE_REF and pointer.repr.startswith("$ptr")
+    # the counter is not needed in the loop anymore: the test compares pointers
+    test = loop.children[0].children[0]
+    assert test.type == NodeType.NODE_GREATER and test.children[0].index == pointer.index
+    counter = 2
+    assert all(ref.index != counter for ref in find_all(loop, NodeType.NODE_REF))
+
+
+def test_optimizer_ivsr_skips_unprofitable_loops():
+    # the counter is also read by the multiplication: a pointer would cost an extra increment
+    func = optimize_text(
+        "int f(int *p, int n) { int i; int s; s = 0; for (i = 0; i < n; i++) { s = s + *(p + i) * i; } return s; }",
+        enable=["ivsr"],
+    )
+    add = find_all(func, NodeType.NODE_DEREF)[0].children[0]
+    assert add.type == NodeType.NODE_ADD and add.children[1].index == 2
+
+
+def test_optimizer_ivsr_only_reduces_dereferenced_addresses():
+    # n + i is a plain value: n + i < n + m would overflow for large n
+    func = optimize_text(
+        "int run(int n, int m) { int s; s = 0; for (int i = 0; i < m; i++) { debug(n + i); s = s + 1; } return s; }",
+        disable=["unroll"],
+    )
+    assert not any(ref.repr and ref.repr.startswith("$ptr") for ref in find_all(func, NodeType.NODE_REF))
+    assert find_all(func, NodeType.NODE_LOWER)[0].children[1].repr == "m"
+
+
+def test_optimizer_vrp_removes_branches_implied_by_enclosing_conditions():
+    func = optimize_text(
+        "int f(int n) { int i; int s; s = 0; for (i = 0; i < n; i++) { if (i >= 0) s = s + i; else s = s - 1; } "
+        "if (n > 10) { if (n > 5) return s; return 0; } return 1; }",
+        disable=["unroll", "ivsr"],
+    )
+    comparisons = find_all(func, NodeType.NODE_GREATER_EQ) + find_all(func, NodeType.NODE_GREATER)
+    assert [(c.children[0].repr, c.children[1].value) for c in comparisons] == [("n", 10)]
+    # the else branch of `i >= 0` is gone
+    assert not find_all(func, NodeType.NODE_SUB)
+
+
+def test_optimizer_vrp_keeps_comparisons_that_may_overflow():
+    # x + n wraps around for n > 0: the comparison is not always true
+    func = optimize_text(
+        "int f(int n) { int x; x = 2147483647; if (n >= 0) { x = x + n; if (x > 0) return 1; } return 0; }",
+        disable=["unroll"],
+    )
+    assert len(find_all(func, NodeType.NODE_GREATER)) == 1
+
+
+def test_optimizer_vrp_joins_ranges_at_continue():
+    # the body ends with `continue`: i still goes 1, 2, 3 and the loop exits
+    func = optimize_text(
+        "int f() { int i; int s; s = 0; for (i = 1; i <= 2; i = i + 1) { s = s + i; continue; } return s; }",
+        level="0",
+        enable=["vrp"],
+    )
+    assert len(find_all(func, NodeType.NODE_LOWER_EQ)) == 1
+
+
+def test_optimizer_vrp_does_not_trust_constants_out_of_the_int_range():
+    # 2147483647 + 1 is folded to 2147483648, which wraps around to INT_MIN in MSM
+    func = optimize_text(
+        "int f() { int y; y = 2147483647 + 1; if (y < 2147483647) return 1; return 0; }",
+        disable=["eval"],
+    )
+    assert len(find_all(func, NodeType.NODE_LOWER)) == 1
+
+
+def test_optimizer_vrp_divides_toward_zero():
+    # n / 2 is in [-3, 0] (not [-4, -1]): -1 / 2 is 0 in C
+    func = optimize_text(
+        "int f(int n) { int q; if (n < 0) { if (n > -8) { q = n / 2; if (q >= 0) return 1; } } return 0; }",
+        disable=["unroll"],
+    )
+    assert len(find_all(func, NodeType.NODE_GREATER_EQ)) == 1